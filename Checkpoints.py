@@ -0,0 +1,71 @@
+import time
+import logging
+import threading
+
+from peewee import *
+
+import Database
+
+log = logging.getLogger()
+
+
+class Checkpoint(Model):
+    name = CharField(unique=True)
+    value = IntegerField()
+
+    class Meta:
+        database = None
+
+
+class Checkpoints:
+    """
+    Persisted high-water marks (e.g. newest processed event created_at) by name.
+    advance() only moves a mark forward in memory, flush() writes the
+    changed ones. Marks are advanced from several threads.
+    """
+
+    def __init__(self, db_path='bot.sqlite', flush_interval=1.0):
+        self.db = SqliteDatabase(db_path, timeout=5, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+        })
+        Checkpoint._meta.database = self.db
+        self.db.connect(reuse_if_open=True)
+        Database.setup(self.db, [Checkpoint])
+
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.values = dict(Checkpoint.select(Checkpoint.name, Checkpoint.value).tuples())
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def advance(self, name, value) -> bool:
+        with self.lock:
+            if value is None or value <= self.values.get(name, value - 1):
+                return False
+            self.values[name] = value
+            self.dirty.add(name)
+            return True
+
+    def flush(self, force=False):
+        if not self.dirty or (not force and time.time() - self.last_flush < self.flush_interval):
+            return
+        with self.lock:
+            rows = [{'name': name, 'value': self.values[name]} for name in self.dirty]
+            self.dirty.clear()
+        try:
+            with self.db.atomic():
+                Checkpoint.insert_many(rows).on_conflict(conflict_target=[Checkpoint.name],
+                                                         preserve=[Checkpoint.value]).execute()
+        except Exception:
+            with self.lock:
+                self.dirty.update(row['name'] for row in rows)
+            raise
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush(force=True)
+        self.db.close()
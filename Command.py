@@ -0,0 +1,113 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+#  Single pass tokenizer, one alternative per token kind. Tokens start at a
+#  word boundary (first char checked before the boundary, cheaper), mentions
+#  and urls are consumed whole so their characters are not scanned one by one
+TOKENS = re.compile(r"""
+    (?=[lstxinh])\b
+    (?: (?P<side>long|short)\b(?:\s+(?P<amount>\d+)\b)?
+    | tp(?P<tp>\d+)\b
+    | x(?P<leverage>\d+)\b
+    | (?P<bolt11>lnbc\S+)
+    | (?P<lnurl>lnurl)
+    | (?P<invoice>invoice)
+    | (?:nostr:|npub1|https?://)\S+
+    )
+""", re.VERBOSE)
+
+#  status, balance and close must be the whole message (after mentions),
+#  "what's the status of btc?" or "close to the top" are not commands
+WORD = re.compile(r"\s*(?:(?:nostr:|npub1|@)\S+\s+)*(status|balance|close)(?:(?<=close)\s+all)?[\s.!?]*$")
+
+DEFAULT_LEVERAGE = 100
+
+#  Commands only accepted by DM
+DM_ONLY = ('withdraw', 'invoice', 'close')
+
+#  A content without any of these cannot hold a command, most chatter is
+#  rejected by these substring checks before the tokenizer runs
+NOTE_KEYWORDS = ('long', 'short', 'status', 'balance')
+DM_KEYWORDS = NOTE_KEYWORDS + ('lnurl', 'invoice', 'lnbc', 'close')
+
+
+@dataclass
+class Command:
+    """
+    kind is one of: trade, withdraw, invoice, status, balance, close
+    """
+    kind: str
+    side: Optional[str] = None
+    amount: Optional[int] = None
+    tp: int = 0
+    leverage: int = DEFAULT_LEVERAGE
+    withdraw_mode: Optional[str] = None
+    invoice: Optional[str] = None
+
+
+def parse(content: str, dm: bool = False) -> Optional[Command]:
+    """
+    Parse a note (or decrypted DM) content, return None if no valid command.
+    Precedence is trade > withdraw by lnurl > withdraw by invoice > bolt11 invoice
+    > status, balance or close (alone in the message).
+    """
+    content = content.lower()
+    for keyword in DM_KEYWORDS if dm else NOTE_KEYWORDS:
+        if keyword in content:
+            break
+    else:
+        return
+
+    sides = set()
+    amount = None
+    tp = None
+    leverage = None
+    bolt11 = None
+    lnurl = False
+    invoice = False
+
+    for side, number, tp_value, leverage_value, bolt11_value, lnurl_value, invoice_value in TOKENS.findall(content):
+        if side:
+            sides.add(side)
+            if amount is None and number:
+                amount = int(number)
+        elif tp_value:
+            if tp is None:
+                tp = int(tp_value)
+        elif leverage_value:
+            if leverage is None:
+                leverage = int(leverage_value)
+        elif bolt11_value:
+            if bolt11 is None:
+                bolt11 = bolt11_value
+        elif lnurl_value:
+            lnurl = True
+        elif invoice_value:
+            invoice = True
+
+    if sides:
+        # ambiguous order
+        if len(sides) > 1:
+            return
+        return Command('trade',
+                       side=sides.pop(),
+                       amount=amount,
+                       tp=tp or 0,
+                       leverage=leverage if leverage is not None else DEFAULT_LEVERAGE)
+
+    if lnurl:
+        command = Command('withdraw', withdraw_mode='lnurl')
+    elif invoice:
+        command = Command('withdraw', withdraw_mode='invoice')
+    elif bolt11:
+        command = Command('invoice', invoice=bolt11)
+    else:
+        word = WORD.match(content)
+        if word is None:
+            return
+        command = Command(word.group(1))
+
+    if command.kind in DM_ONLY and not dm:
+        return
+    return command
@@ -0,0 +1,53 @@
+import logging
+
+log = logging.getLogger()
+
+
+def migration_order_indexes(db):
+    if 'order' not in db.get_tables():
+        return
+    for name, columns in (('order_deposit_id', 'deposit_id'), ('order_status', 'status'),
+                          ('order_lnm_id', 'lnm_id'), ('order_user_status', 'user, status')):
+        db.execute_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "order" ({columns})')
+
+
+def migration_user_profile_at(db):
+    if 'user' not in db.get_tables():
+        return
+    if 'profile_at' not in [column.name for column in db.get_columns('user')]:
+        db.execute_sql('ALTER TABLE "user" ADD COLUMN "profile_at" INTEGER')
+
+
+def migration_order_created_at(db):
+    if 'order' not in db.get_tables():
+        return
+    if 'created_at' not in [column.name for column in db.get_columns('order')]:
+        db.execute_sql('ALTER TABLE "order" ADD COLUMN "created_at" INTEGER')
+
+
+#  Schema migrations of bot.sqlite (orders, users, checkpoints), MIGRATIONS[n]
+#  upgrade a db from user_version n to n + 1. Tables created by a later
+#  store may not exist yet, migrations skip them.
+MIGRATIONS = [
+    migration_order_indexes,
+    migration_user_profile_at,
+    migration_order_created_at,
+]
+
+
+def setup(db, models):
+    """
+    Create the missing tables of models, then run the pending migrations.
+    A db without any table is new: created up to date, nothing to migrate.
+    """
+    new = not db.get_tables()
+    db.create_tables(models, safe=True)
+    if new:
+        db.pragma('user_version', len(MIGRATIONS))
+        return
+    version = db.pragma('user_version')
+    for i in range(version, len(MIGRATIONS)):
+        log.info(f"[Database] migrate db schema to version {i + 1}")
+        with db.atomic():
+            MIGRATIONS[i](db)
+            db.pragma('user_version', i + 1)
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import threading
+
+from peewee import *
+
+log = logging.getLogger()
+
+
+class SeenEvent(Model):
+    event_id = CharField(unique=True)
+    prefix = BigIntegerField(index=True)
+    seen_at = IntegerField(index=True)
+
+    class Meta:
+        database = None
+
+
+class History:
+    """
+    Store of already processed event ids.
+    Lookups hit an in-memory set of 64 bits id prefixes, the sqlite table
+    is only queried to confirm a prefix match, appends are buffered and
+    written by batch. Compaction can run from another thread.
+    """
+
+    def __init__(self, db_path='history.sqlite', legacy_path='history', batch_size=32, flush_interval=1.0):
+        self.db = SqliteDatabase(db_path, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+        })
+        SeenEvent._meta.database = self.db
+        self.db.connect(reuse_if_open=True)
+        self.db.create_tables([SeenEvent], safe=True)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+
+        self.prefixes = set()
+        for (prefix,) in SeenEvent.select(SeenEvent.prefix).tuples().iterator():
+            self.prefixes.add(prefix)
+
+        if legacy_path and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+
+        log.info(f"[History] {len(self.prefixes)} events loaded")
+
+    @staticmethod
+    def to_prefix(event_id: str) -> int:
+        # signed 64 bits to fit in sqlite INTEGER
+        prefix = int(event_id[:16], 16)
+        if prefix >= 1 << 63:
+            prefix -= 1 << 64
+        return prefix
+
+    def __contains__(self, event_id: str) -> bool:
+        prefix = self.to_prefix(event_id)
+        with self.lock:
+            if prefix not in self.prefixes:
+                return False
+            if event_id in (i[0] for i in self.pending):
+                return True
+            return SeenEvent.select().where(SeenEvent.event_id == event_id).exists()
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def add(self, event_id: str):
+        with self.lock:
+            self.prefixes.add(self.to_prefix(event_id))
+            self.pending.append((event_id, self.to_prefix(event_id), int(time.time())))
+            if (len(self.pending) >= self.batch_size) or (time.time() - self.last_flush > self.flush_interval):
+                self.flush()
+
+    def seen(self, event_id: str) -> bool:
+        """
+        Return True if event_id already processed, otherwise record it and return False.
+        """
+        with self.lock:
+            if event_id in self:
+                return True
+            self.add(event_id)
+            return False
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.time()
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            with self.db.atomic():
+                for i in range(0, len(pending), 500):
+                    SeenEvent.insert_many(pending[i:i + 500],
+                                          fields=[SeenEvent.event_id, SeenEvent.prefix, SeenEvent.seen_at]
+                                          ).on_conflict_ignore().execute()
+
+    def compact(self, ttl=30 * 24 * 3600):
+        """
+        Forget events seen more than ttl seconds ago.
+        """
+        limit = int(time.time()) - ttl
+        with self.lock:
+            self.flush()
+            deleted = SeenEvent.delete().where(SeenEvent.seen_at < limit).execute()
+            if deleted:
+                self.prefixes = set()
+                for (prefix,) in SeenEvent.select(SeenEvent.prefix).tuples().iterator():
+                    self.prefixes.add(prefix)
+        log.info(f"[History] compact: {deleted} events removed")
+        return deleted
+
+    def migrate(self, legacy_path):
+        """
+        One shot import of the legacy flat file, renamed to <legacy_path>.migrated on success.
+        """
+        log.info(f"[History] migrate events from {legacy_path}")
+        now = int(time.time())
+        with open(legacy_path, 'r') as file:
+            for line in file:
+                event_id = line.strip()
+                if len(event_id) < 16:
+                    continue
+                self.prefixes.add(self.to_prefix(event_id))
+                self.pending.append((event_id, self.to_prefix(event_id), now))
+        self.flush()
+        os.rename(legacy_path, f"{legacy_path}.migrated")
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger()
+
+
+class Transport:
+    """
+    Pooled keep-alive HTTP session with default (connect, read) timeouts.
+    Only idempotent GET are retried. `base_url` replace scheme and host of
+    every request (local stand-ins).
+    """
+
+    def __init__(self, base_url=None, timeout=(5, 30), pool_size=8, retries=2):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.2, allowed_methods=frozenset(['GET']),
+                      status_forcelist=(502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.base_url:
+            parts = urlsplit(url)
+            url = self.base_url + url[len(f"{parts.scheme}://{parts.netloc}"):]
+        self.requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls (same key) into one in-flight call,
+    results are then cached `ttl` seconds.
+    Keys are strings or tuples, tuples are invalidated by their first item.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.cache = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.cached = 0
+
+    def do(self, key, function, ttl=None, valid=None):
+        """
+        Return function() result, shared with concurrent callers of the same key.
+        Results for which valid(result) is False are not cached.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                self.cached += 1
+                return entry[1]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+                self.requests += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = function()
+        except Exception as e:
+            with self.lock:
+                del self.calls[key]
+            call.set_exception(e)
+            raise
+        with self.lock:
+            if ttl > 0 and (valid is None or valid(result)):
+                self.cache[key] = (time.monotonic(), result)
+            del self.calls[key]
+        call.set_result(result)
+        return result
+
+    def invalidate(self, *names):
+        with self.lock:
+            for key in list(self.cache):
+                name = key[0] if type(key) is tuple else key
+                if name in names:
+                    del self.cache[key]
+
+    def forget(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'cached': self.cached,
+            'saved': self.coalesced + self.cached,
+        }
@@ -1,55 +1,169 @@
 import json
 import logging
 import math
+import time
+import threading
+from collections import namedtuple
 
 import bolt11
 from lnmarkets import rest
 import config
+from PriceFeed import PriceFeed
+from Http import Transport, SingleFlight
+from Metrics import metrics
 
 log = logging.getLogger()
 
+REQUESTS = metrics.histogram('rektbot_lnm_request_seconds', 'LNMarkets API call duration', ['call'])
+ERRORS = metrics.counter('rektbot_lnm_errors_total', 'LNMarkets API calls raising', ['call'])
+
+#  Fields of closed positions kept in cache
+ClosedPosition = namedtuple('ClosedPosition', ('id', 'side', 'exit_price', 'pl', 'opening_fee', 'closing_fee',
+                                               'sum_carry_fees', 'closed_ts'))
+
+
+class PooledLNMarketsRest(rest.LNMarketsRest):
+    """
+    LNMarketsRest sending its calls through `transport` (pooled keep-alive
+    session) instead of the lnmarkets.rest module-global requests.request().
+    """
+
+    def __init__(self, transport: Transport, **options):
+        rest.LNMarketsRest.__init__(self, **options)
+        self.transport = transport
+
+    def request_api(self, method, path, params, credentials=False, format='text'):
+        opts = self._request_options(method=method, path=path, params=params, credentials=credentials)
+        if method in ['GET', 'DELETE']:
+            response = self.transport.request(method, opts['ressource'], headers=opts['headers'])
+        else:
+            response = self.transport.request(method, opts['ressource'], headers=opts['headers'],
+                                              data=json.dumps(params, separators=(',', ':')))
+        if format == 'json':
+            return response.json()
+        return response.text
+
 
 class LNMarkets:
     
-    def __init__(self, key, secret, passphrase, fee=0.003):
+    def __init__(self, key, secret, passphrase, fee=0.003, checkpoints=None):
         options = {'key': key,
                    'secret': secret,
                    'passphrase': passphrase,
                    'network': 'mainnet'}
-        self.client = rest.LNMarketsRest(**options)
+        self.transport = Transport(base_url=getattr(config, 'lnm_base_url', None),
+                                   timeout=getattr(config, 'lnm_timeout', (5, 30)))
+        self.client = PooledLNMarketsRest(self.transport, **options)
+        # identical concurrent reads share one request
+        self.reads = SingleFlight(ttl=getattr(config, 'lnm_cache_ttl', 1.0))
+        # ids of running positions
         self.last_running_position = []
+        # lnm_id -> ClosedPosition of orders not settled yet, filled incrementally by sync_closed_positions()
+        self.closed_positions = {}
+        # cursor persisted in checkpoints (if any), a restart does not fetch the whole history again
+        self.checkpoints = checkpoints
+        self.closed_cursor = checkpoints.get('lnm_closed') if checkpoints is not None else None
+        self.closed_page_size = getattr(config, 'lnm_page_size', 1000)
+        # ms, positions closed just before the cursor can be indexed late
+        self.closed_overlap = 60 * 1000
+        # ms, a position can close before its order is recorded open
+        self.closed_grace = 60 * 1000
+        self.closed_lock = threading.Lock()
         self.fee = fee
-        
+        # payment_hash -> success, filled incrementally by sync_deposits()
+        self.deposits = {}
+        self.deposit_cursor = None
+        # ms, LNMarkets deposit invoices lifetime
+        self.deposit_expiry = getattr(config, 'lnm_deposit_expiry', 3600) * 1000
+        self.deposit_grace = 60 * 1000
+        self.price_feed = PriceFeed(self.fetch_price,
+                                    url=getattr(config, 'lnm_ws_url', 'wss://api.lnmarkets.com'),
+                                    max_age=getattr(config, 'price_max_age', 5.0))
+
+    def request(self, call, function, *args):
+        """
+        JSON API call, its duration is observed by call name.
+        """
+        with REQUESTS.time(call):
+            try:
+                return function(*args, format='json')
+            except Exception:
+                ERRORS.inc(call)
+                raise
+
     def deposit_invoice(self, amount):
-        ret = self.client.deposit({'amount': amount, }, format='json')
+        ret = self.request('deposit', self.client.deposit, {'amount': amount, })
+        self.reads.invalidate('deposits')
         
         if 'paymentRequest' in ret.keys():
             log.info(f"[LNMarkets] API process invoice")
-            log.log(15,f"[LNMarkets] Invoice: {ret['paymentRequest']}")
+            log.log(15, "[LNMarkets] Invoice: %s", ret['paymentRequest'])
             invoice = ret['paymentRequest']
             decoded_invoice = bolt11.decode(invoice)
             payment_hash = decoded_invoice.payment_hash
             return invoice, payment_hash
         else:
             log.info(f"[LNMarkets] API fail to make deposit invoice")
-            log.log(15,f"[LNMarkets] API returns {ret}")
+            log.log(15, "[LNMarkets] API returns %s", ret)
             return None
 
-    def deposit_history(self):
-        return self.client.deposit_history({}, format='json')
+    def deposit_history(self, since=None):
+        params = {}
+        if since is not None:
+            params['from'] = since
+        return self.reads.do(('deposits', since), lambda: self.request('deposit_history', self.client.deposit_history, params),
+                             valid=lambda ret: type(ret) is list)
 
-    def get_deposit_status(self, hash):
-        history = self.deposit_history()
+    def sync_deposits(self, hashes=()) -> bool:
+        """
+        Fetch deposits newer than the cursor and index those of `hashes`
+        (unpaid orders) by payment_hash, other entries are evicted.
+        The cursor only waits for a pending deposit of `hashes` (or a just
+        made one, its order may not be unpaid yet) until its invoice
+        expires, an abandoned deposit never settles.
+        """
+        history = self.deposit_history(self.deposit_cursor)
         if type(history) is not list:
-            return
+            return False
+
+        watched = set(hashes)
+        now = int(time.time() * 1000)
+        expired_before = now - self.deposit_expiry
+        recent_after = now - self.deposit_grace
+        newest = self.deposit_cursor
+        pending = None
         for i in history:
-            if type(i) is not dict:
-                return
-            elif 'payment_hash' in i.keys():
-                if i['payment_hash'] == hash:
-                    return i['success']
+            if type(i) is not dict or 'payment_hash' not in i.keys():
+                continue
+            ts = i.get('ts')
+            if ts is not None and (newest is None or ts > newest):
+                newest = ts
+            if i['payment_hash'] in watched:
+                self.deposits[i['payment_hash']] = i['success']
+            elif ts is None or ts <= recent_after:
+                continue
+            if not i['success'] and ts is not None and ts > expired_before and (pending is None or ts < pending):
+                pending = ts
+        for h in [h for h in self.deposits if h not in watched]:
+            del self.deposits[h]
 
-        return
+        self.deposit_cursor = pending if pending is not None else newest
+        log.log(15, "[LNMarkets] %s deposits fetched, cursor=%s", len(history), self.deposit_cursor)
+        return True
+
+    def get_deposit_statuses(self, hashes) -> dict:
+        """
+        One deposit history request for all hashes: {payment_hash: success or None}
+        """
+        if not self.sync_deposits(hashes):
+            return {}
+        return {h: self.deposits.get(h) for h in hashes}
+
+    def get_deposit_status(self, hash):
+        return self.get_deposit_statuses([hash]).get(hash)
+
+    def forget_deposit(self, hash):
+        self.deposits.pop(hash, None)
 
     def open_long(self, margin, leverage):
         return self.open_market_position('long', margin, leverage)
@@ -57,29 +171,31 @@ class LNMarkets:
     def open_short(self, margin, leverage):
         return self.open_market_position('short', margin, leverage)
 
-    def estimate_dollar_value(self, amount: int, leverage: int):
+    def estimate_dollar_value(self, amount: int, leverage: int, price=None):
         """
         :param amount: sats
         :param leverage: min 1 max 100
+        :param price: price snapshot, fetched if None
         :return: Dollar value of the position
         """
-        price = self.get_price()
+        if price is None:
+            price = self.get_price()
         fee = math.ceil(amount * leverage * self.fee)
         margin = amount - fee
         dollar_value = margin * leverage / (100 * 1000 * 1000) * price
         return dollar_value, margin, price
 
-    def estimate_fee(self, amount, leverage):
-        dollar_value, _, price = self.estimate_dollar_value(amount, leverage)
+    def estimate_fee(self, amount, leverage, price=None):
+        dollar_value, _, price = self.estimate_dollar_value(amount, leverage, price)
         dollar_value = math.floor(dollar_value)
         trade_amount = math.ceil((dollar_value / price) * 100*1000*1000)
         fee = trade_amount * self.fee
         margin = amount - fee
         return fee, margin, trade_amount
 
-    def open_market_position(self, side, margin, leverage=100, tp=None):
+    def open_market_position(self, side, margin, leverage=100, tp=None, price=None):
         # TODO add safety SL
-        log.log(15, f"open_market_position({side=}, {margin=}, {leverage=}, {tp=})")
+        log.log(15, "open_market_position(side=%r, margin=%r, leverage=%r, tp=%r, price=%r)", side, margin, leverage, tp, price)
         if side == 'long':
             side = 'b'
         elif side == 'short':
@@ -87,7 +203,7 @@ class LNMarkets:
         else:
             return
 
-        fee, margin, trade_amount = self.estimate_fee(margin, leverage)
+        fee, margin, trade_amount = self.estimate_fee(margin, leverage, price)
 
         params = {
             'type': 'm',
@@ -99,8 +215,9 @@ class LNMarkets:
         if tp:
             params['takeprofit'] = tp
 
-        ret = self.client.futures_new_position(params, format='json')
-        log.log(15, f"LNM open position answer: {ret}")
+        ret = self.request('new_position', self.client.futures_new_position, params)
+        self.reads.invalidate('running', 'user')
+        log.log(15, "LNM open position answer: %s", ret)
         if 'code' in ret.keys():
             return
 
@@ -116,33 +233,130 @@ class LNMarkets:
         }
         return out
 
+    def close_position(self, lnm_id) -> bool:
+        log.log(15, "close_position(lnm_id=%r)", lnm_id)
+        ret = self.request('close_position', self.client.futures_close_position, {'id': lnm_id})
+        self.reads.invalidate('running', 'user')
+        log.log(15, "LNM close position answer: %s", ret)
+        if type(ret) is not dict or 'code' in ret.keys():
+            return False
+        return True
+
     def get_running_positions(self):
-        positions = []
-        ret = self.client.futures_get_positions({'type': 'running'}, format='json')
-        if type(ret) is list:
-            if len(ret) != len(self.last_running_position):
-                self.last_running_position = ret
-                log.log(15, f"LNM running position update: {ret}")
-            for i in ret:
-                positions.append(i['id'])
-        else:
-            return None
+        """
+        Return the ids of running positions, None if request fail.
+        """
+        def fetch():
+            ret = self.request('running_positions', self.client.futures_get_positions, {'type': 'running'})
+            if type(ret) is not list:
+                return None
+            return [i['id'] for i in ret]
 
+        positions = self.reads.do('running', fetch, valid=lambda ret: ret is not None)
+        if positions is None:
+            return None
+        if len(positions) != len(self.last_running_position):
+            self.last_running_position = positions
+            log.log(15, "LNM running position update: %s", positions)
         return positions
 
-    def get_closed_positions(self):
-        positions = {}
-        ret = self.client.futures_get_positions({'type': 'closed'}, format='json')
-        for i in ret:
-            positions[i['id']] = i
+    def fetch_closed_positions(self, since=None, until=None, limit=None):
+        params = {'type': 'closed'}
+        if since is not None:
+            params['from'] = since
+        if until is not None:
+            params['to'] = until
+        if limit is not None:
+            params['limit'] = limit
+        return self.request('closed_positions', self.client.futures_get_positions, params)
 
-        return positions
+    def sync_closed_positions(self, lnm_ids=None, since=None) -> bool:
+        """
+        Fetch positions closed since the cursor, page by page, and index them by id.
+        Without cursor, the first sync starts at since (ms, oldest open order),
+        the whole history if None. If lnm_ids is given (positions of open
+        orders), other positions are evicted unless just closed.
+        """
+        with self.closed_lock:
+            if self.closed_cursor is not None:
+                since = self.closed_cursor - self.closed_overlap
+            until = None
+            # nothing fetched: everything up to the first sync start is known
+            newest = self.closed_cursor if self.closed_cursor is not None else since
+            fetched = 0
+            while True:
+                page = self.fetch_closed_positions(since, until, self.closed_page_size)
+                if type(page) is not list:
+                    return False
+                fetched += len(page)
+                for i in page:
+                    if type(i) is not dict or 'id' not in i.keys():
+                        continue
+                    self.closed_positions[i['id']] = ClosedPosition(*(i.get(k) for k in ClosedPosition._fields))
+                    ts = i.get('closed_ts')
+                    if ts is not None and (newest is None or ts > newest):
+                        newest = ts
+                if len(page) < self.closed_page_size:
+                    break
+                # next page start at the end of this one, whatever the sort order
+                first, last = page[0].get('closed_ts'), page[-1].get('closed_ts')
+                if first is None or last is None:
+                    break
+                if first <= last:
+                    if last == since:
+                        break
+                    since = last
+                else:
+                    if last == until:
+                        break
+                    until = last
+            self.closed_cursor = newest
+            if lnm_ids is not None:
+                watched = set(lnm_ids)
+                recent_after = int(time.time() * 1000) - self.closed_grace
+                for lnm_id, position in list(self.closed_positions.items()):
+                    if lnm_id not in watched and (position.closed_ts or 0) <= recent_after:
+                        del self.closed_positions[lnm_id]
+            if self.checkpoints is not None:
+                # never past a cached (not yet settled) position, it is fetched again after a restart
+                mark = min((p.closed_ts for p in self.closed_positions.values() if p.closed_ts is not None),
+                           default=newest)
+                self.checkpoints.advance('lnm_closed', mark)
+            log.log(15, "[LNMarkets] %s closed positions fetched, cursor=%s", fetched, self.closed_cursor)
+            return True
+
+    def get_closed_position(self, lnm_id):
+        """
+        Return closed position lnm_id, None if not (yet) closed or request fail.
+        """
+        if lnm_id not in self.closed_positions:
+            self.sync_closed_positions()
+        return self.closed_positions.get(lnm_id)
 
-    def get_price(self):
-        return float(self.client.futures_get_ticker(format='json')['lastPrice'])
+    def forget_closed_position(self, lnm_id):
+        self.closed_positions.pop(lnm_id, None)
+
+    def get_closed_positions(self, lnm_ids, since=None) -> dict:
+        """
+        {lnm_id: ClosedPosition} of lnm_ids (open orders) already closed,
+        one incremental sync if some are not cached. since (ms) bounds the
+        first sync, see sync_closed_positions().
+        """
+        lnm_ids = list(lnm_ids)
+        if any(lnm_id not in self.closed_positions for lnm_id in lnm_ids):
+            self.sync_closed_positions(lnm_ids, since)
+        return {lnm_id: self.closed_positions[lnm_id] for lnm_id in lnm_ids if lnm_id in self.closed_positions}
+
+    def fetch_price(self):
+        ret = self.reads.do('ticker', lambda: self.request('ticker', self.client.futures_get_ticker))
+        return float(ret['lastPrice'])
+
+    def get_price(self, max_age=None):
+        return self.price_feed.get(max_age)
 
     def get_free_balance(self):
-        ret = self.client.get_user(format='json')
+        ret = self.reads.do('user', lambda: self.request('user', self.client.get_user),
+                            valid=lambda ret: type(ret) is dict and 'balance' in ret)
         if 'balance' in ret.keys():
             return int(ret['balance'])
         return
@@ -158,12 +372,13 @@ class LNMarkets:
             return max_amount
 
     def withdraw(self, invoice, amount):
-        log.log(15, f"[LNM]withdraw({invoice=}, {amount=})")
-        ret = self.client.withdraw({
+        log.log(15, "[LNM]withdraw(invoice=%r, amount=%r)", invoice, amount)
+        ret = self.request('withdraw', self.client.withdraw, {
                         'amount': amount,
                         'invoice': invoice
-                      }, format='json')
-        log.log(15, f"[LNM] answer: {ret}")
+                      })
+        self.reads.invalidate('user')
+        log.log(15, "[LNM] answer: %s", ret)
 
         if type(ret) is not dict:
             return False
@@ -172,3 +387,10 @@ class LNMarkets:
         else:
             return False
 
+    def stats(self) -> dict:
+        """
+        HTTP requests sent and read requests saved by coalescing/caching.
+        """
+        stats = self.reads.stats()
+        stats['http_requests'] = self.transport.requests
+        return stats
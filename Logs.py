@@ -0,0 +1,79 @@
+import json
+import queue
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, thread, message (and exc).
+    """
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process listener: the message is merged in the
+    calling thread (args may change later), formatting and I/O are left to
+    the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def file_handler(path, max_bytes=None, when=None, backup_count=5):
+    """
+    Rotate by size if max_bytes, by time if `when` ('midnight', 'H'...), else never.
+    """
+    if max_bytes:
+        return logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                    encoding='utf-8')
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count,
+                                                         encoding='utf-8')
+    return logging.FileHandler(path, encoding='utf-8')
+
+
+def setup(path='rektBot.log', level=15, stream_level=logging.INFO, max_bytes=None, when=None,
+          backup_count=5, json_lines=False, logger=None) -> logging.handlers.QueueListener:
+    """
+    Route `logger` (root) records through a queue to a background writer
+    thread feeding the file and stream handlers. Records below `level` are
+    dropped before their message is built. Return the started listener,
+    stop() it to flush on exit.
+    """
+    logger = logger or logging.getLogger()
+    formatter = logging.Formatter(FORMAT)
+
+    to_file = file_handler(path, max_bytes, when, backup_count)
+    to_file.setLevel(level)
+    to_file.setFormatter(JsonFormatter() if json_lines else formatter)
+
+    to_stream = logging.StreamHandler()
+    to_stream.setLevel(stream_level)
+    to_stream.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, to_file, to_stream, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(LocalQueueHandler(records))
+    logger.setLevel(min(level, stream_level))
+    listener.start()
+    return listener
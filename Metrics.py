@@ -0,0 +1,279 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger()
+
+#  seconds, from local SQLite writes to slow payments
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+NULL_TIMER = nullcontext()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self) -> list:
+        """
+        [(suffix, labels, extra label, value)] in Prometheus exposition order.
+        """
+        with self.lock:
+            return [('', labels, None, value) for labels, value in self.values.items()]
+
+    def format_labels(self, values, extra=None) -> str:
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, value=1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    """
+    Set explicitly, or computed by `function` when collected,
+    function returns {labels tuple: value}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, labels=()):
+        Metric.__init__(self, registry, name, help, labels)
+        self.function = None
+
+    def set(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self) -> list:
+        if self.function is None:
+            return Metric.samples(self)
+        try:
+            values = self.function()
+        except Exception as e:
+            log.log(15, f"[Metrics] gauge {self.name} fail: {e}")
+            return []
+        return [('', labels, None, value) for labels, value in values.items()]
+
+
+class Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=BUCKETS):
+        Metric.__init__(self, registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # bucket counts (not cumulative), sum
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """
+        Context manager observing the duration of its block.
+        """
+        if not self.registry.enabled:
+            return NULL_TIMER
+        return Timer(self, labels)
+
+    def timed(self, *labels):
+        """
+        Decorator observing the duration of each call.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.registry.enabled:
+                    return function(*args, **kwargs)
+                with Timer(self, labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def samples(self) -> list:
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        out = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                out.append(('_bucket', labels, ('le', bound), cumulative))
+            out.append(('_sum', labels, None, total))
+            out.append(('_count', labels, None, cumulative))
+        return out
+
+    def summary(self, labels) -> dict:
+        """
+        Count, mean and p99 upper bound of one label set.
+        """
+        with self.lock:
+            counts, total = self.values[labels]
+            counts = list(counts)
+        count = sum(counts)
+        seen = 0
+        p99 = self.buckets[-1]
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= count * 0.99:
+                p99 = bound
+                break
+        return {'count': count, 'mean': total / count if count else 0.0, 'p99': p99}
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of the process. Disabled by default:
+    updates are then a single attribute check. start() enables them and
+    exposes /metrics (Prometheus text format) and/or a periodic log snapshot.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.stopped = threading.Event()
+
+    def register(self, cls, name, help, labels=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, help, labels, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self.register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS) -> Histogram:
+        return self.register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, extra, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{metric.format_labels(labels, extra)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> str:
+        """
+        One line summary: counters and gauges values, histograms count/mean/p99.
+        """
+        items = []
+        for metric in list(self.metrics.values()):
+            if metric.kind == 'histogram':
+                with metric.lock:
+                    label_sets = list(metric.values)
+                for labels in label_sets:
+                    s = metric.summary(labels)
+                    items.append(f"{metric.name}{metric.format_labels(labels)} n={s['count']} "
+                                 f"avg={s['mean'] * 1000:.1f}ms p99<={s['p99'] * 1000:g}ms")
+            else:
+                for _, labels, _, value in metric.samples():
+                    items.append(f"{metric.name}{metric.format_labels(labels)}={value:g}")
+        return ', '.join(items)
+
+    def start(self, port=None, host='127.0.0.1', log_interval=None):
+        """
+        Enable metrics if an endpoint port or a log interval is set.
+        """
+        if port is None and not log_interval:
+            return
+        self.enabled = True
+        self.stopped.clear()
+        if port is not None:
+            self.serve(host, port)
+        if log_interval:
+            threading.Thread(target=self.log_snapshots, args=(log_interval,), daemon=True, name='metrics-log').start()
+
+    def serve(self, host, port):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics-http').start()
+        log.info(f"[Metrics] serve http://{host}:{self.server.server_address[1]}/metrics")
+
+    def log_snapshots(self, interval):
+        while not self.stopped.wait(interval):
+            log.info(f"[Metrics] {self.snapshot()}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.enabled = False
+
+
+metrics = Registry()
@@ -0,0 +1,153 @@
+import os
+import base64
+import secrets
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives import padding
+from nostr.key import PrivateKey
+from nostr.event import EventKind
+
+log = logging.getLogger()
+
+
+class SharedSecrets:
+    """
+    LRU cache of ECDH shared secrets by counterparty pubkey,
+    evicted secrets are zeroized. Callers get their own copy, an
+    eviction by another thread never changes a key in use.
+    """
+
+    def __init__(self, private_key: PrivateKey, size=1024):
+        self.private_key = private_key
+        self.size = size
+        self.secrets = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pubkey: str) -> bytes:
+        with self.lock:
+            secret = self.secrets.get(pubkey)
+            if secret is not None:
+                self.secrets.move_to_end(pubkey)
+                self.hits += 1
+                return bytes(secret)
+        secret = self.private_key.compute_shared_secret(pubkey)
+        with self.lock:
+            self.misses += 1
+            self.secrets[pubkey] = bytearray(secret)
+            while len(self.secrets) > self.size:
+                _, evicted = self.secrets.popitem(last=False)
+                evicted[:] = bytes(len(evicted))
+        return bytes(secret)
+
+    def clear(self):
+        with self.lock:
+            for secret in self.secrets.values():
+                secret[:] = bytes(len(secret))
+            self.secrets.clear()
+
+
+#  Key and shared secrets of the current worker (thread pool workers share them)
+_private_key = None
+_secrets = None
+
+
+def init(raw_secret: bytes, cache_size=1024):
+    global _private_key, _secrets
+    _private_key = PrivateKey(raw_secret)
+    _secrets = SharedSecrets(_private_key, cache_size)
+
+
+def decrypt(content: str, pubkey: str) -> str:
+    # NIP-04: base64(aes-256-cbc(content))?iv=base64(iv)
+    encoded_content, encoded_iv = content.split('?iv=')
+    iv = base64.b64decode(encoded_iv)
+    cipher = Cipher(algorithms.AES(_secrets.get(pubkey)), modes.CBC(iv))
+    decryptor = cipher.decryptor()
+    decrypted = decryptor.update(base64.b64decode(encoded_content)) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return (unpadder.update(decrypted) + unpadder.finalize()).decode()
+
+
+def encrypt(content: str, pubkey: str) -> str:
+    padder = padding.PKCS7(128).padder()
+    padded = padder.update(content.encode()) + padder.finalize()
+    iv = secrets.token_bytes(16)
+    cipher = Cipher(algorithms.AES(_secrets.get(pubkey)), modes.CBC(iv))
+    encryptor = cipher.encryptor()
+    encrypted = encryptor.update(padded) + encryptor.finalize()
+    return f"{base64.b64encode(encrypted).decode()}?iv={base64.b64encode(iv).decode()}"
+
+
+def seal(event):
+    """
+    Encrypt (if DM) and sign event, return it.
+    """
+    if event.kind == EventKind.ENCRYPTED_DIRECT_MESSAGE and event.content is None:
+        event.content = encrypt(event.cleartext_content, event.recipient_pubkey)
+    _private_key.sign_event(event)
+    return event
+
+
+class OrderedDelivery:
+    """
+    Call callback(result) for submitted futures in submission order,
+    whatever the order they complete in.
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self.lock = threading.Lock()
+
+    def submit(self, future, callback):
+        with self.lock:
+            self.pending.append((future, callback))
+        future.add_done_callback(self.deliver)
+
+    def deliver(self, _=None):
+        while True:
+            with self.lock:
+                if not self.pending or not self.pending[0][0].done():
+                    return
+                future, callback = self.pending.popleft()
+            try:
+                callback(future.result())
+            except Exception as e:
+                log.exception(f"[Crypto] delivery fail: {e}")
+
+
+class CryptoPipeline:
+    """
+    Run NIP-04 decryption/encryption and event signing on a pool of
+    `workers` threads (mode='thread') or processes (mode='process').
+    """
+
+    def __init__(self, private_key: PrivateKey, workers=None, mode='thread', cache_size=1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        if mode == 'process':
+            self.executor = ProcessPoolExecutor(self.workers, initializer=init,
+                                                initargs=(private_key.raw_secret, cache_size))
+        else:
+            init(private_key.raw_secret, cache_size)
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='crypto')
+        self.replies = OrderedDelivery()
+
+    def decrypt(self, content: str, pubkey: str):
+        return self.executor.submit(decrypt, content, pubkey)
+
+    def encrypt(self, content: str, pubkey: str):
+        return self.executor.submit(encrypt, content, pubkey)
+
+    def seal(self, event):
+        return self.executor.submit(seal, event)
+
+    def shutdown(self):
+        self.executor.shutdown()
+        if self.mode != 'process':
+            _secrets.clear()
@@ -3,18 +3,38 @@ import os
 from typing import Union
 import logging
 import math
+import time
+import threading
 import bolt11
 
 from peewee import *
 
 from PySide6.QtCore import QObject, Signal
 
+import Database
+from Metrics import metrics
+
 log = logging.getLogger()
 
+QUERIES = metrics.histogram('rektbot_db_seconds', 'Orders SQLite statement duration', ['statement'])
+ORDERS = metrics.gauge('rektbot_orders', 'Orders by status', ['status'])
+
+
+class TimedSqliteDatabase(SqliteDatabase):
+    """
+    SqliteDatabase observing each statement duration by statement kind (SELECT, UPDATE...).
+    """
+
+    def execute_sql(self, sql, params=None):
+        if not metrics.enabled:
+            return SqliteDatabase.execute_sql(self, sql, params)
+        with QUERIES.time(sql.split(None, 1)[0].upper()):
+            return SqliteDatabase.execute_sql(self, sql, params)
+
 
 class Order(Model):
     order_id = CharField(unique=True)
-    deposit_id = CharField()
+    deposit_id = CharField(index=True)
     user = CharField()
     order_type = CharField()
     mode = CharField()
@@ -23,26 +43,59 @@ class Order(Model):
     leverage = IntegerField()
     trade_amount = IntegerField()
     margin = IntegerField()
-    status = CharField()
+    status = CharField(index=True)
     profit = IntegerField()
     invoice = CharField()
-    lnm_id = CharField()
+    lnm_id = CharField(index=True)
     tp = IntegerField(null=True)
     open_price = FloatField(null=True)
     close_price = FloatField(null=True)
     withdraw_type = CharField()
     withdraw_data = CharField()
+    # s, None for orders made before it was recorded
+    created_at = IntegerField(null=True)
 
     def __repr__(self):
         return f"Order({self.order_id=}, {self.deposit_id=}, {self.user=}, {self.order_type=}, {self.mode=}, {self.amount=}, {self.leverage=}," \
                f" {self.trade_amount=}, {self.margin=}, {self.status=}, {self.profit=}, {self.invoice=}, {self.lnm_id=}, {self.tp=}, {self.open_price=}," \
-               f" {self.close_price=}, {self.withdraw_type=}, {self.withdraw_data=} )"
+               f" {self.close_price=}, {self.withdraw_type=}, {self.withdraw_data=}, {self.created_at=} )"
 
     class Meta:
         database = None
+        indexes = (
+            (('user', 'status'), False),
+        )
 
 
 class OrderManager(QObject):
+    """
+    Order state machine: orders in an active status are kept in memory,
+    indexed by order_id, lnm_id, deposit_id, user and status. Transitions
+    are checked against TRANSITIONS and written through to the db (changed
+    columns only) before being applied in memory.
+    Orders reaching a terminal status are only kept in the db.
+    """
+    #  status -> allowed next statuses, statuses not listed here are terminal
+    TRANSITIONS = {
+        'new': ['unpaid', 'expired'],
+        'unpaid': ['paid', 'expired'],
+        'paid': ['funding', 'funded', 'funding_fail', 'open'],
+        'funding': ['funded', 'funding_fail'],
+        'funded': ['open', 'funding_fail'],
+        'open': ['closed'],
+        'closed': ['withdraw_requested', 'withdraw_pending', 'liquidated'],
+        'withdraw_requested': ['withdraw_pending', 'liquidated'],
+        'withdraw_pending': ['withdraw_done', 'withdraw_failed'],
+        'withdraw_failed': ['withdraw_requested', 'withdraw_pending', 'liquidated'],
+    }
+    #  Orders not yet withdrawn or lost
+    ACTIVE_STATUS = list(TRANSITIONS)
+    #  withdraw_requested orders wait for an invoice, withdraw_pending ones
+    #  are being paid and are not withdrawable again
+    WITHDRAWABLE_STATUS = ['closed', 'withdraw_failed', 'withdraw_requested']
+    #  Orders whose take profit can still be set
+    TP_STATUS = ['new', 'unpaid', 'paid', 'funding', 'funded']
+
     order_status_updated = Signal(object)
     order_status_new = Signal(object)
     order_status_unpaid = Signal(object)
@@ -62,14 +115,30 @@ class OrderManager(QObject):
     def __init__(self, db_path='bot.sqlite'):
         QObject.__init__(self)
 
-        self.db = SqliteDatabase(db_path)
+        self.db = TimedSqliteDatabase(db_path, timeout=5, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -16000,
+            'temp_store': 'memory',
+            'mmap_size': 64 * 1024 * 1024,
+        })
         Order._meta.database = self.db
 
-        if os.path.exists(db_path):
-            self.db.connect()
-        else:
-            self.db.connect()
-            self.db.create_tables([Order], safe=True)
+        self.db.connect(reuse_if_open=True)
+        Database.setup(self.db, [Order])
+
+        # transitions run in the Qt thread, pollers read from the scheduler threads
+        self.lock = threading.RLock()
+        self.active = {}
+        self.by_lnm_id = {}
+        self.by_deposit_id = {}
+        self.by_user = {}
+        self.by_status = {status: {} for status in self.ACTIVE_STATUS}
+        for order in Order.select().where(Order.status.in_(self.ACTIVE_STATUS)):
+            self.index(order)
+        log.info(f"[OrderManager] {len(self.active)} active orders loaded")
+        # computed on scrape/snapshot only
+        ORDERS.set_function(self.count_by_status)
 
     def dump_db(self):
         # orders = list(Order)
@@ -77,13 +146,92 @@ class OrderManager(QObject):
         for order in orders:
             print(json.dumps(order, indent=2))
 
+    def index(self, order):
+        if order.status not in self.by_status:
+            return
+        self.active[order.order_id] = order
+        self.by_status[order.status][order.order_id] = order
+        self.by_user.setdefault(order.user, {})[order.order_id] = order
+        if order.lnm_id:
+            self.by_lnm_id[order.lnm_id] = order
+        if order.deposit_id:
+            self.by_deposit_id[order.deposit_id] = order
+
+    def unindex(self, order):
+        if self.active.pop(order.order_id, None) is None:
+            return
+        self.by_status[order.status].pop(order.order_id, None)
+        user_orders = self.by_user.get(order.user)
+        if user_orders is not None:
+            user_orders.pop(order.order_id, None)
+            if not user_orders:
+                del self.by_user[order.user]
+        if order.lnm_id and self.by_lnm_id.get(order.lnm_id) is order:
+            del self.by_lnm_id[order.lnm_id]
+        if order.deposit_id and self.by_deposit_id.get(order.deposit_id) is order:
+            del self.by_deposit_id[order.deposit_id]
+
+    def allowed(self, order, to_status) -> bool:
+        if to_status in self.TRANSITIONS.get(order.status, ()):
+            return True
+        log.info(f"[OrderManager] order {order.order_id[:5]}_{order.order_id[-5:]} "
+                 f"cannot go from {order.status} to {to_status}")
+        return False
+
+    def write(self, updates):
+        """
+        Persist [(orders, fields)] in one transaction, then apply fields
+        to the in-memory orders and reindex them.
+        """
+        with self.db.atomic():
+            for orders, fields in updates:
+                ids = [order.id for order in orders]
+                for i in range(0, len(ids), 500):
+                    Order.update(**fields).where(Order.id.in_(ids[i:i + 500])).execute()
+        with self.lock:
+            for orders, fields in updates:
+                for order in orders:
+                    self.unindex(order)
+                    for name, value in fields.items():
+                        # same value as read back from the db
+                        setattr(order, name, Order._meta.fields[name].adapt(value))
+                    self.index(order)
+                    # in memory values are now the stored ones
+                    order._dirty.clear()
+
+    def move(self, order_id, to_status, **fields):
+        """
+        Single order transition, return the order, None if unknown or not allowed.
+        """
+        with self.lock:
+            order = self.active.get(order_id)
+        if order is None:
+            log.info(f"[OrderManager] no active order {order_id[:5]}_{order_id[-5:]} to set {to_status}")
+            return
+        if not self.allowed(order, to_status):
+            return
+        self.write([([order], dict(fields, status=to_status))])
+        return order
+
     def get_order_by_id(self, order_id) -> Union[Order | None]:
-        log.log(15, f"get_order_by_id({order_id=})")
+        log.log(15, "get_order_by_id(order_id=%r)", order_id)
+        with self.lock:
+            order = self.active.get(order_id)
+        if order is not None:
+            return order
         try:
             return Order.get(Order.order_id == order_id)
         except Order.DoesNotExist:
             return None
 
+    def get_order_by_lnm_id(self, lnm_id) -> Union[Order | None]:
+        with self.lock:
+            return self.by_lnm_id.get(lnm_id)
+
+    def get_order_by_deposit_id(self, deposit_id) -> Union[Order | None]:
+        with self.lock:
+            return self.by_deposit_id.get(deposit_id)
+
     def get_order_status(self, order_id) -> Union[str | None]:
         order = self.get_order_by_id(order_id)
         if order:
@@ -91,17 +239,35 @@ class OrderManager(QObject):
         else:
             return None
 
+    def count_by_status(self) -> dict:
+        query = Order.select(Order.status, fn.COUNT(Order.id)).group_by(Order.status)
+        return {(status,): count for status, count in query.tuples()}
+
+    def list_orders(self, status) -> list:
+        with self.lock:
+            return list(self.by_status[status].values())
+
     def list_unpaid_orders(self):
-        return Order.select().where(Order.status == 'unpaid')
+        return self.list_orders('unpaid')
 
     def list_funding_orders(self):
-        return Order.select().where(Order.status == 'funding')
+        return self.list_orders('funding')
 
     def list_open_orders(self):
-        return Order.select().where(Order.status == 'open')
+        return self.list_orders('open')
+
+    def list_user_orders(self, user, statuses) -> list:
+        if all(status in self.by_status for status in statuses):
+            with self.lock:
+                return [order for order in self.by_user.get(user, {}).values() if order.status in statuses]
+        return list(Order.select().where((Order.user == user) & (Order.status.in_(statuses))))
+
+    def get_user_balance(self, user) -> int:
+        balances = [order.amount + order.profit for order in self.list_user_orders(user, self.WITHDRAWABLE_STATUS)]
+        return sum(balance for balance in balances if balance > 0)
 
     def new_order(self, data):
-        log.log(15, f"new_order({data=})")
+        log.log(15, "new_order(data=%r)", data)
         order = Order(order_id=data['order_id'],
                       deposit_id='',
                       user=data['user'],
@@ -121,92 +287,82 @@ class OrderManager(QObject):
                       mode=data['mode'],
                       withdraw_type='',
                       withdraw_data='',
+                      created_at=int(time.time()),
                       )
+        with self.lock:
+            if order.order_id in self.active:
+                log.info(f"[OrderManager] order {order.order_id[:5]}_{order.order_id[-5:]} already exists")
+                return
         order.save()
+        with self.lock:
+            self.index(order)
         self.order_status_new.emit(order)
         self.order_status_updated.emit(order)
 
     def set_order_unpaid(self, data):
-        log.log(15, f"set_order_unpaid({data=})")
-        order_id = data['order_id']
-        invoice = data['invoice']
-        order = self.get_order_by_id(order_id)
-        order.invoice = invoice
-        order.status = 'unpaid'
+        log.log(15, "set_order_unpaid(data=%r)", data)
+        fields = {'invoice': data['invoice']}
         if 'hash' in data.keys():
-            order.deposit_id = data['hash']
-        order.save()
-        self.order_status_unpaid.emit(order)
-        self.order_status_updated.emit(order)
+            fields['deposit_id'] = data['hash']
+        order = self.move(data['order_id'], 'unpaid', **fields)
+        if order:
+            self.order_status_unpaid.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_paid(self, order_id):
-        log.log(15, f"set_order_paid({order_id=})")
-        order = self.get_order_by_id(order_id)
-        order.status = 'paid'
-        order.save()
-        self.order_status_paid.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "set_order_paid(order_id=%r)", order_id)
+        order = self.move(order_id, 'paid')
+        if order:
+            self.order_status_paid.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_expired(self, order_id):
-        log.log(15, f"set_order_expired({order_id=})")
-        order = self.get_order_by_id(order_id)
-        order.status = 'expired'
-        order.save()
-        self.order_status_expired.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "set_order_expired(order_id=%r)", order_id)
+        order = self.move(order_id, 'expired')
+        if order:
+            self.order_status_expired.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_funding(self, order_id):
-        log.log(15, f"set_order_funding({order_id=})")
-        order = self.get_order_by_id(order_id)
-        order.status = 'funding'
-        order.save()
-        self.order_status_funding.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "set_order_funding(order_id=%r)", order_id)
+        order = self.move(order_id, 'funding')
+        if order:
+            self.order_status_funding.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_funded(self, order_id):
-        log.log(15, f"set_order_funded({order_id=})")
-        order = self.get_order_by_id(order_id)
-        order.status = 'funded'
-        order.save()
-        self.order_status_funded.emit(order)
-        self.order_status_updated.emit(order)
-        
+        log.log(15, "set_order_funded(order_id=%r)", order_id)
+        order = self.move(order_id, 'funded')
+        if order:
+            self.order_status_funded.emit(order)
+            self.order_status_updated.emit(order)
+
     def set_order_funding_fail(self, order_id):
-        log.log(15, f"set_order_funding_fail({order_id=})")
-        order = self.get_order_by_id(order_id)
-        order.status = 'funding_fail'
-        order.save()
-        self.order_status_funding_fail.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "set_order_funding_fail(order_id=%r)", order_id)
+        order = self.move(order_id, 'funding_fail')
+        if order:
+            self.order_status_funding_fail.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_open(self, data):
-        log.log(15, f"set_order_open({data=})")
-        order_id = data['order_id']
-        price = data['price']
-        lnm_id = data['lnm_id']
-        fee = data['fee']
-        order = self.get_order_by_id(order_id)
-        order.status = 'open'
-        order.trade_amount = data['trade_amount']
-        order.margin = data['margin']
-        order.fee = fee
-        order.open_price = price
-        order.lnm_id = lnm_id
-        order.save()
-        self.order_status_open.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "set_order_open(data=%r)", data)
+        order = self.move(data['order_id'], 'open',
+                          trade_amount=data['trade_amount'],
+                          margin=data['margin'],
+                          fee=data['fee'],
+                          open_price=data['price'],
+                          lnm_id=data['lnm_id'])
+        if order:
+            self.order_status_open.emit(order)
+            self.order_status_updated.emit(order)
 
-    def set_order_close(self, data):
-        log.log(15, f"set_order_close({data=})")
-        order_id = data['order_id']
-        price = data['price']
-        order = self.get_order_by_id(order_id)
-        order.status = 'closed'
-        order.close_price = price
-        log.log(15, f"{order.amount=}, {order.trade_amount=}, {order.margin=}, {order.leverage=}, {order.fee=}")
+    def set_order_tp(self, order_id, tp):
+        self.transition([order_id], self.TP_STATUS, None, tp=tp)
 
-        profit_percent = (order.close_price / order.open_price) - 1
-        log.log(15, f"{order.close_price=}, {order.open_price=} {profit_percent=}")
+    @staticmethod
+    def close_profit(order, price) -> int:
+        profit_percent = (price / order.open_price) - 1
+        log.log(15, "price=%r, order.open_price=%r profit_percent=%r", price, order.open_price, profit_percent)
 
         if order.order_type == 'short':
             profit_percent = -profit_percent
@@ -214,37 +370,74 @@ class OrderManager(QObject):
         else:
             profit = math.ceil(order.trade_amount * profit_percent)
 
-        log.log(15, f"{profit=}")
-        fee = order.fee
-        order.profit = profit - fee
-        order.save()
-        self.order_status_close.emit(order)
-        self.order_status_updated.emit(order)
+        log.log(15, "profit=%r", profit)
+        return profit - order.fee
+
+    def transition(self, order_ids, from_status, to_status, fields_of=None, **fields) -> list:
+        """
+        Move active orders of order_ids having a status in from_status to
+        to_status (and set fields, plus fields_of(order) if given) in a single
+        transaction, return the updated orders. A None to_status only sets fields.
+        """
+        if type(from_status) is str:
+            from_status = [from_status]
+        order_ids = list(order_ids)
+        with self.lock:
+            orders = [self.active[order_id] for order_id in order_ids
+                      if order_id in self.active and self.active[order_id].status in from_status]
+        if to_status is not None:
+            orders = [order for order in orders if self.allowed(order, to_status)]
+            fields['status'] = to_status
+        if orders and fields_of is not None:
+            self.write([([order], dict(fields, **fields_of(order))) for order in orders])
+        elif orders:
+            self.write([(orders, fields)])
+        log.log(15, "transition %s -> %s: %s/%s orders", from_status, to_status, len(orders), len(order_ids))
+        return orders
+
+    def set_order_close(self, data):
+        self.set_orders_close([data])
+
+    def set_orders_close(self, data_list):
+        """
+        Settle several closed positions in one transaction.
+        """
+        log.log(15, "set_orders_close(data_list=%r)", data_list)
+        prices = {data['order_id']: data['price'] for data in data_list}
+
+        def settle(order):
+            price = prices[order.order_id]
+            return {'close_price': price, 'profit': self.close_profit(order, price)}
+
+        for order in self.transition(prices, 'open', 'closed', settle):
+            self.order_status_close.emit(order)
+            self.order_status_updated.emit(order)
 
     def set_order_withdraw_requested(self, data):
         log.info('Withdraw request')
-        log.log(15, f"set_order_withdraw_requested({data=})")
+        log.log(15, "set_order_withdraw_requested(data=%r)", data)
         withdraw_mode = data['withdraw_mode']
-        closed_orders = Order.select().where(
-            ((Order.status == 'closed') | (Order.status == 'withdraw_failed') | (Order.status == 'withdraw_requested'))
-            & (Order.user == data['user'])
-        )
+        user = data['user']
 
-        log.log(15, f"{closed_orders=}")
-
-        total_amount = 0
-        batch_list = []
-        for order in closed_orders:
-            log.log(15, f"{order.margin=}, {order.profit}")
-            balance = order.amount + order.profit
-            if balance > 0:
-                total_amount += balance
-                batch_list.append(order)
-                order.status = 'withdraw_requested'
-                order.save()
+        liquidated = []
+        requested = []
+        for order in self.list_user_orders(user, self.WITHDRAWABLE_STATUS):
+            if order.amount + order.profit <= 0:
+                liquidated.append(order.order_id)
             else:
-                order.status = 'liquidated'
-                order.save()
+                requested.append(order.order_id)
+        self.transition(liquidated, self.WITHDRAWABLE_STATUS, 'liquidated')
+        if withdraw_mode == 'lnurl':
+            # paid right away: only orders moved here are paid, a concurrent request gets none of them
+            batch_list = self.transition(requested, self.WITHDRAWABLE_STATUS, 'withdraw_pending')
+        else:
+            # prompt for all the orders waiting an invoice, paid once the invoice is received
+            self.transition(requested, ['closed', 'withdraw_failed'], 'withdraw_requested')
+            batch_list = self.list_user_orders(user, ['withdraw_requested'])
+
+        total_amount = sum([order.amount + order.profit for order in batch_list])
+        log.log(15, "%s orders, total_amount=%r", len(batch_list), total_amount)
+
         if len(batch_list) == 0:
             log.info('No closed orders')
             return
@@ -260,41 +453,31 @@ class OrderManager(QObject):
             self.order_withdraw_notify_amount.emit(data)
 
     def set_order_withdraw_done(self, data):
-        log.log(15, f"set_order_withdraw_done({data=})")
+        log.log(15, "set_order_withdraw_done(data=%r)", data)
         batch_list = data["batch_list"]
-        for order in batch_list:
-            order_id = order.order_id
-            order = self.get_order_by_id(order_id)
-            order.status = 'withdraw_done'
-            order.save()
+        self.transition([order.order_id for order in batch_list], 'withdraw_pending', 'withdraw_done')
         self.order_status_withdraw_done.emit(data)
 
     def set_order_status_withdraw_fail(self, data):
-        log.log(15, f"set_order_status_withdraw_fail({data=})")
-        order_id = data['order_id']
-        order = self.get_order_by_id(order_id)
-        order.status = 'withdraw_failed'
-        order.save()
-        self.order_status_withdraw_fail.emit(data)
+        log.log(15, "set_order_status_withdraw_fail(data=%r)", data)
+        self.set_orders_withdraw_fail([data['order_id']])
+
+    def set_orders_withdraw_fail(self, order_ids):
+        log.log(15, "set_orders_withdraw_fail(order_ids=%r)", order_ids)
+        for order in self.transition(order_ids, 'withdraw_pending', 'withdraw_failed'):
+            self.order_status_withdraw_fail.emit({'order_id': order.order_id, 'price': order.close_price})
 
     def set_order_withdraw_receive_invoice(self, data):
-        log.log(15, f"set_order_withdraw_receive_invoice({data=})")
+        log.log(15, "set_order_withdraw_receive_invoice(data=%r)", data)
         user = data['user']
         invoice = data['invoice']
         decoded_invoice = bolt11.decode(invoice)
-        amount = decoded_invoice.amount / 1000
-        orders = Order.select().where(
-            (Order.status == 'withdraw_requested')
-            & (Order.user == data['user'])
-        )
-        # orders = Order.objects.filter(status='withdraw_requested', user=user)
-        total_amount = 0
-        batch_list = []
-        for order in orders:
-            balance = order.amount + order.profit
-            if balance > 0:
-                total_amount += balance
-                batch_list.append(order)
+        amount = (decoded_invoice.amount_msat or 0) / 1000
+        batch_list = self.list_user_orders(user, ['withdraw_requested'])
+        if not batch_list:
+            log.info('No withdraw waiting an invoice')
+            return
+        total_amount = sum([order.amount + order.profit for order in batch_list])
         data = {
             'invoice': invoice,
             'batch_list': batch_list,
@@ -302,22 +485,27 @@ class OrderManager(QObject):
             'mode': 'invoice',
             'user': user,
         }
-
-        if total_amount == amount:
-            # send withdraw_request
-
-            self.order_status_withdraw_requested.emit(data)
-
-        else:
-            log.log(15, f"Wrong amout: {total_amount=} != {amount}")
+        if total_amount != amount:
+            log.log(15, "Wrong amout: total_amount=%r != %s", total_amount, amount)
             # Notify user that invoice don't match
             data['wrong_amount'] = True
             self.order_withdraw_notify_amount.emit(data)
+            return
+
+        # paid once: a duplicate invoice finds no order waiting anymore
+        data['batch_list'] = self.transition([order.order_id for order in batch_list], 'withdraw_requested',
+                                             'withdraw_pending')
+        if data['batch_list']:
+            self.order_status_withdraw_requested.emit(data)
 
     def del_order(self, order_id) -> bool:
         try:
             order = Order.get(Order.id == order_id)
             order.delete_instance()
+            with self.lock:
+                active = self.active.get(order.order_id)
+                if active is not None:
+                    self.unindex(active)
             self.order_status_deleted.emit(order)
             self.order_status_updated.emit(order)
             return True
@@ -325,4 +513,4 @@ class OrderManager(QObject):
             return False
 
     def close(self):
-        self.db.close()
\ No newline at end of file
+        self.db.close()
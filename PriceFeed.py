@@ -0,0 +1,103 @@
+import json
+import time
+import logging
+import secrets
+import threading
+
+import websocket
+
+log = logging.getLogger()
+
+
+class PriceFeed:
+    """
+    Latest LNMarkets futures price, pushed by the websocket ticker channel.
+    When the last price is older than max_age (websocket down or silent)
+    get() falls back to the REST `fetch` function.
+    """
+
+    def __init__(self, fetch, url='wss://api.lnmarkets.com', max_age=5.0,
+                 channel='futures:btc_usd:last-price'):
+        self.fetch = fetch
+        self.url = url
+        self.max_age = max_age
+        self.channel = channel
+
+        self.price = None
+        self.updated = 0.0
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+
+        self.ws = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name='price-feed')
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.ws:
+            self.ws.close()
+
+    def run(self):
+        backoff = 1
+        while self.running:
+            self.ws = websocket.WebSocketApp(self.url,
+                                             on_open=self.on_open,
+                                             on_message=self.on_message)
+            start = time.time()
+            self.ws.run_forever(ping_interval=20, ping_timeout=10)
+            if not self.running:
+                return
+            if time.time() - start > 60:
+                backoff = 1
+            log.log(15, "[PriceFeed] websocket closed, reconnect in %ss", backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def on_open(self, ws):
+        log.info(f"[PriceFeed] connected to {self.url}")
+        ws.send(json.dumps({
+            'jsonrpc': '2.0',
+            'method': 'v1/public/subscribe',
+            'id': secrets.token_hex(4),
+            'params': [self.channel],
+        }))
+
+    def on_message(self, ws, message):
+        try:
+            message = json.loads(message)
+            data = message['params']['data']
+            price = float(data['lastPrice'])
+        except (ValueError, KeyError, TypeError):
+            return
+        self.update(price)
+
+    def update(self, price: float):
+        with self.lock:
+            self.price = price
+            self.updated = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.updated
+
+    def get(self, max_age=None) -> float:
+        if max_age is None:
+            max_age = self.max_age
+        with self.lock:
+            if self.price is not None and self.age() <= max_age:
+                return self.price
+
+        # only one caller refresh from REST, others reuse its result
+        with self.fetch_lock:
+            with self.lock:
+                if self.price is not None and self.age() <= max_age:
+                    return self.price
+            price = self.fetch()
+            self.update(price)
+            return price
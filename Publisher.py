@@ -0,0 +1,141 @@
+import time
+import queue
+import logging
+import threading
+
+from Metrics import metrics
+
+log = logging.getLogger()
+
+PUBLISHED = metrics.counter('rektbot_publish_total', 'Messages published to relays by result', ['relay', 'result'])
+PUBLISH_DELAY = metrics.histogram('rektbot_publish_seconds', 'Queued -> sent to relay delay', ['relay'])
+
+
+class RelayQueue:
+    """
+    Bounded outbound buffer of one relay, drained by its own thread.
+    When the buffer is full the oldest message is dropped, a relay failing
+    repeatedly is marked `lagging` and retried less often.
+    """
+
+    def __init__(self, url, relay, size=256, max_retries=5):
+        self.url = url
+        self.relay = relay
+        self.queue = queue.Queue(maxsize=size)
+        self.max_retries = max_retries
+        self.sent = 0
+        self.dropped = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f"publish-{url}")
+        self.thread.start()
+
+    @property
+    def lagging(self) -> bool:
+        return self.consecutive_failures >= self.max_retries
+
+    def put(self, message: str):
+        item = (time.monotonic(), message)
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    PUBLISHED.inc(self.url, 'dropped')
+                except queue.Empty:
+                    pass
+
+    def send(self, message) -> bool:
+        if not getattr(self.relay, 'connected', True):
+            return False
+        try:
+            self.relay.publish(message)
+            return True
+        except Exception as e:
+            log.log(15, "[Publisher] %s send fail: %s", self.url, e)
+            return False
+
+    def run(self):
+        while True:
+            queued_at, message = self.queue.get()
+            backoff = 0.5
+            for attempt in range(self.max_retries + 1):
+                if self.send(message):
+                    delay = time.monotonic() - queued_at
+                    self.sent += 1
+                    self.consecutive_failures = 0
+                    # exponential moving average
+                    self.latency = 0.9 * self.latency + 0.1 * delay
+                    PUBLISHED.inc(self.url, 'sent')
+                    PUBLISH_DELAY.observe(delay, self.url)
+                    break
+                self.failures += 1
+                self.consecutive_failures += 1
+                PUBLISHED.inc(self.url, 'failure')
+                if self.lagging:
+                    # deprioritized: do not retry, next message will probe the relay
+                    self.dropped += 1
+                    PUBLISHED.inc(self.url, 'dropped')
+                    time.sleep(min(backoff * 2 ** self.max_retries, 30))
+                    break
+                time.sleep(backoff)
+                backoff *= 2
+            else:
+                self.dropped += 1
+                PUBLISHED.inc(self.url, 'dropped')
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'lagging': self.lagging,
+            'latency': round(self.latency, 4),
+        }
+
+
+class Publisher:
+    """
+    Outbound queue: events are sealed (encrypted/signed) by the crypto
+    pipeline then fanned out concurrently to the write relays of the pool.
+    """
+
+    def __init__(self, relay_manager, crypto, size=256, max_retries=5):
+        self.relay_manager = relay_manager
+        self.crypto = crypto
+        self.size = size
+        self.max_retries = max_retries
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def relay_queues(self) -> list:
+        with self.lock:
+            for url, relay in list(self.relay_manager.relays.items()):
+                if url not in self.queues or self.queues[url].relay is not relay:
+                    self.queues[url] = RelayQueue(url, relay, self.size, self.max_retries)
+            # best scored connected relays first
+            return [self.queues[relay.url] for relay in self.relay_manager.write_relays()]
+
+    def publish_message(self, message: str):
+        for relay_queue in self.relay_queues():
+            relay_queue.put(message)
+
+    def publish_event(self, event, callback=None):
+        """
+        Seal event in background, then publish it, events are published in submission order.
+        """
+        def publish(sealed):
+            self.publish_message(sealed.to_message())
+            if callback:
+                callback(sealed)
+
+        self.crypto.replies.submit(self.crypto.seal(event), publish)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {url: relay_queue.stats() for url, relay_queue in self.queues.items()}
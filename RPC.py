@@ -1,12 +1,160 @@
-import subprocess
+import os
 import json
+import queue
+import socket
 import logging
+import itertools
+import subprocess
+import threading
+import time
+
+import config
+from Metrics import metrics
 
 log = logging.getLogger()
 
+CALLS = metrics.histogram('rektbot_rpc_seconds', 'Core Lightning RPC call duration', ['method'])
+ERRORS = metrics.counter('rektbot_rpc_errors_total', 'Core Lightning RPC calls failing', ['method'])
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcConnection:
+    """
+    Single connection to the Core Lightning `lightning-rpc` unix socket.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.buffer = bytearray()
+
+    def send(self, request: dict):
+        self.sock.sendall(json.dumps(request).encode())
+
+    def receive(self, deadline) -> dict:
+        # lightningd terminates each response by an empty line
+        scanned = 0
+        while True:
+            end = self.buffer.find(b'\n\n', scanned)
+            if end >= 0:
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                scanned = 0
+                if data.strip():
+                    return json.loads(data)
+                continue
+            scanned = max(len(self.buffer) - 1, 0)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('RPC call timeout')
+            self.sock.settimeout(remaining)
+            data = self.sock.recv(65536)
+            if not data:
+                raise RpcError('Connection closed by lightningd')
+            self.buffer += data
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RpcPool:
+    """
+    Small pool of persistent connections, a connection is used by one call
+    (or one batch of calls) at a time.
+    """
+
+    def __init__(self, path, size=4, timeout=60):
+        self.path = os.path.expanduser(path)
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.semaphore = threading.BoundedSemaphore(size)
+        self.ids = itertools.count(1)
+
+    def acquire(self) -> RpcConnection:
+        if not self.semaphore.acquire(timeout=self.timeout):
+            raise RpcError('No RPC connection available')
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                return RpcConnection(self.path, self.timeout)
+            except OSError:
+                self.semaphore.release()
+                raise
+
+    def release(self, conn: RpcConnection, broken=False):
+        if broken:
+            conn.close()
+        else:
+            self.idle.put(conn)
+        self.semaphore.release()
+
+    def batch(self, calls: list, timeout=None) -> list:
+        """
+        Pipeline several (method, params) calls on one connection,
+        returns the responses in the calls order.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        conn = self.acquire()
+        try:
+            ids = []
+            for method, params in calls:
+                request_id = next(self.ids)
+                ids.append(request_id)
+                conn.send({
+                    'jsonrpc': '2.0',
+                    'id': request_id,
+                    'method': method,
+                    'params': params if params is not None else {},
+                })
+            responses = {}
+            while len(responses) < len(ids):
+                response = conn.receive(deadline)
+                responses[response.get('id')] = response
+        except (OSError, ValueError, RpcError):
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+        out = []
+        for request_id in ids:
+            response = responses[request_id]
+            if 'error' in response.keys():
+                out.append(response['error'])
+            else:
+                out.append(response['result'])
+        return out
+
+    def call(self, method: str, params=None, timeout=None):
+        return self.batch([(method, params)], timeout)[0]
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 
 class RPC:
 
+    cli_path = '/usr/bin/lightning-cli'
+    # label -> settled (paid/expired) status, those never change
+    invoice_cache = {}
+    cache_lock = threading.Lock()
+    pool = RpcPool(getattr(config, 'lightning_rpc', '~/.lightning/bitcoin/lightning-rpc'))
+
     @staticmethod
     def to_json(txt):
         return json.loads(txt)
@@ -18,28 +166,55 @@ class RPC:
         else:
             param = ''
 
-        command = f"/usr/bin/lightning-cli {command} {param}"
+        method = command
+        command = f"{RPC.cli_path} {command} {param}"
         # print(command)
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+        with CALLS.time(method):
+            result = subprocess.run(command, shell=True, capture_output=True, text=True)
         if result.stderr:
-            log.log(15, f"rpc_call fail with {command=}: {result.stderr=}")
+            ERRORS.inc(method)
+            log.log(15, "rpc_call fail with command=%r: result.stderr=%r", command, result.stderr)
             return RPC.to_json(result.stderr)
         else:
             return RPC.to_json(result.stdout)
 
+    @staticmethod
+    def call(method: str, params=None, timeout=None):
+        """
+        JSON-RPC call over the lightning-rpc socket, on failure returns
+        the error object like rpc_call() does with lightning-cli stderr.
+        """
+        try:
+            with CALLS.time(method):
+                return RPC.pool.call(method, params, timeout)
+        except (OSError, ValueError, RpcError) as e:
+            ERRORS.inc(method)
+            log.log(15, "call fail with method=%r: %s", method, e)
+            return {'code': -1, 'message': str(e)}
+
+    @staticmethod
+    def batch(calls: list, timeout=None) -> list:
+        try:
+            with CALLS.time('batch'):
+                return RPC.pool.batch(calls, timeout)
+        except (OSError, ValueError, RpcError) as e:
+            ERRORS.inc('batch')
+            log.log(15, "batch fail: %s", e)
+            return [{'code': -1, 'message': str(e)} for _ in calls]
+
     @staticmethod
     def pay_invoice(bolt11) -> bool:
         log.info(f"[Core Lightning RPC] try to pay Invoice")
-        log.log(15,f"[Core Lightning RPC] Invoice: {bolt11}")
-        out = RPC.rpc_call('pay', [bolt11])
-        log.log(15, f"[Core Lightning RPC] answer: {out}")
+        log.log(15, "[Core Lightning RPC] Invoice: %s", bolt11)
+        out = RPC.call('pay', {'bolt11': bolt11}, timeout=180)
+        log.log(15, "[Core Lightning RPC] answer: %s", out)
 
         if ('status' in out.keys()) and (out['status'] == 'complete'):
             log.info(f"[Core Lightning RPC] Invoice paid")
             return True
         else:
             log.info(f"[Core Lightning RPC] Fail to pay Invoice")
-            log.log(15,f"[Core Lightning RPC] {out}")
+            log.log(15, "[Core Lightning RPC] %s", out)
             return False
 
     @staticmethod
@@ -47,53 +222,87 @@ class RPC:
         if type(amount) == str:
             amount = int(amount)
 
-        if type(expiry) == int:
-            expiry = str(expiry)
-
         log.info(f"[Core Lightning RPC] Invoice")
-        log.log(15,f"Invoice: {amount=}, {label=}, {expiry=}")
-        out = RPC.rpc_call(command="invoice", param=[str(amount * 1000), label
-            , f"'rektBot: play with {amount} sats and you will be likely rekt!'", expiry])
+        log.log(15, "Invoice: amount=%r, label=%r, expiry=%r", amount, label, expiry)
+        out = RPC.call('invoice', {
+            'amount_msat': amount * 1000,
+            'label': label,
+            'description': f"rektBot: play with {amount} sats and you will be likely rekt!",
+            'expiry': int(expiry),
+        })
 
-        if type(out) == list:
-            print(out)
-        else:
-            # print(f"{out=}")
+        if 'bolt11' in out.keys():
             return out['bolt11']
+        else:
+            log.log(15, "[Core Lightning RPC] invoice fail: %s", out)
+
+    @staticmethod
+    def cache_invoice(invoice: dict):
+        if invoice['status'] in ('paid', 'expired'):
+            with RPC.cache_lock:
+                RPC.invoice_cache[invoice['label']] = invoice['status']
+
+    @staticmethod
+    def uncache_invoice(label):
+        with RPC.cache_lock:
+            RPC.invoice_cache.pop(label, None)
 
     @staticmethod
     def invoice_status(label) -> str:
-        invoices = RPC.list_invoices()
-        for i in invoices:
-            if i['label'] == label:
-                log.debug(f"Status: {i['status']}")
-                return i['status']
-        log.debug(f"Status: invoice_not_exist")
+        with RPC.cache_lock:
+            status = RPC.invoice_cache.get(label)
+        if status:
+            log.debug("Status: %s", status)
+            return status
+
+        invoice = RPC.get_invoice(label)
+        if invoice:
+            RPC.cache_invoice(invoice)
+            log.debug("Status: %s", invoice['status'])
+            return invoice['status']
+        log.debug("Status: invoice_not_exist")
         return 'invoice_not_exist'
 
+    @staticmethod
+    def get_invoice(label) -> dict:
+        out = RPC.call('listinvoices', {'label': label})
+        if 'invoices' in out.keys() and out['invoices']:
+            return out['invoices'][0]
+
     @staticmethod
     def list_invoices():
-        return RPC.rpc_call('listinvoices')['invoices']
+        return RPC.call('listinvoices')['invoices']
 
     @staticmethod
     def del_invoice(label, status):
         log.info(f"[Core Lightning RPC] Delete invoice {label[:5]}_{label[-5:]}")
-        return RPC.rpc_call('delinvoice', [label, status])
+        RPC.uncache_invoice(label)
+        return RPC.call('delinvoice', {'label': label, 'status': status})
+
+    @staticmethod
+    def del_invoices(invoices: list, chunk=100) -> int:
+        """
+        Delete invoices by pipelined batches of `delinvoice`, returns deleted count.
+        """
+        log.info(f"[Core Lightning RPC] Delete {len(invoices)} invoices")
+        deleted = 0
+        for i in range(0, len(invoices), chunk):
+            calls = [('delinvoice', {'label': invoice['label'], 'status': invoice['status']})
+                     for invoice in invoices[i:i + chunk]]
+            for invoice, out in zip(invoices[i:i + chunk], RPC.batch(calls)):
+                if 'label' in out.keys():
+                    RPC.uncache_invoice(invoice['label'])
+                    deleted += 1
+                else:
+                    log.log(15, "[Core Lightning RPC] delinvoice fail: %s", out)
+        return deleted
 
     @staticmethod
     def del_all_invoices():
         log.info(f"[Core Lightning RPC] Delete all invoices")
-        invoices = RPC.list_invoices()
+        return RPC.del_invoices(RPC.list_invoices())
 
-        for i in invoices['invoices']:
-            label = i['label']
-            status = i['status']
-            RPC.del_invoice(label, status)
-            
     @staticmethod
     def del_expired_invoices():
         log.info(f"[Core Lightning RPC] Delete expired invoices")
-        return RPC.rpc_call('delexpiredinvoice')
-
-
-
+        return RPC.call('delexpiredinvoice')
@@ -0,0 +1,382 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import secp256k1
+from websocket import WebSocketApp
+from nostr.relay import RelayPolicy
+from nostr.message_pool import MessagePool
+from nostr.message_type import ClientMessageType, RelayMessageType
+
+from Metrics import metrics
+
+log = logging.getLogger()
+#  websocket-client logs every (re)connection, errors are logged by Relay.on_error
+logging.getLogger('websocket').setLevel(logging.CRITICAL)
+
+DEFAULT_RELAYS = [
+    "wss://nostr.oxtr.dev",
+    "wss://nostr.mom",
+    "wss://relay.damus.io",
+    "wss://nostr-relay.lnmarkets.com",
+]
+
+EVENTS = metrics.counter('rektbot_relay_events_total', 'Events received from relays', ['relay', 'result'])
+CONNECTED = metrics.gauge('rektbot_relays_connected', 'Connected relays')
+
+
+def verify_event(event: dict) -> bool:
+    """
+    Check event id and schnorr signature (NIP-01).
+    """
+    try:
+        serialized = json.dumps([0, event['pubkey'], event['created_at'], event['kind'], event['tags'],
+                                 event['content']], separators=(',', ':'), ensure_ascii=False)
+        event_id = hashlib.sha256(serialized.encode()).hexdigest()
+        if event_id != event['id']:
+            return False
+        pubkey = secp256k1.PublicKey(bytes.fromhex('02' + event['pubkey']), True)
+        return pubkey.schnorr_verify(bytes.fromhex(event_id), bytes.fromhex(event['sig']), None, raw=True)
+    except Exception:
+        return False
+
+
+class Relay:
+    """
+    Connection to one relay, reconnected with exponential backoff.
+    Round trip latency is measured on the handshake, on every REQ/EOSE and
+    on every ping/pong.
+    """
+
+    def __init__(self, url, pool, policy=None, ping_interval=30, max_backoff=60):
+        self.url = url
+        self.pool = pool
+        self.policy = policy or RelayPolicy()
+        self.ping_interval = ping_interval
+        self.max_backoff = max_backoff
+        self.ws = None
+        self.ready = threading.Event()
+        self.closed = False
+        self.subscriptions = set()
+        # subscriptions whose stored events were all received
+        self.eose = set()
+        self.requested_at = {}
+        self.lock = threading.Lock()
+        self.latency = None
+        self.delivered = 0
+        self.expected = 0
+        self.invalid = 0
+        self.connections = 0
+        self.failures = 0
+        self.connecting_at = None
+        self.thread = threading.Thread(target=self.run, daemon=True, name=f"relay-{url}")
+
+    @property
+    def connected(self) -> bool:
+        return self.ready.is_set()
+
+    def connect(self):
+        self.thread.start()
+
+    def run(self):
+        backoff = 1
+        while not self.closed:
+            self.connecting_at = time.monotonic()
+            self.ws = WebSocketApp(self.url,
+                                   on_open=self.on_open,
+                                   on_message=self.on_message,
+                                   on_error=self.on_error,
+                                   on_close=self.on_close,
+                                   on_pong=self.on_pong)
+            try:
+                if self.ping_interval:
+                    self.ws.run_forever(ping_interval=self.ping_interval, ping_timeout=self.ping_interval / 2)
+                else:
+                    self.ws.run_forever()
+            except Exception as e:
+                log.log(15, "[RelayPool] %s error: %s", self.url, e)
+            was_ready = self.ready.is_set()
+            self.ready.clear()
+            with self.lock:
+                self.subscriptions.clear()
+                self.eose.clear()
+            if self.closed:
+                break
+            if was_ready:
+                backoff = 1
+            else:
+                self.failures += 1
+            log.log(15, "[RelayPool] %s disconnected, reconnect in %ss", self.url, backoff)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def update_latency(self, sample: float):
+        if self.latency is None:
+            self.latency = sample
+        else:
+            # exponential moving average
+            self.latency = 0.8 * self.latency + 0.2 * sample
+
+    def on_open(self, ws):
+        self.update_latency(time.monotonic() - self.connecting_at)
+        self.connections += 1
+        self.ready.set()
+        log.log(15, "[RelayPool] %s connected in %.3fs", self.url, self.latency)
+        self.pool.on_relay_ready(self)
+
+    def on_pong(self, ws, data):
+        if ws.last_ping_tm:
+            self.update_latency(max(time.time() - ws.last_ping_tm, 0))
+
+    def on_error(self, ws, error):
+        log.log(15, "[RelayPool] %s error: %s", self.url, error)
+
+    def on_close(self, ws, status_code, message):
+        self.ready.clear()
+
+    def on_message(self, ws, message: str):
+        try:
+            message_json = json.loads(message)
+        except ValueError:
+            self.invalid += 1
+            EVENTS.inc(self.url, 'invalid')
+            return
+        if not isinstance(message_json, list) or not message_json:
+            return
+        if message_json[0] == RelayMessageType.EVENT:
+            if len(message_json) != 3 or message_json[1] not in self.subscriptions:
+                return
+            if not verify_event(message_json[2]):
+                self.invalid += 1
+                EVENTS.inc(self.url, 'invalid')
+                return
+            self.delivered += 1
+            self.pool.on_event(self, message_json[2]['id'])
+        elif message_json[0] == RelayMessageType.END_OF_STORED_EVENTS and len(message_json) > 1:
+            self.eose.add(message_json[1])
+            requested_at = self.requested_at.pop(message_json[1], None)
+            if requested_at is not None:
+                self.update_latency(time.monotonic() - requested_at)
+        self.pool.message_pool.add_message(message, self.url)
+
+    def publish(self, message: str):
+        self.ws.send(message)
+
+    def subscribe(self, subscription_id, filters):
+        """
+        filters can be a function of the relay url returning the filters.
+        """
+        if callable(filters):
+            filters = filters(self.url)
+        request = [ClientMessageType.REQUEST, subscription_id]
+        request.extend(filters.to_json_array())
+        with self.lock:
+            self.subscriptions.add(subscription_id)
+            self.eose.discard(subscription_id)
+            self.requested_at[subscription_id] = time.monotonic()
+        self.publish(json.dumps(request))
+
+    def unsubscribe(self, subscription_id):
+        with self.lock:
+            self.subscriptions.discard(subscription_id)
+            self.eose.discard(subscription_id)
+        self.publish(json.dumps([ClientMessageType.CLOSE, subscription_id]))
+
+    def close(self):
+        self.closed = True
+        if self.ws:
+            self.ws.close()
+
+    def stats(self) -> dict:
+        return {
+            'connected': self.connected,
+            'latency': round(self.latency, 4) if self.latency is not None else None,
+            'delivered': self.delivered,
+            'expected': self.expected,
+            'invalid': self.invalid,
+            'connections': self.connections,
+            'failures': self.failures,
+            'score': round(self.pool.score(self), 4),
+        }
+
+
+class RelayPool:
+    """
+    Relays connected in parallel, scored by latency and event delivery rate
+    (share of the unique events received while subscribed that the relay
+    delivered), lower is better.
+    Subscriptions go to the `read_count` best relays, publications to the
+    `write_count` best (None: every connected relay), the routing is
+    refreshed every `rescore_interval` seconds.
+    Keep the nostr RelayManager interface used by the bot.
+    """
+
+    def __init__(self, read_count=None, write_count=None, ping_interval=30, rescore_interval=30,
+                 miss_penalty=1.0, history=10000):
+        self.relays = {}
+        self.message_pool = MessagePool()
+        self.subscriptions = {}
+        self.read_count = read_count
+        self.write_count = write_count
+        self.ping_interval = ping_interval
+        self.rescore_interval = rescore_interval
+        self.miss_penalty = miss_penalty
+        self.history = history
+        self.seen = OrderedDict()
+        self.unique_events = 0
+        self.lock = threading.RLock()
+        self.ready = threading.Condition(self.lock)
+        self.closed = threading.Event()
+        self.maintenance = threading.Thread(target=self.maintain, daemon=True, name='relay-pool')
+        CONNECTED.set_function(lambda: {(): len(self.connected_relays())})
+
+    def add_relay(self, url, policy=None):
+        self.relays[url] = Relay(url, self, policy, self.ping_interval)
+
+    def remove_relay(self, url):
+        relay = self.relays.pop(url, None)
+        if relay:
+            relay.close()
+
+    def connect(self, timeout=5.0, min_ready=None) -> int:
+        """
+        Connect all relays in parallel, return when `min_ready` relays
+        (default all) are connected or on timeout, the others keep
+        connecting in background. Return the count of connected relays.
+        """
+        start = time.monotonic()
+        for relay in self.relays.values():
+            relay.connect()
+        if not self.maintenance.is_alive():
+            self.maintenance.start()
+        if min_ready is None:
+            min_ready = len(self.relays)
+        min_ready = min(min_ready, len(self.relays))
+        deadline = start + timeout
+        with self.ready:
+            while len(self.connected_relays()) < min_ready:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.ready.wait(remaining)
+        connected = len(self.connected_relays())
+        log.info(f"[RelayPool] {connected}/{len(self.relays)} relays connected in {time.monotonic() - start:.3f}s")
+        return connected
+
+    def connected_relays(self) -> list:
+        return [relay for relay in self.relays.values() if relay.connected]
+
+    def score(self, relay) -> float:
+        if not relay.connected:
+            return float('inf')
+        rate = min(relay.delivered / relay.expected, 1) if relay.expected else 1
+        return (relay.latency or 0) + (1 - rate) * self.miss_penalty
+
+    def ranked(self, relays=None) -> list:
+        relays = self.connected_relays() if relays is None else relays
+        return sorted(relays, key=self.score)
+
+    def read_relays(self) -> list:
+        relays = self.ranked([r for r in self.connected_relays() if r.policy.should_read])
+        return relays[:self.read_count] if self.read_count else relays
+
+    def write_relays(self) -> list:
+        relays = self.ranked([r for r in self.connected_relays() if r.policy.should_write])
+        return relays[:self.write_count] if self.write_count else relays
+
+    def on_event(self, relay, event_id):
+        with self.lock:
+            if event_id in self.seen:
+                EVENTS.inc(relay.url, 'duplicate')
+                return
+            EVENTS.inc(relay.url, 'unique')
+            self.seen[event_id] = None
+            self.unique_events += 1
+            if len(self.seen) > self.history:
+                self.seen.popitem(last=False)
+            for other in self.relays.values():
+                if other.subscriptions:
+                    other.expected += 1
+
+    def on_relay_ready(self, relay):
+        with self.ready:
+            self.ready.notify_all()
+        if relay.policy.should_read and relay in self.read_relays():
+            self.send_subscriptions(relay)
+
+    def send_subscriptions(self, relay):
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        for subscription_id, filters in subscriptions:
+            try:
+                relay.subscribe(subscription_id, filters)
+            except Exception as e:
+                log.log(15, "[RelayPool] %s subscribe fail: %s", relay.url, e)
+
+    def add_subscription_on_all_relays(self, subscription_id, filters):
+        """
+        Register (or replace) subscription and send it to the read relays,
+        relays connecting later receive it on connect.
+        filters can be a function of the relay url, called on every REQ.
+        """
+        with self.lock:
+            self.subscriptions[subscription_id] = filters
+        for relay in self.read_relays():
+            try:
+                relay.subscribe(subscription_id, filters)
+            except Exception as e:
+                log.log(15, "[RelayPool] %s subscribe fail: %s", relay.url, e)
+
+    def close_subscription_on_all_relays(self, subscription_id):
+        with self.lock:
+            self.subscriptions.pop(subscription_id, None)
+        for relay in self.connected_relays():
+            if subscription_id in relay.subscriptions:
+                try:
+                    relay.unsubscribe(subscription_id)
+                except Exception:
+                    pass
+
+    def rebalance(self):
+        """
+        Move subscriptions to the current best read relays.
+        """
+        if not self.read_count:
+            return
+        best = self.read_relays()
+        for relay in self.connected_relays():
+            if relay in best and not relay.subscriptions:
+                self.send_subscriptions(relay)
+            elif relay not in best and relay.subscriptions:
+                for subscription_id in list(relay.subscriptions):
+                    try:
+                        relay.unsubscribe(subscription_id)
+                    except Exception:
+                        pass
+
+    def maintain(self):
+        while not self.closed.wait(self.rescore_interval):
+            self.rebalance()
+            if log.isEnabledFor(15):
+                log.log(15, "[RelayPool] %s", self.stats())
+
+    def publish_message(self, message: str):
+        for relay in self.write_relays():
+            try:
+                relay.publish(message)
+            except Exception as e:
+                log.log(15, "[RelayPool] %s publish fail: %s", relay.url, e)
+
+    def publish_event(self, event):
+        self.publish_message(event.to_message())
+
+    def close_connections(self):
+        self.closed.set()
+        for relay in self.relays.values():
+            relay.close()
+
+    def stats(self) -> dict:
+        return {url: relay.stats() for url, relay in self.relays.items()}
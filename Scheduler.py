@@ -0,0 +1,154 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+
+log = logging.getLogger()
+
+
+class Job:
+
+    def __init__(self, name, function, interval=None, timeout=None):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.timeout = timeout
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_duration = 0.0
+        self.thread = None
+        # Future of the last run done on a worker (jobs having a timeout)
+        self.running = None
+
+    def __repr__(self):
+        return f"Job({self.name=}, {self.interval=}, {self.timeout=}, {self.runs=}, {self.overruns=}," \
+               f" {self.skipped=}, {self.errors=}, {self.last_duration=})"
+
+
+class Scheduler:
+    """
+    Run every job in its own thread so a slow job never delay the others:
+    - periodic jobs run every `interval` seconds. With a `timeout`, each
+      run is done on a worker thread and waited at most `timeout` seconds:
+      a run still going is counted as an overrun and left behind (a thread
+      cannot be killed), the job is skipped until it returns so two runs
+      of a job never overlap
+    - listeners are blocking functions (e.g. waiting on a queue) called
+      again as soon as they return
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.stopped = threading.Event()
+
+    def add_job(self, name, function, interval, timeout=None):
+        self.jobs[name] = Job(name, function, interval, timeout)
+
+    def add_listener(self, name, function):
+        self.jobs[name] = Job(name, function)
+
+    def start(self):
+        for job in self.jobs.values():
+            job.thread = threading.Thread(target=self.run, args=(job,), daemon=True, name=job.name)
+            job.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    @staticmethod
+    def submit(job: Job) -> Future:
+        future = Future()
+
+        def work():
+            try:
+                future.set_result(job.function())
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=work, daemon=True, name=f"{job.name}-run").start()
+        return future
+
+    def on_late_result(self, job: Job, start, future: Future):
+        job.last_duration = time.monotonic() - start
+        log.info(f"[Scheduler] job {job.name} returned after {job.last_duration:.2f}s (timeout {job.timeout}s)")
+        if future.exception() is not None:
+            job.errors += 1
+            log.error(f"[Scheduler] job {job.name} fail: {future.exception()}")
+
+    def call(self, job: Job, start) -> bool:
+        """
+        Run job once, return False if skipped.
+        """
+        if job.timeout is None or job.interval is None:
+            job.function()
+            return True
+        if job.running is not None and not job.running.done():
+            job.skipped += 1
+            log.log(15, "[Scheduler] job %s still running, skipped", job.name)
+            return False
+        job.running = self.submit(job)
+        try:
+            job.running.result(timeout=job.timeout)
+        except TimeoutError:
+            job.overruns += 1
+            log.warning(f"[Scheduler] job {job.name} timed out after {job.timeout}s, left running")
+            job.running.add_done_callback(lambda future: self.on_late_result(job, start, future))
+        return True
+
+    def run(self, job: Job):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            try:
+                if not self.call(job, start):
+                    self.stopped.wait(job.interval)
+                    continue
+            except Exception as e:
+                job.errors += 1
+                log.exception(f"[Scheduler] job {job.name} fail: {e}")
+                # do not spin on a listener failing instantly
+                if job.interval is None:
+                    self.stopped.wait(1)
+            job.runs += 1
+            job.last_duration = time.monotonic() - start
+
+            if job.interval is not None:
+                self.stopped.wait(max(job.interval - job.last_duration, 0))
+
+
+class Latency:
+    """
+    Measure delay between mark(key) and done(key), e.g. note received -> reply sent.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.pending = {}
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def mark(self, key):
+        with self.lock:
+            now = time.monotonic()
+            # drop keys that never got done()
+            if len(self.pending) > self.size:
+                self.pending = {k: v for k, v in self.pending.items() if now - v < 300}
+            self.pending[key] = now
+
+    def done(self, key):
+        with self.lock:
+            start = self.pending.pop(key, None)
+            if start is None:
+                return
+            delay = time.monotonic() - start
+            self.samples.append(delay)
+            if len(self.samples) > self.size:
+                self.samples = self.samples[-self.size:]
+            return delay
+
+    def percentile(self, p):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return
+        return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
@@ -0,0 +1,74 @@
+import time
+
+from nostr.filter import Filter, Filters
+from nostr.event import EventKind
+
+
+class MetadataShards:
+    """
+    Split SET_METADATA subscriptions of users in shards of at most `size`
+    authors, each shard having a stable subscription id.
+    Adding a user only resend its shard: users already subscribed are
+    requested `since` the previous request of the shard, only the new
+    user profile is requested without time bound.
+    """
+
+    def __init__(self, prefix='rektbot-meta', size=200, overlap=60):
+        self.prefix = prefix
+        self.size = size
+        self.overlap = overlap
+        self.shards = []
+
+    def subscription_id(self, index) -> str:
+        return f"{self.prefix}-{index}"
+
+    def load(self, users, since=None, has_profile=None) -> list:
+        """
+        Build shards for all users, return [(subscription_id, filters), ...]
+        Users with a known profile (has_profile(user)) are requested `since`
+        the checkpoint, the others without time bound.
+        """
+        self.shards = []
+        for i in range(0, len(users), self.size):
+            chunk = users[i:i + self.size]
+            if since is None or has_profile is None:
+                authors, pending = [], list(chunk)
+            else:
+                authors = [user for user in chunk if has_profile(user)]
+                pending = [user for user in chunk if not has_profile(user)]
+            self.shards.append({
+                'authors': authors,
+                'pending': pending,
+                'since': since,
+                'last_request': None,
+            })
+        return [self.request(i) for i in range(len(self.shards))]
+
+    def add(self, user) -> tuple:
+        """
+        Add user to the last shard (or a new one), return (subscription_id, filters) to send.
+        """
+        if not self.shards or len(self.shards[-1]['authors']) + len(self.shards[-1]['pending']) >= self.size:
+            self.shards.append({
+                'authors': [],
+                'pending': [],
+                'since': None,
+                'last_request': None,
+            })
+        shard = self.shards[-1]
+        # profiles of pending users was received with the previous request
+        shard['authors'].extend(shard['pending'])
+        shard['pending'] = [user]
+        if shard['last_request'] is not None:
+            shard['since'] = shard['last_request'] - self.overlap
+        return self.request(len(self.shards) - 1)
+
+    def request(self, index) -> tuple:
+        shard = self.shards[index]
+        shard['last_request'] = int(time.time())
+        filters = []
+        if shard['authors']:
+            filters.append(Filter(authors=list(shard['authors']), kinds=[EventKind.SET_METADATA], since=shard['since']))
+        if shard['pending']:
+            filters.append(Filter(authors=list(shard['pending']), kinds=[EventKind.SET_METADATA]))
+        return self.subscription_id(index), Filters(filters)
@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+
+from peewee import *
+
+import Database
+
+log = logging.getLogger()
+
+
+class User(Model):
+    pubkey = CharField(unique=True)
+    first_seen = IntegerField()
+    last_activity = IntegerField()
+    lud16 = CharField(null=True)
+    # created_at of the SET_METADATA event lud16 comes from
+    profile_at = IntegerField(null=True)
+    events = IntegerField(default=0)
+    orders = IntegerField(default=0)
+
+    def __repr__(self):
+        return f"User({self.pubkey=}, {self.first_seen=}, {self.last_activity=}, {self.lud16=}, {self.profile_at=}, {self.events=}," \
+               f" {self.orders=})"
+
+    class Meta:
+        database = None
+
+
+class UserRegistry:
+    """
+    Known users, persisted in sqlite and loaded once in memory:
+    membership and lud16 lookups never hit the db.
+    Profiles are updated newer-wins on the metadata event created_at.
+    """
+
+    def __init__(self, db_path='bot.sqlite', legacy_path='users.pubkey'):
+        self.db = SqliteDatabase(db_path, timeout=5, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+        })
+        User._meta.database = self.db
+        self.db.connect(reuse_if_open=True)
+        Database.setup(self.db, [User])
+
+        # pubkey -> created_at of the last profile (None if never received)
+        self.pubkeys = {}
+        self.lud16 = {}
+        for pubkey, lud16, profile_at in User.select(User.pubkey, User.lud16, User.profile_at
+                                                     ).order_by(User.id).tuples():
+            self.pubkeys[pubkey] = profile_at
+            if lud16:
+                self.lud16[pubkey] = lud16
+
+        if legacy_path and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+
+        log.info(f"[UserRegistry] {len(self.pubkeys)} users loaded")
+
+    def __contains__(self, pubkey) -> bool:
+        return pubkey in self.pubkeys
+
+    def __len__(self):
+        return len(self.pubkeys)
+
+    def __iter__(self):
+        # dict keep insertion (first seen) order
+        return iter(list(self.pubkeys))
+
+    def add(self, pubkey) -> bool:
+        if pubkey in self.pubkeys:
+            return False
+        now = int(time.time())
+        User.insert(pubkey=pubkey, first_seen=now, last_activity=now).on_conflict_ignore().execute()
+        self.pubkeys[pubkey] = None
+        return True
+
+    def touch(self, pubkey):
+        """
+        Record an event from pubkey.
+        """
+        User.update({User.last_activity: int(time.time()), User.events: User.events + 1}
+                    ).where(User.pubkey == pubkey).execute()
+
+    def count_order(self, pubkey):
+        User.update({User.orders: User.orders + 1}).where(User.pubkey == pubkey).execute()
+
+    def get_lud16(self, pubkey):
+        return self.lud16.get(pubkey)
+
+    def set_lud16(self, pubkey, lud16):
+        if self.lud16.get(pubkey) == lud16:
+            return
+        self.add(pubkey)
+        User.update(lud16=lud16).where(User.pubkey == pubkey).execute()
+        self.lud16[pubkey] = lud16
+
+    def has_profile(self, pubkey) -> bool:
+        return self.pubkeys.get(pubkey) is not None
+
+    def is_newer_profile(self, pubkey, created_at) -> bool:
+        profile_at = self.pubkeys.get(pubkey)
+        return profile_at is None or created_at > profile_at
+
+    def set_profile(self, pubkey, lud16, created_at) -> bool:
+        """
+        Store profile if newer than the known one, return True if stored.
+        """
+        if not self.is_newer_profile(pubkey, created_at):
+            return False
+        self.add(pubkey)
+        User.update(lud16=lud16, profile_at=created_at).where(User.pubkey == pubkey).execute()
+        self.pubkeys[pubkey] = created_at
+        if lud16:
+            self.lud16[pubkey] = lud16
+        else:
+            self.lud16.pop(pubkey, None)
+        return True
+
+    def get_user(self, pubkey):
+        try:
+            return User.get(User.pubkey == pubkey)
+        except User.DoesNotExist:
+            return None
+
+    def migrate(self, legacy_path):
+        """
+        One shot import of the legacy users.pubkey file, renamed to <legacy_path>.migrated on success.
+        """
+        log.info(f"[UserRegistry] import users from {legacy_path}")
+        now = int(time.time())
+        rows = []
+        with open(legacy_path, 'r') as file:
+            for line in file:
+                pubkey = line.strip()
+                if not pubkey or pubkey in self.pubkeys:
+                    continue
+                self.pubkeys[pubkey] = None
+                rows.append({'pubkey': pubkey, 'first_seen': now, 'last_activity': now})
+        with self.db.atomic():
+            for i in range(0, len(rows), 500):
+                User.insert_many(rows[i:i + 500]).on_conflict_ignore().execute()
+        os.rename(legacy_path, f"{legacy_path}.migrated")
+
+    def close(self):
+        self.db.close()
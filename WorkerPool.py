@@ -0,0 +1,77 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QObject, Signal
+
+log = logging.getLogger()
+
+
+class WorkerPool(QObject):
+    """
+    Fixed size thread pool with a bounded queue.
+    Each job result is emitted as {'data': data, 'return': out} by `result`.
+    A job running longer than its timeout is reported by `job_timeout` but
+    keep running (e.g. a payment cannot be cancelled), its result is still
+    emitted when it ends.
+    """
+    result = Signal(object)
+    job_timeout = Signal(object)
+
+    def __init__(self, size=4, max_queue=32, timeout=300, name='worker'):
+        QObject.__init__(self)
+        self.size = size
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.timed_out = 0
+
+    def queue_depth(self) -> int:
+        return self.queued
+
+    def active_count(self) -> int:
+        return self.active
+
+    def submit(self, function, args=(), kwargs=None, data=None, timeout=None) -> bool:
+        """
+        Return False if the queue is full, the job is then not run.
+        """
+        with self.lock:
+            if self.queued >= self.max_queue:
+                log.info(f"[WorkerPool] queue full ({self.queued} jobs), job rejected")
+                return False
+            self.queued += 1
+        if timeout is None:
+            timeout = self.timeout
+        self.executor.submit(self.run, function, args, kwargs or {}, data, timeout)
+        return True
+
+    def run(self, function, args, kwargs, data, timeout):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        timer = threading.Timer(timeout, self.on_timeout, (function, data, timeout))
+        timer.daemon = True
+        timer.start()
+        try:
+            out = function(*args, **kwargs)
+        except Exception as e:
+            log.exception(f"[WorkerPool] job {function.__name__} fail: {e}")
+            out = None
+        finally:
+            timer.cancel()
+            with self.lock:
+                self.active -= 1
+        self.result.emit({'data': data, 'return': out})
+
+    def on_timeout(self, function, data, timeout):
+        with self.lock:
+            self.timed_out += 1
+        log.info(f"[WorkerPool] job {function.__name__} still running after {timeout}s")
+        self.job_timeout.emit(data)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
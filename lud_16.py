@@ -1,58 +1,105 @@
-import requests
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import bolt11
 
+from Http import Transport, SingleFlight
+from Metrics import metrics
+
+log = logging.getLogger()
+
+REQUESTS = metrics.histogram('rektbot_lud16_request_seconds', 'LUD16 lnurlp/callback request duration', ['step'])
+INVOICES = metrics.counter('rektbot_lud16_invoices_total', 'LUD16 invoice requests by result', ['result'])
+
 
 class LUD16:
+    """
+    LUD16 (lightning address) client: lnurlp metadata is cached `ttl`
+    seconds per address, requests share a keep-alive pool with timeouts,
+    get_invoice_async() resolves on a small thread pool.
+    """
+
+    def __init__(self, timeout=(5, 15), ttl=300, workers=4, base_url=None):
+        # no retry: a stalled wallet server fails after one timeout, the user can retry
+        self.transport = Transport(base_url=base_url, timeout=timeout, pool_size=workers, retries=0)
+        self.metadata = SingleFlight(ttl)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='lud16')
 
     @staticmethod
-    def connect(url: str):
-        user, domain = url.split('@')
-        url = f"https://{domain}/.well-known/lnurlp/{user}"
-        ret = requests.get(url).json()
-        if ret['status'] == 'OK':
-            callback = ret['callback']
-            metadata = ret['metadata']
-            min_sendable = ret['minSendable']
-            max_sendable = ret['maxSendable']
-            tag = ret['tag']
-            if tag != 'payRequest':
-                return
-            try:
-                data = {
-                    'callback': callback,
-                    'metadata': metadata,
-                    'min_sendable': min_sendable,
-                    'max_sendable': max_sendable,
-                    'tag': tag,
-                    }
-                return data
-            except:
-                return
-        else:
+    def lnurlp_url(address: str) -> str:
+        user, domain = address.split('@')
+        return f"https://{domain}/.well-known/lnurlp/{user}"
+
+    def fetch(self, address: str):
+        with REQUESTS.time('lnurlp'):
+            ret = self.transport.get(self.lnurlp_url(address)).json()
+        # status is only mandatory on error
+        if ret.get('status', 'OK') != 'OK' or ret.get('tag') != 'payRequest':
+            log.log(15, "[LUD16] %s lnurlp answer: %s", address, ret)
+            return
+        try:
+            return {
+                'callback': ret['callback'],
+                'metadata': ret['metadata'],
+                'min_sendable': int(ret['minSendable']),
+                'max_sendable': int(ret['maxSendable']),
+                'tag': ret['tag'],
+            }
+        except (KeyError, ValueError, TypeError):
             return
 
-    @staticmethod
-    def process_callback_url(data, amount) -> str:
-        return LUD16.process_callback_url_msats(data, amount*1000)
+    def connect(self, address: str):
+        """
+        Return lnurlp metadata of address, None if not valid.
+        """
+        return self.metadata.do(('lnurlp', address.lower()), lambda: self.fetch(address),
+                                valid=lambda data: data is not None)
 
-    @staticmethod
-    def process_callback_url_msats(data, amount) -> str:
-        return f"{data['callback']}?&amount={amount}"
+    def request_invoice(self, address: str, amount: int):
+        """
+        Ask the callback for an invoice of amount sats, return it unchecked.
+        """
+        data = self.connect(address)
+        if not data:
+            INVOICES.inc('no_metadata')
+            return
+        msats = amount * 1000
+        if not data['min_sendable'] <= msats <= data['max_sendable']:
+            log.info(f"[LUD16] {amount}sats out of {address} range "
+                     f"[{data['min_sendable'] // 1000}, {data['max_sendable'] // 1000}]")
+            INVOICES.inc('out_of_range')
+            return
+        with REQUESTS.time('callback'):
+            ret = self.transport.get(data['callback'], params={'amount': msats}).json()
+        if ret.get('status', 'OK') != 'OK' or 'pr' not in ret:
+            # callback may have changed
+            self.metadata.forget(('lnurlp', address.lower()))
+            log.log(15, "[LUD16] %s callback answer: %s", address, ret)
+            INVOICES.inc('callback_error')
+            return
+        return ret['pr']
 
-    @staticmethod
-    def get_invoice(url: str, amount: int):
-        data = LUD16.connect(url)
-        if data:
-            callback_url = LUD16.process_callback_url(data, amount)
-            ret = requests.get(callback_url).json()
-            if ret['status'] == 'OK':
-                invoice = ret['pr']
-                a = bolt11.decode(invoice).amount
-                if a == amount*1000:
-                    return invoice
-                else:
-                    return
-            else:
+    def get_invoice(self, address: str, amount: int):
+        invoice = self.request_invoice(address, amount)
+        if invoice and bolt11.decode(invoice).amount_msat == amount * 1000:
+            INVOICES.inc('ok')
+            return invoice
+        if invoice:
+            INVOICES.inc('wrong_amount')
+
+    def get_invoice_async(self, address: str, amount: int):
+        """
+        Return a Future of get_invoice(), its result is None on any failure.
+        """
+        def run():
+            try:
+                return self.get_invoice(address, amount)
+            except Exception as e:
+                INVOICES.inc('error')
+                log.info(f"[LUD16] fail to get invoice from {address}: {e}")
                 return
-        else:
-            return
\ No newline at end of file
+        return self.executor.submit(run)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.transport.close()
@@ -1,5 +1,5 @@
+import atexit
 import logging
-import re
 import config
 import subprocess
 from copy import deepcopy as copy
@@ -9,21 +9,32 @@ import random
 import math
 
 import json
+import queue
 import ssl
 import time
 from nostr.key import PrivateKey, PublicKey
 from nostr.filter import Filter, Filters
 from nostr.event import Event, EventKind, EncryptedDirectMessage
-from nostr.relay_manager import RelayManager
-from nostr.message_type import ClientMessageType
 
-from PySide6.QtCore import QThread, QObject, Signal
+from PySide6.QtCore import QObject, Signal
 from PySide6.QtCore import QCoreApplication
 
 from RPC import RPC
 from LNM import LNMarkets
 from OrderManager import OrderManager
 from lud_16 import LUD16
+from History import History
+import Command
+from Scheduler import Scheduler, Latency
+from WorkerPool import WorkerPool
+from Subscriptions import MetadataShards
+from Users import UserRegistry
+from Nip04 import CryptoPipeline
+from Publisher import Publisher
+from RelayPool import RelayPool, DEFAULT_RELAYS
+from Checkpoints import Checkpoints
+from Metrics import metrics
+import Logs
 
 
 # TODO: charge for withdraw fee??
@@ -40,45 +51,26 @@ from lud_16 import LUD16
 # TODO: DB recovery log
 # TODO: delete paid invoices from CLN and copy data to rektBot.log
 # TODO: handle every case when API call not success
-# TODO: move history to a peewee DB
 
 logging.addLevelName(15, "DEBG")
 DEB = 15
 
 log = logging.getLogger()
-log.setLevel(logging.DEBUG)
-
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-file_handler = logging.FileHandler('rektBot.log')
-file_handler.setLevel(15)
-file_handler.setFormatter(formatter)
-
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(formatter)
-
-log.addHandler(file_handler)
-log.addHandler(stream_handler)
-
-
-class Worker(QThread):
-
-    result = Signal(object)
-
-    def __init__(self, function, args=(), kwargs={}):
-        QThread.__init__(self)
-        self.function = function
-        self.args = args
-        self.kwargs = kwargs
-        self.data = None
-
-    def run(self):
-        args = self.args
-        kwargs = self.kwargs
-        out = self.function(*args, **kwargs)
-        data = {'data': self.data, 'return': out}
-        self.result.emit(data)
+# records are written by a background thread, below log_level they are not even built
+log_listener = Logs.setup(path=getattr(config, 'log_file', 'rektBot.log'),
+                          level=getattr(config, 'log_level', DEB),
+                          stream_level=getattr(config, 'log_stream_level', logging.INFO),
+                          max_bytes=getattr(config, 'log_max_bytes', None),
+                          when=getattr(config, 'log_rotate_when', None),
+                          backup_count=getattr(config, 'log_backup_count', 5),
+                          json_lines=getattr(config, 'log_json', False))
+atexit.register(log_listener.stop)
+
+EVENTS = metrics.counter('rektbot_events_total', 'Events handled by kind and result', ['kind', 'result'])
+COMMANDS = metrics.counter('rektbot_commands_total', 'Commands received', ['command'])
+BATCH = metrics.histogram('rektbot_ingest_batch_seconds', 'Ingest batch handling duration')
+INGEST_QUEUE = metrics.gauge('rektbot_ingest_queue', 'Events waiting to be handled')
+REPLY = metrics.histogram('rektbot_reply_seconds', 'Note received -> reply published delay')
 
 
 class NostrBot(QObject):
@@ -91,33 +83,80 @@ class NostrBot(QObject):
     set_order_funding_fail = Signal(object)
     set_order_open = Signal(object)
     set_order_close = Signal(object)
+    set_orders_close = Signal(object)
     set_order_withdraw_requested = Signal(object)
     set_order_withdraw_receive_invoice = Signal(object)
     set_order_withdraw_done = Signal(object)
     set_order_status_withdraw_fail = Signal(object)
+    set_orders_withdraw_fail = Signal(object)
     del_order = Signal(object)
+    lud16_invoice = Signal(object)
 
-    def __init__(self, pk):
+    def __init__(self, pk, lnm=None, order_manager=None):
+        """
+        lnm and order_manager can be injected (benchmarks), relays, LNMarkets
+        and lightning-rpc endpoints come from config.
+        """
         QObject.__init__(self)
 
         #  Quit application on CTRL + C
         signal.signal(signal.SIGINT, self.interupt)
 
+        # no-op unless an endpoint port or a log interval is set
+        metrics.start(port=getattr(config, 'metrics_port', None),
+                      host=getattr(config, 'metrics_host', '127.0.0.1'),
+                      log_interval=getattr(config, 'metrics_log_interval', None))
+
         self.private_key = PrivateKey.from_nsec(pk)
         # print(self.private_key.bech32())
-
-        # TODO: periodicaly check stopped workers in list and delete them
-        self.worker_list = []
-        self.users_list = []
-        self.lnurl_list = {}
+        self.crypto = CryptoPipeline(self.private_key,
+                                     workers=getattr(config, 'crypto_workers', None),
+                                     mode=getattr(config, 'crypto_mode', 'thread'))
+
+        self.withdraw_pool = WorkerPool(size=getattr(config, 'withdraw_workers', 4),
+                                        max_queue=getattr(config, 'withdraw_queue', 32),
+                                        timeout=getattr(config, 'withdraw_timeout', 300),
+                                        name='withdraw')
+        self.withdraw_pool.result.connect(self.after_detach_withdraw)
+        self.withdraw_pool.job_timeout.connect(self.on_withdraw_timeout)
+        # LUD16 invoices are fetched off thread, then handled by on_lud16_invoice()
+        self.lud16 = LUD16(timeout=getattr(config, 'lud16_timeout', (5, 15)),
+                           ttl=getattr(config, 'lud16_cache_ttl', 300),
+                           base_url=getattr(config, 'lud16_base_url', None))
+        self.lud16_invoice.connect(self.on_lud16_invoice)
+        self.users = UserRegistry()
 
         self.filters = None
         self.relay_manager = None
+        self.metadata_shards = MetadataShards(size=getattr(config, 'metadata_shard_size', 200))
+        # newest processed event created_at, persisted
+        self.checkpoints = Checkpoints()
+        self.metadata_overlap = getattr(config, 'metadata_overlap', 3600)
+        self.mentions_overlap = getattr(config, 'mentions_overlap', 300)
+        # relay url -> newest handled mention created_at, not yet committed
+        self.mention_marks = {}
+
+        # events older than history_ttl are considered already processed
+        self.history_ttl = 30 * 24 * 3600
+        self.history = History()
 
         self.connect_relays()
+        INGEST_QUEUE.set_function(lambda: {(): self.relay_manager.message_pool.events.qsize()})
+        self.publisher = Publisher(self.relay_manager, self.crypto,
+                                   size=getattr(config, 'relay_queue_size', 256))
         self.update_filters()
 
-        self.loop_worker = Worker(self.loop)
+        # note received -> first reply
+        self.latency = Latency()
+        self.scheduler = Scheduler()
+        self.scheduler.add_listener('ingest', self.listen_notifications)
+        self.scheduler.add_job('unpaid_orders', self.check_unpaid_orders,
+                               interval=getattr(config, 'unpaid_interval', 2), timeout=10)
+        self.scheduler.add_job('open_orders', self.check_open_orders,
+                               interval=getattr(config, 'open_interval', 5), timeout=20)
+        # first run at start, then daily
+        self.scheduler.add_job('history_compact', lambda: self.history.compact(self.history_ttl),
+                               interval=getattr(config, 'history_compact_interval', 24 * 3600))
 
         log.info('Start NostrBot')
         log.info(f'Using pubkey {self.private_key.public_key.bech32()}')
@@ -127,9 +166,10 @@ class NostrBot(QObject):
         key = config.lnmarkets['key']
         secret = config.lnmarkets['secret']
         passphrase = config.lnmarkets['passphrase']
-        self.lnm = LNMarkets(key, secret, passphrase, self.fee)
+        self.lnm = lnm or LNMarkets(key, secret, passphrase, self.fee, checkpoints=self.checkpoints)
+        self.lnm.price_feed.start()
 
-        self.order_manager = OrderManager()
+        self.order_manager = order_manager or OrderManager()
         self.order_manager.order_status_new.connect(self.on_new_order)
         self.order_manager.order_status_unpaid.connect(self.on_unpaid)
         # self.order_manager.order_status_paid.connect(self.on_paid)
@@ -154,72 +194,66 @@ class NostrBot(QObject):
         self.set_order_funding_fail.connect(self.order_manager.set_order_funding_fail)
         self.set_order_open.connect(self.order_manager.set_order_open)
         self.set_order_close.connect(self.order_manager.set_order_close)
+        self.set_orders_close.connect(self.order_manager.set_orders_close)
         self.set_order_withdraw_requested.connect(self.order_manager.set_order_withdraw_requested)
         self.set_order_withdraw_receive_invoice.connect(self.order_manager.set_order_withdraw_receive_invoice)
         self.set_order_withdraw_done.connect(self.order_manager.set_order_withdraw_done)
         self.set_order_status_withdraw_fail.connect(self.order_manager.set_order_status_withdraw_fail)
+        self.set_orders_withdraw_fail.connect(self.order_manager.set_orders_withdraw_fail)
         self.del_order.connect(self.order_manager.del_order)
 
     def interupt(self, a, b):
+        self.history.flush()
+        self.checkpoints.flush(force=True)
         sys.exit()
 
     def start(self):
-        self.loop_worker.start()
-        
-    def load_users_pubkeys(self):
-        file = open('users.pubkey', 'r')
-        users_list = file.readlines()
-        file.close()
-
-        self.users_list = []
+        self.scheduler.start()
 
-        for user in users_list:
-            if user[-1] == '\n':
-                user = user[:-1]
-            self.users_list.append(user)
+    def stop(self):
+        self.scheduler.stop()
+        self.lnm.price_feed.stop()
+        self.relay_manager.close_connections()
+        self.history.flush()
+        self.checkpoints.flush(force=True)
+        metrics.stop()
 
     def add_user(self, user):
-        self.users_list.append(user)
-        file = open('users.pubkey', 'a')
-        file.write(f"{user}\n")
-        file.close()
+        self.users.add(user)
+        # only the shard of the new user is resent
+        self.subscribe(*self.metadata_shards.add(user))
 
-    def update_filters(self):
-        self.load_users_pubkeys()
-
-        # Register to npub notifications
-        npub = self.private_key.public_key.hex()
-        self.filters = Filters([
-            Filter(pubkey_refs=[npub], kinds=[EventKind.TEXT_NOTE, EventKind.ENCRYPTED_DIRECT_MESSAGE]),
-            Filter(authors=self.users_list, kinds=[EventKind.SET_METADATA]),
+    def subscribe(self, subscription_id, filters):
+        # sent to the best read relays, and again to relays on (re)connect
+        log.log(15, "Subscribe %s", subscription_id)
+        self.relay_manager.add_subscription_on_all_relays(subscription_id, filters)
 
-        ])
-
-        self.relay_manager.add_subscription_on_all_relays('rektbot', self.filters)
+    def update_filters(self):
+        # Register to npub notifications, filters are built per relay on every (re)subscription
+        self.filters = self.mentions_filters
+        self.subscribe('rektbot', self.filters)
 
-        request = [ClientMessageType.REQUEST, 'rektbot']
-        request.extend(self.filters.to_json_array())
-        message = json.dumps(request)
-        self.publish_to_all_relays(message)
+        # Register to users metadata, only changes since the checkpoint for known profiles
+        since = self.checkpoints.get('metadata')
+        if since is not None:
+            since -= self.metadata_overlap
+        for subscription_id, filters in self.metadata_shards.load(list(self.users), since, self.users.has_profile):
+            self.subscribe(subscription_id, filters)
 
     def connect_relays(self):
-        self.relay_manager = RelayManager()
-        log.info("Add relay wss://nostr.oxtr.dev")
-        self.relay_manager.add_relay("wss://nostr.oxtr.dev")
-        log.info("Add relay wss://nostr.mom")
-        self.relay_manager.add_relay("wss://nostr.mom")
-        log.info("Add relay wss://relay.damus.io")
-        self.relay_manager.add_relay("wss://relay.damus.io")
-        log.info("Add relay wss://nostr-relay.lnmarkets.com")
-        self.relay_manager.add_relay("wss://nostr-relay.lnmarkets.com")
-        time.sleep(2)
+        self.relay_manager = RelayPool(read_count=getattr(config, 'read_relays', None),
+                                       write_count=getattr(config, 'write_relays', None))
+        for url in getattr(config, 'relays', DEFAULT_RELAYS):
+            log.info(f"Add relay {url}")
+            self.relay_manager.add_relay(url)
+        # relays not ready yet are subscribed as soon as they connect
+        self.relay_manager.connect(timeout=getattr(config, 'relay_connect_timeout', 5),
+                                   min_ready=getattr(config, 'relay_min_ready', 2))
         log.info(f"Register for notification on pubkey {self.private_key.public_key.bech32()}")
 
     def publish_to_all_relays(self, msg):
-        log.log(15,f"Publish message to all relays({msg})")
-        for relay in self.relay_manager.relays.values():
-            if relay.policy.should_write:
-                relay.publish(msg)
+        log.log(15, "Publish message to all relays(%s)", msg)
+        self.publisher.publish_message(msg)
 
     def reply_to(self, note_id, user, msg: str, mode: str):
         if note_id:
@@ -229,7 +263,7 @@ class NostrBot(QObject):
 
         msg2 = msg
         msg2.replace('\n', ' ')
-        log.log(15,f"Message: {msg2}")
+        log.log(15, "Message: %s", msg2)
 
         if mode == 'note':
             reply = Event(content=msg)
@@ -242,28 +276,102 @@ class NostrBot(QObject):
         if note_id:
             reply.add_event_ref(note_id)
 
-        self.private_key.sign_event(reply)
-        self.relay_manager.publish_event(reply)
+        # encrypt, sign and publish off thread, replies are published in order
+        self.publisher.publish_event(reply, lambda event: self.on_reply_published(note_id))
 
-    def loop(self, *args, **kwargs):
-        while True:
-            self.listen_notifications()
-            self.check_unpaid_orders()
-            self.check_open_orders()
-            time.sleep(2)
+    def on_reply_published(self, note_id):
+        if note_id:
+            delay = self.latency.done(note_id)
+            if delay is not None:
+                REPLY.observe(delay)
+                log.log(15, "Note %s_%s replied in %.3fs", note_id[:5], note_id[-5:], delay)
 
     def listen_notifications(self):
-        while self.relay_manager.message_pool.has_events():
-            event_msg = self.relay_manager.message_pool.get_event()
-            self.handle_event(event_msg.event.to_json()[1])
+        # block until an event comes in, then drain the pool
+        events = self.relay_manager.message_pool.events
+        try:
+            event_msg = events.get(timeout=1)
+        except queue.Empty:
+            self.history.flush()
+            self.commit_mention_marks()
+            self.checkpoints.flush()
+            return
+        # decrypt DMs of the batch in parallel, handle events in arrival order
+        batch = []
+        while True:
+            event = event_msg.event.to_json()[1]
+            decrypted = None
+            if event['kind'] == EventKind.ENCRYPTED_DIRECT_MESSAGE and event['id'] not in self.history:
+                decrypted = self.crypto.decrypt(event['content'], event['pubkey'])
+            batch.append((event, decrypted, event_msg.url, event_msg.subscription_id))
+            if len(batch) >= 256:
+                break
+            try:
+                event_msg = events.get_nowait()
+            except queue.Empty:
+                break
+
+        with BATCH.time():
+            self.handle_batch(batch)
+        self.history.flush()
+        self.commit_mention_marks()
+        self.checkpoints.flush()
+
+    def handle_batch(self, batch):
+        for event, decrypted, url, subscription_id in batch:
+            if subscription_id == 'rektbot':
+                created_at = min(event['created_at'], int(time.time()))
+                self.mention_marks[url] = max(self.mention_marks.get(url, created_at), created_at)
+            if decrypted is not None:
+                try:
+                    decrypted = decrypted.result()
+                except Exception as e:
+                    log.info(f"Fail to decrypt event {event['id'][:5]}_{event['id'][-5:]}: {e}")
+                    # not decrypted again on every replay
+                    self.history.add(event['id'])
+                    continue
+            self.handle_event(event, decrypted)
+
+    def commit_mention_marks(self):
+        """
+        Advance the per relay checkpoint of handled mentions/DMs.
+        Relays send stored events newest first, so a mark is only committed
+        once the relay sent EOSE and every received event was handled.
+        """
+        if not self.mention_marks or self.relay_manager.message_pool.events.qsize():
+            return
+        for url, created_at in list(self.mention_marks.items()):
+            relay = self.relay_manager.relays.get(url)
+            if relay is not None and 'rektbot' in relay.eose:
+                self.checkpoints.advance(f"mentions:{url}", created_at)
+                del self.mention_marks[url]
+
+    def mentions_filters(self, url) -> Filters:
+        """
+        Mentions/DMs filters for relay url, since its checkpoint minus overlap
+        (events older than history_ttl are ignored anyway).
+        """
+        since = int(time.time()) - self.history_ttl
+        mark = self.checkpoints.get(f"mentions:{url}")
+        if mark is not None:
+            since = max(since, mark - self.mentions_overlap)
+        npub = self.private_key.public_key.hex()
+        return Filters([
+            Filter(pubkey_refs=[npub], kinds=[EventKind.TEXT_NOTE, EventKind.ENCRYPTED_DIRECT_MESSAGE], since=since),
+        ])
 
     def check_unpaid_orders(self):
-        unpaid_orders = self.order_manager.list_unpaid_orders()
+        unpaid_orders = list(self.order_manager.list_unpaid_orders())
+        if not unpaid_orders:
+            return
+
+        statuses = self.lnm.get_deposit_statuses([order.deposit_id for order in unpaid_orders])
 
         for order in unpaid_orders:
             # status = RPC.invoice_status(order.order_id)
-            status = self.lnm.get_deposit_status(order.deposit_id)
+            status = statuses.get(order.deposit_id)
             if status :
+                self.lnm.forget_deposit(order.deposit_id)
                 self.set_order_paid.emit(order.order_id)
             #  TODO: handle expired deposit to lnm (timestamp?)
 
@@ -287,112 +395,103 @@ class NostrBot(QObject):
         
         # if some closed orders
         if closed_orders:
-            lnm_closed_orders = self.lnm.get_closed_positions()
+            # closed positions are synced incrementally, positions of settled orders are evicted.
+            # No position of an open order closed before the oldest one was created
+            created = [order.created_at for order in db_open_orders]
+            since = min(created) * 1000 if None not in created else None
+            lnm_orders = self.lnm.get_closed_positions([order.lnm_id for order in closed_orders], since)
+            data_list = []
             for order in closed_orders:
                 order_id = order.order_id
                 lnm_id = order.lnm_id
-                lnm_order = lnm_closed_orders[lnm_id]
-                close_price = lnm_order['exit_price']
-                # profit = lnm_order['pl'] - lnm_order['opening_fee'] \
-                #          - lnm_order['closing_fee'] - lnm_order['sum_carry_fees']
-                data = {
+                lnm_order = lnm_orders.get(lnm_id)
+                if lnm_order is None:
+                    # not yet listed as closed, retry on next poll
+                    continue
+                close_price = lnm_order.exit_price
+                # profit = lnm_order.pl - lnm_order.opening_fee \
+                #          - lnm_order.closing_fee - lnm_order.sum_carry_fees
+                data_list.append({
                     'order_id': order_id,
                     'price': close_price,
-                }
-                self.set_order_close.emit(data)
-
-    @staticmethod
-    def in_history(hash) -> bool:
-        hash += '\n'
-        file = open('history', 'r')
-        note_history = file.readlines()
-        file.close()
-        if hash in note_history:
+                })
+                self.lnm.forget_closed_position(lnm_id)
+            if data_list:
+                self.set_orders_close.emit(data_list)
+
+    def in_history(self, event) -> bool:
+        if event['created_at'] < time.time() - self.history_ttl:
             return True
-        else:
-            file = open('history', 'a')
-            file.write(hash)
-            file.close()
-            return False
+        return self.history.seen(event['id'])
 
     # Handle notification
-    def handle_event(self, event):
+    def handle_event(self, event, decrypted=None):
         # TODO: refactor (split) handle_event()
 
         #if event type is METADATA (used for get LUD16 lnurl)
         if event['kind'] == EventKind.SET_METADATA:
             pubkey = event['pubkey']
-            content = json.loads(event['content'])
-            # if contain lnurl for user
-            if 'lud16' in content.keys():
-                self.lnurl_list[pubkey] = content['lud16']
-                log.log(15,f"Update lud16 for {pubkey=}: {content['lud16']}")
+            created_at = event['created_at']
+            # newer-wins, replayed or older profiles are not parsed
+            if self.users.is_newer_profile(pubkey, created_at):
+                EVENTS.inc('metadata', 'new')
+                try:
+                    content = json.loads(event['content'])
+                except ValueError:
+                    content = {}
+                lud16 = content.get('lud16') if type(content) is dict else None
+                self.users.set_profile(pubkey, lud16, created_at)
+                log.log(15, "Update lud16 for pubkey=%r: %s", pubkey, lud16)
+            else:
+                EVENTS.inc('metadata', 'seen')
+            self.checkpoints.advance('metadata', min(created_at, int(time.time())))
 
         # if new event
-        elif not self.in_history(event['id']):
+        elif not self.in_history(event):
             log.info(f"Get notification")
-            log.log(15, f"Event:{event}")
+            log.log(15, "Event:%s", event)
+            EVENTS.inc(str(event['kind']), 'new')
 
             note_id = event['id']
+            self.latency.mark(note_id)
             note_from = event['pubkey']
 
-            if note_from not in self.users_list:
+            if note_from not in self.users:
                 self.add_user(note_from)
-                self.update_filters()
+            self.users.touch(note_from)
 
             note_content = event['content']
             if event['kind'] == EventKind.TEXT_NOTE:
                 note_type = 'note'
             elif event['kind'] == EventKind.ENCRYPTED_DIRECT_MESSAGE:
                 note_type = 'dm'
-                note_content = self.private_key.decrypt_message(note_content, event['pubkey'])
-                log.log(15, f"Decrypted message = {note_content}")
+                if decrypted is None:
+                    decrypted = self.crypto.decrypt(note_content, event['pubkey']).result()
+                note_content = decrypted
+                log.log(15, "Decrypted message = %s", note_content)
             else:
                 return
 
-            note_content = note_content.lower()
+            command = Command.parse(note_content, note_type == 'dm')
+            if not command:
+                COMMANDS.inc('none')
+                return
+            log.log(15, "command=%r", command)
+            COMMANDS.inc(command.kind)
 
             #  If long or short order
-            if ('long ' in note_content) or ('short ' in note_content):
-                log.log(15,"LONG or SHORT command detected in content")
-                pattern_long = r'\blong\s+(\d+)\b'
-                pattern_short = r'\bshort\s+(\d+)\b'
-                pattern_leverage = r'\bx(\d+)\b'
-                pattern_tp = r'\btp(\d+)\b'
-                
-                # Parse params
-                if ('long' in note_content) and ('short' in note_content):
-                    log.log(15,"Both short AND long command in content, return")
-                    return
-                elif 'long' in note_content:
-                    log.log(15,"Command is LONG")
-                    amount = re.findall(pattern_long, note_content)
-                    order_type = 'long'
-                elif 'short' in note_content:
-                    log.log(15,"Command is SHORT")
-                    amount = re.findall(pattern_short, note_content)
-                    order_type = 'short'
-                else:
-                    log.log(15,"Command is unknow")
-                    return
-                
-                leverage = re.findall(pattern_leverage, note_content)
-                if not leverage:
-                    leverage = 100
-                else:
-                    leverage = int(leverage[0])
-                log.log(15,f"{leverage=}")
-                
-                tp = re.findall(pattern_tp, note_content)
-                
+            if command.kind == 'trade':
+                order_type = command.side
+                amount = command.amount
+                leverage = command.leverage
+                tp = command.tp
+
                 #  Open order
-                log.log(15, f"{amount=}, {tp=}")
                 if amount:
 
-                    amount = int(amount[0])
-
-                    trade_amount_dollar, _, _ = self.lnm.estimate_dollar_value(amount, leverage)
-                    log.log(15, f"{type(trade_amount_dollar)=}, {trade_amount_dollar}")
+                    price = self.lnm.get_price()
+                    trade_amount_dollar, _, _ = self.lnm.estimate_dollar_value(amount, leverage, price)
+                    log.log(15, "type(trade_amount_dollar)=%r, %s", type(trade_amount_dollar), trade_amount_dollar)
                     if trade_amount_dollar < 1.0:
                         msg = f"Position value < 1$ ({trade_amount_dollar}$), increase margin or leverage!"
                         self.reply_to(note_id, note_from, msg, note_type)
@@ -405,13 +504,8 @@ class NostrBot(QObject):
                     if amount > 300000:
                         amount = 300000
 
-                    if tp:
-                        tp = int(tp[0])
-                    else:
-                        tp = 0
-
-                    log.log(15,f"{order_type=}, {amount=}, {leverage=}, {tp=}")
-                    log.info(f'[{note_id[:5]}_{note_id[-5:]}] {note_from[:5]}_{note_from[-5:]} request for LONG {amount} sats')
+                    log.log(15, "order_type=%r, amount=%r, leverage=%r, tp=%r", order_type, amount, leverage, tp)
+                    log.info(f'[{note_id[:5]}_{note_id[-5:]}] {note_from[:5]}_{note_from[-5:]} request for {order_type.upper()} {amount} sats')
                     self.new_order.emit({'order_id': note_id,
                                          'user': note_from,
                                          'amount': amount,
@@ -420,39 +514,73 @@ class NostrBot(QObject):
                                          'leverage': leverage,
                                          'mode': note_type,
                                          })
+                    self.users.count_order(note_from)
 
-            #  Withdraw by lnurl requested
-            elif ('lnurl' in note_content) and (note_type == 'dm'):
+            #  Withdraw by lnurl or invoice requested
+            elif command.kind == 'withdraw':
 
                 data = {
                     'user': note_from,
-                    'withdraw_mode': 'lnurl',
+                    'withdraw_mode': command.withdraw_mode,
                     }
                 self.set_order_withdraw_requested.emit(data)
 
-            elif ('invoice' in note_content) and (note_type == 'dm'):
+            elif command.kind == 'invoice':
 
                 data = {
                     'user': note_from,
-                    'withdraw_mode': 'invoice',
+                    'invoice': command.invoice,
                 }
-                self.set_order_withdraw_requested.emit(data)
+                self.set_order_withdraw_receive_invoice.emit(data)
 
-            elif ('lnbc' in note_content) and (note_type == 'dm'):
-                pattern = r'lnbc\S+'
-                invoice = re.findall(pattern, note_content)[0]
+            elif command.kind == 'status':
+                self.reply_status(note_from)
 
-                data = {
-                    'user': note_from,
-                    'invoice': invoice,
-                }
-                self.set_order_withdraw_receive_invoice.emit(data)
+            elif command.kind == 'balance':
+                self.reply_balance(note_from)
+
+            elif command.kind == 'close':
+                self.close_user_positions(note_from)
+        else:
+            EVENTS.inc(str(event['kind']), 'seen')
+
+    def reply_status(self, user):
+        orders = self.order_manager.list_user_orders(user, OrderManager.ACTIVE_STATUS)
+        if not orders:
+            msg = "You don't have any running order!"
+        else:
+            lines = []
+            for order in orders:
+                line = f"{order.order_type.upper()} {order.amount}sats x{order.leverage}: {order.status}"
+                if order.status == 'open':
+                    line += f" at {order.open_price}, TP={order.tp}"
+                lines.append(line)
+            msg = '\n'.join(lines)
+        self.reply_to(None, user, msg, 'dm')
+
+    def reply_balance(self, user):
+        balance = self.order_manager.get_user_balance(user)
+        if balance > 0:
+            msg = f'You can withdraw {balance}sats, just send "lnurl" or "invoice" by DM!'
+        else:
+            msg = "Nothing to withdraw!"
+        self.reply_to(None, user, msg, 'dm')
+
+    def close_user_positions(self, user):
+        orders = self.order_manager.list_user_orders(user, ['open'])
+        if not orders:
+            self.reply_to(None, user, "You don't have any open position!", 'dm')
+            return
+        for order in orders:
+            if not self.lnm.close_position(order.lnm_id):
+                self.reply_to(None, user, f"Fail to close order {order.order_id[:5]}_{order.order_id[-5:]}, retry later!", 'dm')
+        # closed positions are then settled by check_open_orders()
 
     def on_new_order(self, order):
         # invoice = RPC.invoice(order.amount, order.order_id)
         invoice, hash = self.lnm.deposit_invoice(order.amount,)
         log.info('Generate invoice')
-        log.log(15,f'invoice: {invoice}')
+        log.log(15, "invoice: %s", invoice)
         self.set_order_unpaid.emit({'order_id': order.order_id, 'invoice': invoice, 'hash': hash})
         
     def on_unpaid(self, order):
@@ -474,7 +602,7 @@ class NostrBot(QObject):
     
     def on_funded(self, order):
         log.info(f'Funding success for invoice {order.order_id[:5]}_{order.order_id[-5:]}')
-        log.log(15, f"on_funded({order=})")
+        log.log(15, "on_funded(order=%r)", order)
         # TODO: Log it in separate records
         # TODO: handle if position fail to open
         price = self.lnm.get_price()
@@ -498,9 +626,8 @@ class NostrBot(QObject):
                 tp = round((1 + delta) * price)
             else:
                 tp = round((1 - delta) * price)
-            order.tp = tp
-            order.save()
-            log.log(15, f"Random TP set at {tp} ({delta=})")
+            self.order_manager.set_order_tp(order.order_id, tp)
+            log.log(15, "Random TP set at %s (delta=%r)", tp, delta)
 
         if order.order_type == 'long':
             if tp < price + 100:
@@ -515,7 +642,7 @@ class NostrBot(QObject):
         #     else:
         #         self.reply_to(order.order_id, order.user, "TP too close, disabled, you'll be hedged or rekt!", order.mode)
 
-        position = self.lnm.open_market_position(order.order_type, order.amount, order.leverage, tp)
+        position = self.lnm.open_market_position(order.order_type, order.amount, order.leverage, tp, price)
         if not position:
             log.info("Open position fail!")
             return
@@ -561,7 +688,7 @@ class NostrBot(QObject):
         # TODO: cleanup db and log history?
 
     def detach_withdraw(self, data):
-        log.log(15, f"detach_withdraw({data=})")
+        log.log(15, "detach_withdraw(data=%r)", data)
         amount = data["total_amount"]
         invoice = data['invoice']
         # withdraw directly from LNM
@@ -573,15 +700,15 @@ class NostrBot(QObject):
             function = RPC.pay_invoice
             params = (invoice,)
 
-        worker = Worker(function, params)
-        worker.data = data
-        # append worker to list belonging to self for avoid thread stop by garbage collector
-        self.worker_list.append(worker)
-        worker.result.connect(self.after_detach_withdraw)
-        worker.start()
+        if not self.withdraw_pool.submit(function, params, data=data):
+            self.after_detach_withdraw({'data': data, 'return': False})
+
+    def on_withdraw_timeout(self, data):
+        log.info(f"Withdraw of {data['total_amount']}sats still pending, "
+                 f"{self.withdraw_pool.active_count()} active, {self.withdraw_pool.queue_depth()} queued")
 
     def after_detach_withdraw(self, out):
-        log.log(15, f"after_detach_withdraw({out=})")
+        log.log(15, "after_detach_withdraw(out=%r)", out)
         ret = out['return']
         data = out['data']
 
@@ -589,14 +716,7 @@ class NostrBot(QObject):
             # switch all orders status back to 'closed'
             batch_list = data['batch_list']
             user = batch_list[0].user
-            for order in batch_list:
-                order_id = order.order_id
-                price = order.close_price
-                data = {
-                    'order_id': order_id,
-                    'price': price,
-                }
-                self.set_order_status_withdraw_fail.emit(data)
+            self.set_orders_withdraw_fail.emit([order.order_id for order in batch_list])
             # Notify user
             msg = 'Cannot process to withdraw, retry later!'
             self.reply_to(None, user, msg, 'dm')
@@ -604,20 +724,17 @@ class NostrBot(QObject):
             self.set_order_withdraw_done.emit(data)
 
     def on_withdraw_requested(self, data):
-        log.log(15, f"on_withdraw_requested({data=})")
+        log.log(15, "on_withdraw_requested(data=%r)", data)
         if data['mode'] == 'lnurl':
             user = data['batch_list'][0].user
-            if user in self.lnurl_list.keys():
-                url = self.lnurl_list[user]
-                invoice = LUD16.get_invoice(url, data['total_amount'])
-                if not invoice:
-                    return
-                data['invoice'] = invoice
-                # Start withdraw in a new thread, trigger set_order_withdraw_done on withdrawal end
-                self.detach_withdraw(data)
+            url = self.users.get_lud16(user)
+            if url:
+                future = self.lud16.get_invoice_async(url, data['total_amount'])
+                future.add_done_callback(lambda f: self.lud16_invoice.emit({'data': data, 'invoice': f.result()}))
 
             else:
-                # Notice user that no public lnurl
+                # orders back to withdrawable, notice user that no public lnurl
+                self.set_orders_withdraw_fail.emit([order.order_id for order in data['batch_list']])
                 msg = "You don't have a public LUD16 LNURL! add one or withdraw by invoice!"
                 self.reply_to(None, user, msg, 'dm')
                 return
@@ -630,8 +747,20 @@ class NostrBot(QObject):
             # msg = f"Please send me BOLT11 invoice for amount: {amount}sats"
             # self.reply_to(None, user, msg, 'dm')
 
+    def on_lud16_invoice(self, out):
+        data = out['data']
+        invoice = out['invoice']
+        if not invoice:
+            user = data['batch_list'][0].user
+            self.set_orders_withdraw_fail.emit([order.order_id for order in data['batch_list']])
+            self.reply_to(None, user, "Cannot get an invoice from your LUD16 address, retry later or withdraw by invoice!", 'dm')
+            return
+        data['invoice'] = invoice
+        # Start withdraw in a new thread, trigger set_order_withdraw_done on withdrawal end
+        self.detach_withdraw(data)
+
     def on_withdraw_notify_amount(self, data):
-        log.log(15, f"on_withdraw_notify_amount({data})")
+        log.log(15, "on_withdraw_notify_amount(%s)", data)
         # Notify user to send an invoice
         if len(data['batch_list']) == 0:
             user = data['user']
@@ -652,7 +781,7 @@ class NostrBot(QObject):
         self.reply_to(None, user, msg, 'dm')
 
     def on_withdraw_done(self, data):
-        log.log(15,f"on_withdraw_done({data=})")
+        log.log(15, "on_withdraw_done(data=%r)", data)
         user = data['batch_list'][0].user
         msg = f"Successfully withdraw {data['total_amount']}sats!"
         self.reply_to(None, user, msg, 'dm')
@@ -661,13 +790,11 @@ class NostrBot(QObject):
         pass
 
 
-app = QCoreApplication()
-bot = NostrBot(config.key)
-bot.loop_worker.start()
-
-app.exec()
-
-sys.exit(0)
-
+if __name__ == '__main__':
+    app = QCoreApplication()
+    bot = NostrBot(config.key)
+    bot.start()
 
+    app.exec()
 
+    sys.exit(0)
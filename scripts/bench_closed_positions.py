@@ -0,0 +1,121 @@
+import os
+import time
+import random
+import tempfile
+import tracemalloc
+import multiprocessing
+
+import requests
+
+from fake_lnm import JsonClient, serve
+import config
+
+#  check_open_orders close detection with a 100k closed positions account:
+#  full history download per close (before) vs incremental cached sync,
+#  then a restart with the cursor persisted in checkpoints.
+#  The REST stand-in runs in its own process.
+
+HISTORY = 100000
+CLOSES = 5
+
+
+def position(i, closed_ts):
+    return {
+        'id': f"{i:08x}-0000-4000-8000-{i:012x}", 'uid': 'u', 'type': 'm', 'side': random.choice('bs'),
+        'margin': 1000, 'pl': random.randint(-1000, 1000), 'price': 30000.5, 'quantity': 1, 'leverage': 50,
+        'liquidation': 29500.0, 'stoploss': 0, 'takeprofit': 31000, 'exit_price': 30500.5, 'creation_ts': closed_ts - 3600000,
+        'market_filled_ts': closed_ts - 3599000, 'closed_ts': closed_ts, 'opening_fee': 2, 'closing_fee': 2,
+        'sum_carry_fees': 1, 'open': False, 'running': False, 'canceled': False, 'closed': True,
+    }
+
+
+if __name__ == '__main__':
+    now = int(time.time() * 1000)
+    closed = [position(i, now - (HISTORY - i) * 60000) for i in range(HISTORY)]
+    running = [position(HISTORY + i, 0) for i in range(CLOSES)]
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(queue,), kwargs={'closed': closed, 'running': running},
+                                      daemon=True)
+    process.start()
+    url = queue.get()
+    config.lnm_base_url = url
+
+    from LNM import LNMarkets
+
+    lnm = LNMarkets('k', 's', 'p')
+    lnm.client = JsonClient(lnm.client)
+
+    def requests_count():
+        return requests.get(f"{url}/fake/stats").json()['requests'] - 1
+
+    # before: whole history on every close
+    times = []
+    for i in range(CLOSES):
+        start = time.monotonic()
+        positions = {p['id']: p for p in lnm.fetch_closed_positions()}
+        times.append(time.monotonic() - start)
+    print(f"full download: {sum(times) / len(times) * 1000:.0f}ms per close, {len(positions)} positions per request")
+    del positions
+
+    # after: first sync fetch the history once (paged), then incremental
+    base = requests_count()
+    start = time.monotonic()
+    lnm.sync_closed_positions()
+    first = time.monotonic() - start
+    requests_first = requests_count() - base - 1
+    # again, to measure the cache size
+    lnm.closed_positions = {}
+    lnm.closed_cursor = None
+    tracemalloc.start()
+    lnm.sync_closed_positions()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"first sync: {first * 1000:.0f}ms, {requests_first} requests, "
+          f"{len(lnm.closed_positions)} cached ({size / len(lnm.closed_positions):.0f} bytes/position)")
+
+    # first sync bounded by the oldest open order, opened now
+    lnm.closed_positions = {}
+    lnm.closed_cursor = None
+    base = requests_count()
+    start = time.monotonic()
+    lnm.sync_closed_positions([], since=int(time.time() * 1000))
+    print(f"first sync from the oldest open order: {(time.monotonic() - start) * 1000:.1f}ms, "
+          f"{requests_count() - base - 1} requests")
+
+    times = []
+    base = requests_count()
+    for i in range(CLOSES):
+        p = running[i]
+        p['closed_ts'] = int(time.time() * 1000) + i
+        requests.post(f"{url}/fake/close", json=p)
+        start = time.monotonic()
+        assert lnm.get_closed_position(p['id']).exit_price == 30500.5
+        times.append(time.monotonic() - start)
+        lnm.forget_closed_position(p['id'])
+    print(f"incremental: {sum(times) / len(times) * 1000:.1f}ms per close, "
+          f"{requests_count() - base - 1 - CLOSES} requests for {CLOSES} closes")
+
+    ids = [p['id'] for p in closed]
+    start = time.monotonic()
+    for _ in range(100000):
+        lnm.closed_positions.get(ids[random.randrange(HISTORY)])
+    print(f"lookup: {(time.monotonic() - start) * 10:.2f}us")
+
+    # restart: the cursor is persisted, positions of settled orders are evicted
+    from Checkpoints import Checkpoints
+
+    path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+    checkpoints = Checkpoints(path)
+    lnm = LNMarkets('k', 's', 'p', checkpoints=checkpoints)
+    lnm.client = JsonClient(lnm.client)
+    lnm.sync_closed_positions([])
+    print(f"no open order: {len(lnm.closed_positions)} positions kept in cache (closed in the last minute)")
+    checkpoints.close()
+
+    checkpoints = Checkpoints(path)
+    lnm = LNMarkets('k', 's', 'p', checkpoints=checkpoints)
+    lnm.client = JsonClient(lnm.client)
+    base = requests_count()
+    start = time.monotonic()
+    lnm.sync_closed_positions([])
+    print(f"sync after restart: {(time.monotonic() - start) * 1000:.1f}ms, {requests_count() - base - 1} requests")
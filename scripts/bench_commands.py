@@ -0,0 +1,78 @@
+import re
+import time
+import random
+
+import Command
+
+#  Commands/sec of Command.parse against the former substring + re.findall
+#  chain, on a synthetic corpus of mention texts
+
+SIZE = 200_000
+RUNS = 5
+random.seed(1)
+
+npub = 'nostr:npub15w8szlfuwx86zt62q73mkude9gtsm8rzzjshlj3ug8wf6wprvhcsj2nuj0'
+chatter = [
+    'gm', 'this bot is fun', 'wen moon?', 'I got rekt again lol', 'zap me', 'hodl', 'how does it work?',
+    'LFG!!', 'short the top', 'long live bitcoin', 'nice', 'who made this?', '#plebchain #bitcoin',
+    'check https://lnmarkets.com', 'is it down?', 'ty for the sats',
+]
+commands = [
+    'long {a}', 'short {a}', 'long {a} tp{tp}', 'short {a} tp{tp} x{x}', 'LONG {a} x{x}', 'long {a} tp{tp} x{x}',
+    'lnurl', 'invoice', 'lnbc10u1pjtz58msp5z03z8x4d2pu0wuycq2sjd93d63ws9k72y2zdg3lkx7mv3pw04y5spp562ejss',
+    'status', 'balance', 'close',
+]
+
+
+def note():
+    parts = []
+    if random.random() < 0.7:
+        parts.append(npub)
+    if random.random() < 0.6:
+        parts.append(random.choice(chatter))
+    if random.random() < 0.5:
+        parts.append(random.choice(commands).format(a=random.randint(50, 50000), tp=random.randint(20000, 60000),
+                                                    x=random.randint(1, 100)))
+    if random.random() < 0.3:
+        parts.append(random.choice(chatter))
+    return ' '.join(parts)
+
+
+def former(note_content, dm):
+    note_content = note_content.lower()
+    if ('long ' in note_content) or ('short ' in note_content):
+        pattern_long = r'\blong\s+(\d+)\b'
+        pattern_short = r'\bshort\s+(\d+)\b'
+        pattern_leverage = r'\bx(\d+)\b'
+        pattern_tp = r'\btp(\d+)\b'
+        if ('long' in note_content) and ('short' in note_content):
+            return
+        elif 'long' in note_content:
+            amount = re.findall(pattern_long, note_content)
+        else:
+            amount = re.findall(pattern_short, note_content)
+        leverage = re.findall(pattern_leverage, note_content)
+        tp = re.findall(pattern_tp, note_content)
+        return 'trade', amount, leverage, tp
+    elif ('lnurl' in note_content) and dm:
+        return 'lnurl'
+    elif ('invoice' in note_content) and dm:
+        return 'invoice'
+    elif ('lnbc' in note_content) and dm:
+        return re.findall(r'lnbc\S+', note_content)[0]
+
+
+corpus = [(note(), random.random() < 0.5) for _ in range(SIZE)]
+
+# best of RUNS, the host is shared
+for name, function in (('former', former), ('Command.parse', Command.parse)):
+    elapsed = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for content, dm in corpus:
+            function(content, dm)
+        elapsed.append(time.perf_counter() - start)
+    print(f"{name:<14} {SIZE / min(elapsed):10.0f} notes/s")
+
+print(Command.parse(f"{npub} short 250 tp9000 x50"))
+print(Command.parse('lnbc10u1pjtz58msp5 please', dm=True))
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+
+from nostr.key import PrivateKey
+
+from Nip04 import CryptoPipeline
+
+#  DM burst: decrypt N encrypted DMs through CryptoPipeline with 1..W workers
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+SENDERS = 300
+MAX_WORKERS = max(os.cpu_count() or 1, 4)
+
+bot = PrivateKey()
+senders = [PrivateKey() for _ in range(SENDERS)]
+burst = []
+for i in range(MESSAGES):
+    sender = senders[i % SENDERS]
+    burst.append((sender.encrypt_message(f"long {i} tp35000 x50", bot.public_key.hex()), sender.public_key.hex()))
+print(f"{MESSAGES} DMs from {SENDERS} users, {os.cpu_count()} cpu")
+
+start = time.perf_counter()
+for content, pubkey in burst:
+    bot.decrypt_message(content, pubkey)
+print(f"{'inline':<18} {MESSAGES / (time.perf_counter() - start):8.0f} msg/s")
+
+for mode in ('thread', 'process'):
+    workers = 1
+    while workers <= MAX_WORKERS:
+        pipeline = CryptoPipeline(bot, workers=workers, mode=mode)
+        # warm up workers
+        pipeline.decrypt(*burst[0]).result()
+        start = time.perf_counter()
+        futures = [pipeline.decrypt(content, pubkey) for content, pubkey in burst]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        print(f"{mode + ' x' + str(workers):<18} {MESSAGES / elapsed:8.0f} msg/s")
+        pipeline.shutdown()
+        workers *= 2
+
+#  Per message cost for repeat correspondents, shared secret cache vs ECDH each time
+import Nip04
+
+Nip04.init(bot.raw_secret)
+for label, function in (('nostr decrypt_message', bot.decrypt_message), ('Nip04.decrypt (cached)', Nip04.decrypt)):
+    start = time.perf_counter()
+    for content, pubkey in burst:
+        assert function(content, pubkey).startswith('long')
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed / MESSAGES * 1e6:7.1f}us/msg")
+print(f"cache: {Nip04._secrets.hits} hits, {Nip04._secrets.misses} misses")
+
+reply = Nip04.encrypt('hello', senders[0].public_key.hex())
+assert senders[0].decrypt_message(reply, bot.public_key.hex()) == 'hello'
@@ -0,0 +1,370 @@
+import os
+import sys
+import json
+import time
+import types
+import queue
+import random
+import inspect
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import bolt11
+import secp256k1
+from nostr.key import PrivateKey
+
+from fake_relay import FakeRelay, make_event
+from fake_lnm import FakeLNMRest, FakeTicker, JsonClient
+from fake_cln import FakeLightningd
+from fake_lnurl import FakeLnurl, make_invoice
+import nostr_fork
+
+#  End-to-end load benchmark: NostrBot + OrderManager against local stand-ins
+#  (relay, LNMarkets REST + ticker, lightningd socket, LUD16 wallet).
+#  Every order goes mention/DM -> invoice -> paid -> open -> close -> withdraw,
+#  per stage latencies and throughput are written as JSON, comparable across commits.
+#
+#  PYTHONPATH=.:scripts python scripts/bench_e2e.py --users 20 --orders 200 --output e2e.json
+#
+#  The bot needs the nostr fork of requirements.md, on PyPI nostr the fork's
+#  event API is patched in by nostr_fork (bench only).
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['invoice', 'open', 'close', 'withdraw_prompt', 'withdraw', 'total']
+FAILURES = ('Cannot ', 'Fail ', 'Wrong invoice', "You don't have", 'Position value < 1$', 'Nothing to withdraw')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='rektBot end-to-end load benchmark')
+    parser.add_argument('--users', type=int, default=10, help='concurrent users, one order at a time each')
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=5.0, help='new orders per second (all users)')
+    parser.add_argument('--hold', type=float, default=1.0, help='seconds between position open and close')
+    parser.add_argument('--dm-share', type=float, default=0.3, help='orders sent by DM instead of mention')
+    parser.add_argument('--withdraw-share', type=float, default=0.8, help='closed orders withdrawn right away')
+    parser.add_argument('--lnurl-share', type=float, default=0.5, help='withdrawals by LUD16 instead of invoice')
+    parser.add_argument('--min-amount', type=int, default=500, help='sats, <= 1000 are withdrawn by our node')
+    parser.add_argument('--max-amount', type=int, default=5000)
+    parser.add_argument('--leverage', type=int, default=10)
+    parser.add_argument('--relay-delay', type=float, default=0.0)
+    parser.add_argument('--lnm-delay', type=float, default=0.02)
+    parser.add_argument('--cln-delay', type=float, default=0.01)
+    parser.add_argument('--lnurl-delay', type=float, default=0.02)
+    parser.add_argument('--unpaid-interval', type=float, default=0.5)
+    parser.add_argument('--open-interval', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=30.0, help='per reply')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON result file (default: stdout)')
+    return parser.parse_args()
+
+
+class Failure(Exception):
+    pass
+
+
+class ObservedRelay(FakeRelay):
+    """
+    Relay stand-in handing every event published by the bot to on_bot_event.
+    """
+
+    def __init__(self, bot_pubkey, on_bot_event, **kwargs):
+        FakeRelay.__init__(self, **kwargs)
+        self.bot_pubkey = bot_pubkey
+        self.on_bot_event = on_bot_event
+
+    def inject(self, event: dict):
+        FakeRelay.inject(self, event)
+        if event['pubkey'] == self.bot_pubkey:
+            self.on_bot_event(event)
+
+
+class User:
+
+    def __init__(self, index, bot_pubkey):
+        self.key = PrivateKey()
+        self.signer = secp256k1.PrivateKey(self.key.raw_secret)
+        self.pubkey = self.key.public_key.hex()
+        self.bot_pubkey = bot_pubkey
+        self.lud16 = f"user{index}@wallet.bench"
+        # (received at, content, referenced event ids)
+        self.inbox = queue.Queue()
+
+    def receive(self, event):
+        content = event['content']
+        if event['kind'] == 4:
+            content = self.key.decrypt_message(content, self.bot_pubkey)
+        refs = [tag[1] for tag in event['tags'] if tag[0] == 'e']
+        self.inbox.put((time.monotonic(), content, refs))
+
+    def note(self, content) -> dict:
+        return make_event(self.signer, 1, content, [['p', self.bot_pubkey]])
+
+    def dm(self, content) -> dict:
+        return make_event(self.signer, 4, self.key.encrypt_message(content, self.bot_pubkey), [['p', self.bot_pubkey]])
+
+    def profile(self) -> dict:
+        return make_event(self.signer, 0, json.dumps({'name': self.lud16.split('@')[0], 'lud16': self.lud16}))
+
+    def expect(self, prefix, timeout, ref=None):
+        """
+        Wait for a reply starting with prefix (referencing ref), return (received at, content).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                received, content, refs = self.inbox.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise Failure(f"timeout waiting '{prefix}'")
+            if ref is not None and ref not in refs:
+                continue
+            if content.startswith(prefix):
+                return received, content
+            if content.startswith(FAILURES):
+                raise Failure(content.split('\n')[0])
+
+
+class Driver:
+    """
+    Run orders through the bot, at most one in flight per user.
+    """
+
+    def __init__(self, args, relay, lnm_rest, order_manager, users):
+        self.args = args
+        self.relay = relay
+        self.lnm_rest = lnm_rest
+        self.order_manager = order_manager
+        self.users = users
+        self.samples = {stage: [] for stage in STAGES}
+        self.failures = {}
+        self.withdrawals = {'invoice': 0, 'lnurl': 0}
+        self.completed = 0
+        self.next_order = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def record(self, stage, value):
+        with self.lock:
+            self.samples[stage].append(value)
+
+    def fail(self, reason):
+        with self.lock:
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def run(self):
+        self.start = time.monotonic()
+        threads = [threading.Thread(target=self.run_user, args=(user,), daemon=True) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.monotonic() - self.start
+        self.done.set()
+
+    def run_user(self, user):
+        rng = random.Random(f"{self.args.seed}-{user.lud16}")
+        while True:
+            with self.lock:
+                index = self.next_order
+                self.next_order += 1
+            if index >= self.args.orders:
+                return
+            # arrivals paced at `rate` orders per second, at most `users` in flight
+            delay = self.start + index / self.args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.run_order(user, rng)
+                with self.lock:
+                    self.completed += 1
+            except Failure as e:
+                self.fail(str(e))
+            except Exception as e:
+                self.fail(f"{type(e).__name__}: {e}")
+
+    def run_order(self, user, rng):
+        args = self.args
+        side = rng.choice(['long', 'short'])
+        amount = rng.randint(args.min_amount, args.max_amount)
+        content = f"{side} {amount} x{args.leverage}"
+        event = user.dm(content) if rng.random() < args.dm_share else user.note(content)
+        order_id = event['id']
+
+        sent = time.monotonic()
+        self.relay.inject(event)
+        received, invoice = user.expect('lnbc', args.timeout, order_id)
+        self.record('invoice', received - sent)
+
+        paid = time.monotonic()
+        self.lnm_rest.pay_deposit(bolt11.decode(invoice).payment_hash)
+        received, _ = user.expect(f"{side.upper()} open at", args.timeout, order_id)
+        self.record('open', received - paid)
+
+        time.sleep(args.hold)
+        lnm_id = self.order_manager.get_order_by_id(order_id).lnm_id
+        closed = time.monotonic()
+        self.lnm_rest.close_position(lnm_id, self.lnm_rest.price * rng.uniform(0.99, 1.01))
+        received, _ = user.expect('Trade closed at', args.timeout, order_id)
+        self.record('close', received - closed)
+
+        if rng.random() < args.withdraw_share:
+            mode = 'lnurl' if rng.random() < args.lnurl_share else 'invoice'
+            requested = time.monotonic()
+            self.relay.inject(user.dm(mode))
+            if mode == 'invoice':
+                received, prompt = user.expect('Please send me BOLT11 invoice for amount:', args.timeout)
+                self.record('withdraw_prompt', received - requested)
+                total = int(prompt.split(':')[1].strip().rstrip('sats'))
+                self.relay.inject(user.dm(make_invoice(total * 1000)))
+            received, _ = user.expect('Successfully withdraw', args.timeout)
+            self.record('withdraw', received - requested)
+            with self.lock:
+                self.withdrawals[mode] += 1
+        self.record('total', time.monotonic() - sent)
+
+
+def summary(samples) -> dict:
+    # same percentile as Scheduler.Latency
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def percentile(p):
+        return round(samples[min(int(len(samples) * p / 100), len(samples) - 1)] * 1000, 1)
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(50),
+        'p99_ms': percentile(99),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 1),
+        'max_ms': round(samples[-1] * 1000, 1),
+    }
+
+
+def git_revision() -> dict:
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=REPO, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD'), 'subject': git('log', '-1', '--format=%s'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    output = os.path.abspath(args.output) if args.output else None
+    # bot.sqlite, history and rektBot.log of the run
+    workdir = tempfile.mkdtemp(prefix='rektbot-e2e-')
+    os.chdir(workdir)
+
+    bot_key = PrivateKey()
+    bot_pubkey = bot_key.public_key.hex()
+    users = [User(i, bot_pubkey) for i in range(args.users)]
+    by_pubkey = {user.pubkey: user for user in users}
+
+    def on_bot_event(event):
+        for tag in event['tags']:
+            if tag[0] == 'p' and tag[1] in by_pubkey:
+                by_pubkey[tag[1]].receive(event)
+
+    relay = ObservedRelay(bot_pubkey, on_bot_event, delay=args.relay_delay).start()
+    lnm_rest = FakeLNMRest(delay=args.lnm_delay, balance=10 ** 8).start()
+    ticker = FakeTicker(price=lnm_rest.price).start()
+    cln = FakeLightningd(os.path.join(workdir, 'lightning-rpc'), delay=args.cln_delay).start()
+    lnurl = FakeLnurl(delay=args.lnurl_delay).start()
+    for user in users:
+        relay.inject(user.profile())
+
+    # config is read at import by RPC and main
+    config = types.ModuleType('config')
+    config.key = bot_key.bech32()
+    config.lnmarkets = {'key': 'k', 'secret': 's', 'passphrase': 'p'}
+    config.relays = [relay.url]
+    config.relay_min_ready = 1
+    config.lnm_base_url = lnm_rest.url
+    config.lnm_ws_url = ticker.url
+    config.lightning_rpc = cln.path
+    config.lud16_base_url = lnurl.url
+    config.unpaid_interval = args.unpaid_interval
+    config.open_interval = args.open_interval
+    config.log_stream_level = logging.WARNING
+    sys.modules['config'] = config
+
+    from PySide6.QtCore import QCoreApplication, QTimer
+    from lnmarkets import rest
+    nostr_fork.install()
+    import main as bot_main
+    from LNM import LNMarkets
+
+    app = QCoreApplication([])
+    lnm = LNMarkets('k', 's', 'p', 0.002)
+    if 'format' not in inspect.signature(rest.LNMarketsRest.futures_get_ticker).parameters:
+        # lnmarkets releases without format='json'
+        lnm.client = JsonClient(lnm.client)
+    bot = bot_main.NostrBot(config.key, lnm=lnm)
+    bot.start()
+
+    driver = Driver(args, relay, lnm_rest, bot.order_manager, users)
+    threading.Thread(target=driver.run, daemon=True, name='driver').start()
+    timer = QTimer()
+    timer.timeout.connect(lambda: driver.done.is_set() and app.quit())
+    timer.start(100)
+    app.exec()
+    bot.stop()
+
+    result = {
+        'benchmark': 'e2e',
+        'git': git_revision(),
+        'params': vars(args),
+        'elapsed_s': round(driver.elapsed, 3),
+        'orders': {
+            'started': min(driver.next_order, args.orders),
+            'completed': driver.completed,
+            'failed': sum(driver.failures.values()),
+        },
+        'throughput': {
+            'orders_per_s': round(driver.completed / driver.elapsed, 3),
+            'orders_per_min': round(driver.completed / driver.elapsed * 60, 1),
+        },
+        'stages': {stage: summary(samples) for stage, samples in driver.samples.items()},
+        'failures': driver.failures,
+        'withdrawals': driver.withdrawals,
+        'bot': {
+            'reply_p50_ms': round((bot.latency.percentile(50) or 0) * 1000, 1),
+            'reply_p99_ms': round((bot.latency.percentile(99) or 0) * 1000, 1),
+            'scheduler': {job.name: {'runs': job.runs, 'errors': job.errors, 'overruns': job.overruns,
+                                     'skipped': job.skipped}
+                          for job in bot.scheduler.jobs.values()},
+            'publisher': bot.publisher.stats(),
+            'lnm': lnm.stats(),
+        },
+        'stand_ins': {
+            'relay_requests': relay.requests,
+            'lnm_requests': lnm_rest.requests,
+            'lnm_connections': len(lnm_rest.connections),
+            'lnm_withdrawals': len(lnm_rest.withdrawals),
+            'cln_calls': cln.calls,
+            'lnurl_requests': lnurl.requests,
+        },
+    }
+
+    for stage, stats in result['stages'].items():
+        if stats['count']:
+            print(f"{stage:>16}: n={stats['count']:<5} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms",
+                  file=sys.stderr)
+    print(f"{driver.completed}/{args.orders} orders in {driver.elapsed:.1f}s, "
+          f"{result['throughput']['orders_per_min']} orders/min, failures: {driver.failures}", file=sys.stderr)
+
+    data = json.dumps(result, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+
+    for server in (relay, lnm_rest, ticker, cln, lnurl):
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
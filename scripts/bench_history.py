@@ -0,0 +1,44 @@
+import os
+import time
+import secrets
+import tempfile
+
+from History import History, SeenEvent
+
+#  Lookup cost of History while the store grows up to 1M+ event ids
+
+STEPS = [10_000, 100_000, 1_000_000, 1_200_000]
+LOOKUPS = 10_000
+
+path = os.path.join(tempfile.mkdtemp(), 'history.sqlite')
+history = History(db_path=path, legacy_path=None, batch_size=10_000)
+
+stored = []
+count = 0
+for step in STEPS:
+    start = time.perf_counter()
+    while count < step:
+        event_id = secrets.token_hex(32)
+        history.add(event_id)
+        if count % 100 == 0:
+            stored.append(event_id)
+        count += 1
+    history.flush()
+    insert = time.perf_counter() - start
+
+    new_ids = [secrets.token_hex(32) for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for event_id in new_ids:
+        assert event_id not in history
+    miss = (time.perf_counter() - start) / LOOKUPS
+
+    old_ids = stored[-LOOKUPS:]
+    start = time.perf_counter()
+    for event_id in old_ids:
+        assert event_id in history
+    hit = (time.perf_counter() - start) / len(old_ids)
+
+    print(f"{count:>9} ids | insert {insert:6.2f}s | "
+          f"new id lookup {miss * 1e6:6.2f}us | seen id lookup {hit * 1e6:6.2f}us")
+
+history.close()
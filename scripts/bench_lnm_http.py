@@ -0,0 +1,58 @@
+import json
+import time
+import threading
+
+import requests
+from lnmarkets import rest
+
+import config
+from fake_lnm import FakeLNMRest, JsonClient
+
+#  LNMarkets wrapper against a local REST stand-in: concurrent pollers asking
+#  ticker / running positions / balance, raw client vs pooled + coalesced
+
+THREADS = 8
+CALLS = 30
+DELAY = 0.02
+
+
+def run(calls):
+    def poll():
+        for _ in range(CALLS):
+            for call in calls:
+                call()
+    threads = [threading.Thread(target=poll) for _ in range(THREADS)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start
+
+
+server = FakeLNMRest(delay=DELAY, running=[{'id': str(i)} for i in range(20)], balance=1000).start()
+config.lnm_base_url = server.url
+total = THREADS * CALLS * 3
+
+# raw lnmarkets client: one connection per request, no coalescing
+client = JsonClient(rest.LNMarketsRest(key='k', secret='s', passphrase='p'))
+rest.request = lambda method, url, **kwargs: requests.request(method, server.url + url[url.index('/v1'):], **kwargs)
+elapsed = run([lambda: client.futures_get_ticker(format='json'),
+               lambda: client.futures_get_positions({'type': 'running'}, format='json'),
+               lambda: client.get_user(format='json')])
+print(f"raw client: {total} calls in {elapsed:.2f}s, {server.requests} HTTP requests, "
+      f"{len(server.connections)} connections")
+
+from LNM import LNMarkets
+from Http import SingleFlight
+
+lnm = LNMarkets('k', 's', 'p')
+lnm.client = JsonClient(lnm.client)
+for ttl in (0, 1.0):
+    server.requests = 0
+    server.connections.clear()
+    lnm.reads = SingleFlight(ttl)
+    elapsed = run([lnm.fetch_price, lnm.get_running_positions, lnm.get_free_balance])
+    print(f"LNMarkets ttl={ttl}: {total} calls in {elapsed:.2f}s, {server.requests} HTTP requests, "
+          f"{len(server.connections)} connections, {lnm.stats()}")
+server.stop()
@@ -0,0 +1,105 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+
+import Logs
+
+#  Event flood: THREADS threads logging like listen_notifications/handle_event
+#  (INFO + level 15 event dump), time spent in the logging threads and until
+#  every record is written. Synchronous handlers + f-strings (before) vs
+#  queue pipeline + lazy args (after).
+
+THREADS = 4
+EVENTS = 5000
+DEB = 15
+
+logging.addLevelName(DEB, 'DEBG')
+log = logging.getLogger()
+event = {
+    'id': os.urandom(32).hex(), 'pubkey': os.urandom(32).hex(), 'created_at': int(time.time()), 'kind': 4,
+    'tags': [['p', os.urandom(32).hex()]], 'content': 'x' * 200, 'sig': os.urandom(64).hex(),
+}
+workdir = tempfile.mkdtemp()
+
+
+def eager():
+    for _ in range(EVENTS):
+        log.info(f"Get notification")
+        log.log(DEB, f"Event:{event}")
+
+
+def lazy():
+    for _ in range(EVENTS):
+        log.info("Get notification")
+        log.log(DEB, "Event:%s", event)
+
+
+def flood(function) -> float:
+    threads = [threading.Thread(target=function) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def sync_handlers(path, level=DEB):
+    # main.py logging setup before the queue pipeline
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.setLevel(logging.DEBUG if level == DEB else level)
+    formatter = logging.Formatter(Logs.FORMAT)
+    file_handler = logging.FileHandler(path)
+    file_handler.setLevel(level)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.WARNING)
+    stream_handler.setFormatter(formatter)
+    log.addHandler(file_handler)
+    log.addHandler(stream_handler)
+    return file_handler
+
+
+def run(name, setup, function):
+    path = os.path.join(workdir, f"{name}.log")
+    start = time.perf_counter()
+    listener = setup(path)
+    logging_time = flood(function)
+    if isinstance(listener, logging.FileHandler):
+        listener.close()
+    else:
+        listener.stop()
+    total = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir) if f.startswith(name))
+    records = THREADS * EVENTS * 2
+    print(f"{name:>28}: {logging_time:.2f}s in logging threads ({records / logging_time:,.0f} records/s), "
+          f"{total:.2f}s until written, {size / 1e6:.1f}MB")
+
+
+run('sync f-string', sync_handlers, eager)
+run('queue lazy', lambda path: Logs.setup(path, stream_level=logging.WARNING), lazy)
+run('queue lazy json', lambda path: Logs.setup(path, stream_level=logging.WARNING, json_lines=True), lazy)
+run('queue lazy rotating', lambda path: Logs.setup(path, stream_level=logging.WARNING, max_bytes=2 * 10 ** 6), lazy)
+print('level 15 disabled (log_level=INFO):')
+run('sync f-string INFO', lambda path: sync_handlers(path, logging.INFO), eager)
+run('queue lazy INFO', lambda path: Logs.setup(path, level=logging.INFO, stream_level=logging.WARNING), lazy)
+
+# disk stalls (1ms every 100 writes) are paid by the logging threads only with synchronous handlers
+writes = [0]
+emit = logging.FileHandler.emit
+
+
+def slow_emit(self, record):
+    writes[0] += 1
+    if writes[0] % 100 == 0:
+        time.sleep(0.001)
+    emit(self, record)
+
+
+logging.FileHandler.emit = slow_emit
+print('slow disk:')
+run('sync f-string slow disk', sync_handlers, eager)
+run('queue lazy slow disk', lambda path: Logs.setup(path, stream_level=logging.WARNING), lazy)
@@ -0,0 +1,77 @@
+import time
+import queue
+import random
+import threading
+
+from Scheduler import Scheduler, Latency
+
+#  Note -> reply latency of the former polling loop vs the Scheduler,
+#  with LNM calls simulated by sleeps
+
+DURATION = 20
+EVENT_RATE = 2          # events / second
+LNM_DELAY = 0.4         # one LNM round trip
+REPLY_DELAY = 0.01      # handle_event + reply_to
+
+
+def producer(events, latency, stop):
+    i = 0
+    while not stop.is_set():
+        time.sleep(random.expovariate(EVENT_RATE))
+        latency.mark(i)
+        events.put(i)
+        i += 1
+
+
+def handle(latency, event):
+    time.sleep(REPLY_DELAY)
+    latency.done(event)
+
+
+def check_unpaid_orders():
+    time.sleep(LNM_DELAY)
+
+
+def check_open_orders():
+    time.sleep(LNM_DELAY * 2)
+
+
+def polling_loop():
+    events, latency, stop = queue.Queue(), Latency(size=100000), threading.Event()
+    threading.Thread(target=producer, args=(events, latency, stop), daemon=True).start()
+    end = time.monotonic() + DURATION
+    while time.monotonic() < end:
+        while not events.empty():
+            handle(latency, events.get())
+        check_unpaid_orders()
+        check_open_orders()
+        time.sleep(2)
+    stop.set()
+    return latency
+
+
+def scheduler():
+    events, latency, stop = queue.Queue(), Latency(size=100000), threading.Event()
+    threading.Thread(target=producer, args=(events, latency, stop), daemon=True).start()
+
+    def listen():
+        try:
+            handle(latency, events.get(timeout=1))
+        except queue.Empty:
+            pass
+
+    s = Scheduler()
+    s.add_listener('ingest', listen)
+    s.add_job('unpaid_orders', check_unpaid_orders, interval=2)
+    s.add_job('open_orders', check_open_orders, interval=5)
+    s.start()
+    time.sleep(DURATION)
+    s.stop()
+    stop.set()
+    return latency
+
+
+for name, run in (('polling loop (before)', polling_loop), ('scheduler (after)', scheduler)):
+    latency = run()
+    print(f"{name:<24} {len(latency.samples):4} notes | p50 {latency.percentile(50) * 1000:7.1f}ms"
+          f" | p99 {latency.percentile(99) * 1000:7.1f}ms")
@@ -0,0 +1,57 @@
+import os
+import time
+import tempfile
+import urllib.request
+
+from Metrics import metrics
+from OrderManager import OrderManager, Order
+
+#  Cost of the metrics hooks, disabled (default) vs enabled,
+#  then /metrics scraped once from a local OrderManager
+
+CALLS = 1_000_000
+QUERIES = 20_000
+
+counter = metrics.counter('bench_total', 'bench counter', ['kind'])
+histogram = metrics.histogram('bench_seconds', 'bench histogram', ['call'])
+
+
+def per_call(function, calls=CALLS):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def timed():
+    with histogram.time('call'):
+        pass
+
+
+path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+manager = OrderManager(path)
+with manager.db.atomic():
+    Order.insert_many([{
+        'order_id': f"{i:064x}", 'deposit_id': f"{i:016x}", 'user': f"{i % 50:064x}", 'order_type': 'long',
+        'mode': 'dm', 'amount': 1000, 'fee': 2, 'leverage': 100, 'trade_amount': 1000, 'margin': 1000,
+        'status': ['unpaid', 'open', 'closed'][i % 3], 'profit': 0, 'invoice': '', 'lnm_id': f"{i:016x}",
+        'withdraw_type': '', 'withdraw_data': '',
+    } for i in range(1000)]).execute()
+
+for enabled in (False, True):
+    metrics.enabled = enabled
+    print(f"enabled={enabled}: "
+          f"counter.inc {per_call(lambda: counter.inc('note')):.0f}ns, "
+          f"histogram.observe {per_call(lambda: histogram.observe(0.01, 'call')):.0f}ns, "
+          f"histogram.time {per_call(timed):.0f}ns, "
+          f"get_order_by_id {per_call(lambda: manager.get_order_by_id(f'{7:064x}'), QUERIES) / 1000:.1f}us")
+metrics.enabled = False
+
+metrics.start(port=0)
+url = f"http://127.0.0.1:{metrics.server.server_address[1]}/metrics"
+start = time.perf_counter()
+body = urllib.request.urlopen(url).read().decode()
+print(f"scrape: {len(body.splitlines())} lines in {(time.perf_counter() - start) * 1000:.1f}ms")
+print('\n'.join(line for line in body.splitlines() if line.startswith(('rektbot_orders', 'rektbot_db_seconds_count'))))
+print(f"snapshot: {metrics.snapshot()[:300]}...")
+metrics.stop()
@@ -0,0 +1,74 @@
+import os
+import time
+import random
+import tempfile
+
+from Metrics import metrics
+from OrderManager import OrderManager, Order, QUERIES
+
+#  Full order lifecycle (new -> unpaid -> paid -> open -> closed -> withdraw)
+#  through OrderManager next to 100k historical orders, unpaid/open polls
+#  between transitions like the scheduler jobs. Counts SQL statements.
+
+HISTORY = 100_000
+ORDERS = 2000
+USERS = 200
+POLL_EVERY = 5
+
+path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+manager = OrderManager(path)
+with manager.db.atomic():
+    rows = [{
+        'order_id': f"h{i:063x}", 'deposit_id': f"h{i:015x}", 'user': f"{i % USERS:064x}", 'order_type': 'long',
+        'mode': 'dm', 'amount': 1000, 'fee': 2, 'leverage': 100, 'trade_amount': 1000, 'margin': 1000,
+        'status': random.choice(['withdraw_done', 'liquidated']), 'profit': 0, 'invoice': '',
+        'lnm_id': f"h{i:015x}", 'withdraw_type': '', 'withdraw_data': '',
+    } for i in range(HISTORY)]
+    for i in range(0, len(rows), 1000):
+        Order.insert_many(rows[i:i + 1000]).execute()
+manager.close()
+# reload, active orders (none) are loaded at start
+manager = OrderManager(path)
+metrics.enabled = True
+
+transitions = 0
+polls = 0
+
+
+def poll():
+    global polls
+    polls += 1
+    list(manager.list_unpaid_orders())
+    list(manager.list_open_orders())
+
+
+def step(function, *args):
+    global transitions
+    function(*args)
+    transitions += 1
+    if transitions % POLL_EVERY == 0:
+        poll()
+
+
+start = time.perf_counter()
+for i in range(ORDERS):
+    order_id = f"{i:064x}"
+    user = f"{i % USERS:064x}"
+    step(manager.new_order, {'order_id': order_id, 'user': user, 'amount': 2000, 'order_type': 'long', 'tp': 0,
+                             'leverage': 100, 'mode': 'dm'})
+    step(manager.set_order_unpaid, {'order_id': order_id, 'invoice': 'lnbc', 'hash': f"{i:016x}"})
+    step(manager.set_order_paid, order_id)
+    step(manager.set_order_open, {'order_id': order_id, 'price': 30000.0, 'lnm_id': f"{i:016x}",
+                                  'trade_amount': 100000, 'margin': 1900, 'fee': 100})
+    step(manager.set_orders_close, [{'order_id': order_id, 'price': 30300.0}])
+    step(manager.set_order_withdraw_requested, {'user': user, 'withdraw_mode': 'lnurl'})
+    step(manager.set_order_withdraw_done, {'batch_list': manager.list_user_orders(user, ['withdraw_pending'])})
+elapsed = time.perf_counter() - start
+
+statements = {labels[0]: sum(state[0]) for labels, state in QUERIES.values.items()}
+print(f"{ORDERS} orders, {transitions} transitions, {polls} polls in {elapsed:.2f}s "
+      f"({elapsed / transitions * 1e6:.0f}us per transition incl. polls)")
+print(f"SQL statements: {statements}, {sum(statements.values()) / ORDERS:.1f} per order")
+done = Order.select().where((Order.status == 'withdraw_done') & ~Order.order_id.startswith('h')).count()
+print(f"{done} orders withdrawn in db")
+manager.close()
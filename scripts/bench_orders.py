@@ -0,0 +1,82 @@
+import os
+import time
+import random
+import tempfile
+
+from OrderManager import OrderManager, Order
+
+#  Poll queries of OrderManager on a db holding 1M historical orders
+
+ORDERS = 1_000_000
+USERS = 5000
+RUNS = 50
+
+path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+manager = OrderManager(path)
+
+users = [os.urandom(32).hex() for _ in range(USERS)]
+start = time.perf_counter()
+rows = []
+with manager.db.atomic():
+    for i in range(ORDERS):
+        if i % 20000 == 0:
+            status = random.choice(['unpaid', 'open', 'closed'])
+        else:
+            status = random.choice(['withdraw_done', 'liquidated'])
+        rows.append({
+            'order_id': f"{i:064x}", 'deposit_id': os.urandom(8).hex(), 'user': random.choice(users),
+            'order_type': 'long', 'mode': 'dm', 'amount': 1000, 'fee': 2, 'leverage': 100,
+            'trade_amount': 1000, 'margin': 1000, 'status': status, 'profit': 0, 'invoice': '',
+            'lnm_id': os.urandom(8).hex(), 'withdraw_type': '', 'withdraw_data': '',
+        })
+        if len(rows) == 1000:
+            Order.insert_many(rows).execute()
+            rows = []
+print(f"{ORDERS} orders inserted in {time.perf_counter() - start:.1f}s")
+manager.close()
+# reload, active orders are loaded at start
+manager = OrderManager(path)
+
+
+def bench(name, query):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        count = len(list(query()))
+    elapsed = (time.perf_counter() - start) / RUNS
+    print(f"  {name:<42} {elapsed * 1000:8.3f}ms  ({count} orders)")
+    return elapsed
+
+
+def by_status(status):
+    return lambda: Order.select().where(Order.status == status)
+
+
+def run():
+    # OrderManager (in memory) against the db query it replaced
+    user = next(iter(manager.by_user), users[0])
+    lnm_id = next(iter(manager.by_lnm_id), 'x')
+    for name, memory, db in (
+            ('list_unpaid_orders', manager.list_unpaid_orders, by_status('unpaid')),
+            ('list_open_orders', manager.list_open_orders, by_status('open')),
+            ('list_funding_orders', manager.list_funding_orders, by_status('funding')),
+            ('withdrawable orders (user, status)',
+             lambda: manager.list_user_orders(user, OrderManager.WITHDRAWABLE_STATUS),
+             lambda: Order.select().where((Order.user == user) &
+                                          (Order.status.in_(OrderManager.WITHDRAWABLE_STATUS)))),
+            ('lookup by lnm_id', lambda: [manager.get_order_by_lnm_id(lnm_id)],
+             lambda: Order.select().where(Order.lnm_id == lnm_id))):
+        db_time = bench(f"{name} db", db)
+        memory_time = bench(f"{name} memory", memory)
+        print(f"  {'':<42} x{db_time / memory_time:.0f}")
+
+
+print(f"{len(manager.active)} active orders")
+print('db with indexes:')
+run()
+
+for index in manager.db.get_indexes('order'):
+    if not index.unique:
+        manager.db.execute_sql(f'DROP INDEX "{index.name}"')
+print('db without indexes:')
+run()
+manager.close()
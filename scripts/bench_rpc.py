@@ -0,0 +1,46 @@
+import os
+import stat
+import time
+import tempfile
+import threading
+
+from RPC import RPC, RpcPool
+from fake_cln import FakeLightningd
+
+#  Calls/sec of the lightning-rpc socket client vs lightning-cli subprocess
+
+CALLS = 500
+THREADS = 8
+
+tmp = tempfile.mkdtemp()
+fake = FakeLightningd(os.path.join(tmp, 'lightning-rpc')).start()
+RPC.pool = RpcPool(fake.path, size=4)
+
+cli = os.path.join(tmp, 'lightning-cli')
+with open(cli, 'w') as file:
+    file.write(f"#!/bin/sh\necho '{{\"status\": \"complete\"}}'\n")
+os.chmod(cli, os.stat(cli).st_mode | stat.S_IEXEC)
+RPC.cli_path = cli
+
+
+def run(name, function, calls, threads=1, per_call=1):
+    def job():
+        for _ in range(calls // threads):
+            function()
+
+    workers = [threading.Thread(target=job) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {calls * per_call / elapsed:10.0f} calls/s")
+
+
+run('subprocess lightning-cli', lambda: RPC.rpc_call('pay', ['lnbc']), CALLS // 5)
+run('socket', lambda: RPC.call('pay', {'bolt11': 'lnbc'}), CALLS)
+run(f'socket x{THREADS} threads', lambda: RPC.call('pay', {'bolt11': 'lnbc'}), CALLS, THREADS)
+run('socket batch of 10', lambda: RPC.batch([('pay', {'bolt11': 'lnbc'})] * 10), CALLS // 10, per_call=10)
+
+fake.stop()
@@ -0,0 +1,62 @@
+import os
+import time
+import tempfile
+
+from OrderManager import OrderManager, Order
+
+#  Latency of a withdrawal (request + done) against the number of closed
+#  orders of the user, per order save() vs bulk transitions
+
+BATCHES = [1, 10, 50, 200, 1000]
+
+path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+manager = OrderManager(path)
+manager.db.pragma('synchronous', 'full')
+
+
+def fill(user, count):
+    rows = [{
+        'order_id': f"{user}{i:08x}", 'deposit_id': '', 'user': user, 'order_type': 'long', 'mode': 'dm',
+        'amount': 1000, 'fee': 2, 'leverage': 100, 'trade_amount': 1000, 'margin': 1000, 'status': 'closed',
+        'profit': 10 if i % 10 else -2000, 'invoice': '', 'lnm_id': '', 'withdraw_type': '', 'withdraw_data': '',
+    } for i in range(count)]
+    with manager.db.atomic():
+        for i in range(0, len(rows), 500):
+            Order.insert_many(rows[i:i + 500]).execute()
+    # closed orders are active, loaded in memory at start
+    for order in Order.select().where(Order.user == user):
+        manager.index(order)
+
+
+def per_order(user):
+    # former implementation
+    batch_list = []
+    for order in Order.select().where((Order.user == user) & (Order.status == 'closed')):
+        if order.amount + order.profit > 0:
+            batch_list.append(order)
+            order.status = 'withdraw_requested'
+        else:
+            order.status = 'liquidated'
+        order.save()
+    for order in batch_list:
+        order = manager.get_order_by_id(order.order_id)
+        order.status = 'withdraw_done'
+        order.save()
+
+
+def bulk(user):
+    manager.set_order_withdraw_requested({'user': user, 'withdraw_mode': 'lnurl'})
+    manager.set_order_withdraw_done({'batch_list': manager.list_user_orders(user, ['withdraw_pending'])})
+
+
+print(f"{'orders':>7} | {'per order':>10} | {'bulk':>10}")
+for count in BATCHES:
+    results = []
+    for name, function in (('a', per_order), ('b', bulk)):
+        user = os.urandom(8).hex() + name
+        fill(user, count)
+        start = time.perf_counter()
+        function(user)
+        results.append((time.perf_counter() - start) * 1000)
+    print(f"{count:>7} | {results[0]:8.1f}ms | {results[1]:8.1f}ms")
+manager.close()
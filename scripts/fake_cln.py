@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import socketserver
+import threading
+
+#  Local stand-in for lightningd JSON-RPC unix socket
+
+
+class FakeLightningd:
+
+    def __init__(self, path, delay=0.0):
+        self.path = path
+        self.delay = delay
+        self.invoices = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                decoder = json.JSONDecoder()
+                buffer = ''
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    buffer += data.decode()
+                    while True:
+                        buffer = buffer.lstrip()
+                        try:
+                            request, end = decoder.raw_decode(buffer)
+                        except ValueError:
+                            break
+                        buffer = buffer[end:]
+                        response = fake.handle(request)
+                        self.request.sendall(json.dumps(response).encode() + b'\n\n')
+
+        self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+        method = request['method']
+        params = request.get('params', {})
+        try:
+            result = getattr(self, f"rpc_{method}")(**params)
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32600, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def rpc_invoice(self, amount_msat, label, description, expiry=600):
+        with self.lock:
+            if label in self.invoices:
+                raise ValueError('Duplicate label')
+            bolt11 = f"lnbcfake{label}"
+            self.invoices[label] = {
+                'label': label,
+                'bolt11': bolt11,
+                'payment_hash': os.urandom(32).hex(),
+                'amount_msat': amount_msat,
+                'status': 'unpaid',
+                'description': description,
+                'expires_at': int(time.time()) + expiry,
+            }
+            invoice = self.invoices[label]
+        return {'bolt11': bolt11, 'payment_hash': invoice['payment_hash'], 'expires_at': invoice['expires_at']}
+
+    def rpc_listinvoices(self, label=None, **kwargs):
+        with self.lock:
+            if label is not None:
+                invoices = [self.invoices[label]] if label in self.invoices else []
+            else:
+                invoices = list(self.invoices.values())
+        return {'invoices': invoices}
+
+    def rpc_delinvoice(self, label, status):
+        with self.lock:
+            invoice = self.invoices.get(label)
+            if not invoice or invoice['status'] != status:
+                raise ValueError('Unknown invoice or status mismatch')
+            return self.invoices.pop(label)
+
+    def rpc_delexpiredinvoice(self, **kwargs):
+        return {}
+
+    def rpc_pay(self, bolt11, **kwargs):
+        return {'status': 'complete', 'payment_preimage': '00' * 32}
@@ -0,0 +1,257 @@
+import os
+import json
+import uuid
+import bisect
+import hashlib
+import socket
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from fake_ws import WebSocketServer
+from fake_lnurl import make_invoice
+
+#  Local stand-ins for LNMarkets APIs
+
+
+class FakeTicker:
+    """
+    Websocket server pushing `futures:btc_usd:last-price` every interval seconds.
+    """
+
+    def __init__(self, price=30000.0, interval=0.1):
+        self.price = price
+        self.interval = interval
+        self.server = WebSocketServer(self.handle)
+        self.url = self.server.url
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+    def handle(self, client):
+        message = json.loads(client.receive())
+        channel = message['params'][0]
+        client.send(json.dumps({'jsonrpc': '2.0', 'id': message['id'], 'result': [channel]}))
+
+        def push():
+            while not client.closed:
+                client.send(json.dumps({
+                    'jsonrpc': '2.0',
+                    'method': 'subscription',
+                    'params': {'channel': channel, 'data': {'lastPrice': self.price, 'time': int(time.time() * 1000)}},
+                }))
+                time.sleep(self.interval)
+
+        threading.Thread(target=push, daemon=True).start()
+        while client.receive() is not None:
+            pass
+
+
+class JsonClient:
+    """
+    Wrap an lnmarkets client without the format='json' keyword used by LNM.py.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        function = getattr(self.client, name)
+
+        def call(*args, format=None, **kwargs):
+            ret = function(*args, **kwargs)
+            return json.loads(ret) if format == 'json' else ret
+        return call
+
+
+class FakeLNMRest:
+    """
+    HTTP/1.1 keep-alive stand-in for the LNMarkets REST API (v1),
+    every answer is delayed `delay` seconds. Counts requests and TCP connections.
+    Deposits are paid by pay_deposit(), positions closed by close_position().
+    """
+
+    def __init__(self, price=30000.0, delay=0.0, running=None, closed=None, balance=0):
+        self.price = price
+        self.delay = delay
+        self.running = running or []
+        self.closed = closed or []
+        self.closed_ts = []
+        self.balance = balance
+        # payment_hash -> deposit, in creation order
+        self.deposits = {}
+        self.withdrawals = []
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # headers and body are written separately
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle_request(self, method):
+                with fake.lock:
+                    fake.requests += 1
+                    fake.connections.add(self.client_address)
+                size = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(size)) if size else {}
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if fake.delay:
+                    time.sleep(fake.delay)
+                answer = fake.route(method, url.path, query, body)
+                if answer is None:
+                    self.reply({'code': 404, 'message': 'Not found'}, 404)
+                else:
+                    self.reply(answer)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def close(self, position):
+        """
+        Move a running position to the closed ones, closed positions are kept sorted by closed_ts.
+        """
+        self.running = [p for p in self.running if p['id'] != position['id']]
+        self.closed.append(position)
+        self.closed_ts.append(position['closed_ts'])
+
+    def pay_deposit(self, payment_hash) -> bool:
+        with self.lock:
+            deposit = self.deposits.get(payment_hash)
+            if deposit is None or deposit['success']:
+                return False
+            deposit['success'] = True
+            self.balance += deposit['amount']
+        return True
+
+    def new_position(self, body):
+        position = {
+            'id': str(uuid.uuid4()),
+            'type': body.get('type', 'm'),
+            'side': body.get('side'),
+            'margin': body.get('margin'),
+            'leverage': body.get('leverage'),
+            'takeprofit': body.get('takeprofit', 0),
+            'price': self.price,
+            'creation_ts': int(time.time() * 1000),
+        }
+        with self.lock:
+            self.running.append(position)
+        return position
+
+    def close_position(self, lnm_id, exit_price=None) -> bool:
+        """
+        Close a running position at exit_price (default the current price).
+        """
+        with self.lock:
+            position = next((p for p in self.running if p['id'] == lnm_id), None)
+            if position is None:
+                return False
+            exit_price = self.price if exit_price is None else exit_price
+            closed = dict(position, exit_price=exit_price, pl=0, opening_fee=0, closing_fee=0,
+                          sum_carry_fees=0, closed_ts=int(time.time() * 1000))
+            self.close(closed)
+        return True
+
+    def closed_page(self, query):
+        # newest first, `from`/`to` inclusive, like the LNMarkets API
+        if len(self.closed_ts) != len(self.closed):
+            self.closed.sort(key=lambda p: p['closed_ts'])
+            self.closed_ts = [p['closed_ts'] for p in self.closed]
+        start = bisect.bisect_left(self.closed_ts, int(query['from'])) if 'from' in query else 0
+        end = bisect.bisect_right(self.closed_ts, int(query['to'])) if 'to' in query else len(self.closed)
+        limit = int(query.get('limit', len(self.closed)))
+        return self.closed[max(start, end - limit):end][::-1]
+
+    def route(self, method, path, query, body):
+        #  control routes, when the stand-in run in another process
+        if path == '/fake/close':
+            self.close(body)
+            return {}
+        if path == '/fake/stats':
+            return {'requests': self.requests, 'connections': len(self.connections)}
+        if path == '/fake/pay':
+            return {'paid': self.pay_deposit(body['payment_hash'])}
+        if path == '/fake/close_position':
+            return {'closed': self.close_position(body['id'], body.get('exit_price'))}
+        if path == '/v1/futures/ticker':
+            return {'lastPrice': self.price, 'index': self.price}
+        if path == '/v1/futures' and method == 'GET':
+            if query.get('type') == 'running':
+                return self.running
+            return self.closed_page(query)
+        if path == '/v1/futures' and method == 'POST':
+            return self.new_position(body)
+        if path == '/v1/futures' and method == 'DELETE':
+            if self.close_position(query.get('id')):
+                return {'closed': True}
+            return {'code': 404, 'message': 'Position not found'}
+        if path == '/v1/user':
+            return {'balance': self.balance}
+        if path == '/v1/user/deposit' and method == 'GET':
+            since = int(query.get('from', 0))
+            with self.lock:
+                return [dict(d) for d in self.deposits.values() if d['ts'] >= since]
+        if path == '/v1/user/deposit' and method == 'POST':
+            payment_hash = hashlib.sha256(os.urandom(32)).hexdigest()
+            invoice = make_invoice(int(body['amount']) * 1000, payment_hash, 'lnmarkets deposit')
+            with self.lock:
+                self.deposits[payment_hash] = {'payment_hash': payment_hash, 'amount': int(body['amount']),
+                                               'success': False, 'ts': int(time.time() * 1000)}
+            return {'depositId': payment_hash, 'paymentRequest': invoice}
+        if path == '/v1/user/withdraw':
+            with self.lock:
+                self.withdrawals.append(body)
+                self.balance -= int(body['amount'])
+            return {'id': str(uuid.uuid4()), 'paymentHash': hashlib.sha256(os.urandom(32)).hexdigest(),
+                    'amount': body['amount']}
+
+
+def serve(queue, **kwargs):
+    """
+    Run FakeLNMRest in a child process (multiprocessing target), its url is put on queue.
+    """
+    server = FakeLNMRest(**kwargs).start()
+    queue.put(server.url)
+    server.thread.join()
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import bolt11
+from bolt11 import Bolt11, Tags, Tag, TagChar, MilliSatoshi
+
+#  Local LUD16 wallet server stand-in (lnurlp metadata + callback)
+
+
+def make_invoice(msats: int, payment_hash=None, description='rektbot withdraw') -> str:
+    payment_hash = payment_hash or hashlib.sha256(os.urandom(32)).hexdigest()
+    tags = Tags([Tag(TagChar.payment_hash, payment_hash),
+                 Tag(TagChar.description, description),
+                 Tag(TagChar.payment_secret, os.urandom(32).hex())])
+    invoice = Bolt11(currency='bc', date=int(time.time()), tags=tags, amount_msat=MilliSatoshi(msats))
+    return bolt11.encode(invoice, private_key=os.urandom(32).hex())
+
+
+class FakeLnurl:
+    """
+    Answer every `user`, every answer is delayed `delay` seconds.
+    """
+
+    def __init__(self, delay=0.0, min_sendable=1000, max_sendable=100000000):
+        self.delay = delay
+        self.min_sendable = min_sendable
+        self.max_sendable = max_sendable
+        self.requests = 0
+        self.metadata_requests = 0
+        self.connections = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests += 1
+                fake.connections.add(self.client_address)
+                if fake.delay:
+                    time.sleep(fake.delay)
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path.startswith('/.well-known/lnurlp/'):
+                    fake.metadata_requests += 1
+                    body = {
+                        'callback': f"{fake.url}/callback/{url.path.split('/')[-1]}",
+                        'metadata': json.dumps([['text/plain', 'fake']]),
+                        'minSendable': fake.min_sendable,
+                        'maxSendable': fake.max_sendable,
+                        'tag': 'payRequest',
+                    }
+                elif url.path.startswith('/callback/'):
+                    body = {'pr': make_invoice(int(query['amount'])), 'routes': []}
+                else:
+                    body = {'status': 'ERROR', 'reason': 'not found'}
+                try:
+                    data = json.dumps(body).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,117 @@
+import json
+import time
+import random
+import hashlib
+import threading
+
+import secp256k1
+
+from fake_ws import WebSocketServer
+
+#  Local nostr relay stand-in (NIP-01 REQ/EVENT/CLOSE, in memory)
+
+
+def make_event(private_key: secp256k1.PrivateKey, kind: int, content: str, tags=None, created_at=None) -> dict:
+    pubkey = private_key.pubkey.serialize()[1:].hex()
+    event = {
+        'pubkey': pubkey,
+        'created_at': created_at or int(time.time()),
+        'kind': kind,
+        'tags': tags or [],
+        'content': content,
+    }
+    serialized = json.dumps([0, pubkey, event['created_at'], kind, event['tags'], content],
+                            separators=(',', ':'), ensure_ascii=False)
+    event['id'] = hashlib.sha256(serialized.encode()).hexdigest()
+    event['sig'] = private_key.schnorr_sign(bytes.fromhex(event['id']), None, raw=True).hex()
+    return event
+
+
+def match(filter: dict, event: dict) -> bool:
+    if 'ids' in filter and event['id'] not in filter['ids']:
+        return False
+    if 'authors' in filter and event['pubkey'] not in filter['authors']:
+        return False
+    if 'kinds' in filter and event['kind'] not in filter['kinds']:
+        return False
+    if 'since' in filter and event['created_at'] < filter['since']:
+        return False
+    if 'until' in filter and event['created_at'] > filter['until']:
+        return False
+    for key, values in filter.items():
+        if key.startswith('#'):
+            if not any(tag[0] == key[1:] and tag[1] in values for tag in event['tags']):
+                return False
+    return True
+
+
+class FakeRelay:
+    """
+    `delay`: seconds added before every message sent to clients,
+    `loss`: share of live events not delivered to subscribers.
+    """
+
+    def __init__(self, delay=0.0, loss=0.0, port=0):
+        self.delay = delay
+        self.loss = loss
+        self.events = []
+        self.subscriptions = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = WebSocketServer(self.handle, port=port)
+        self.url = self.server.url
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+    def drop_clients(self):
+        for client in list(self.server.clients):
+            client.close()
+
+    def send(self, client, message):
+        if self.delay:
+            time.sleep(self.delay)
+        client.send(json.dumps(message))
+
+    def inject(self, event: dict):
+        """
+        Store event and push it to matching subscriptions.
+        """
+        with self.lock:
+            self.events.append(event)
+            subscriptions = list(self.subscriptions.items())
+        if self.loss and random.random() < self.loss:
+            return
+        for (client, subscription_id), filters in subscriptions:
+            if not client.closed and any(match(f, event) for f in filters):
+                self.send(client, ['EVENT', subscription_id, event])
+
+    def handle(self, client):
+        while True:
+            message = client.receive()
+            if message is None:
+                break
+            message = json.loads(message)
+            if message[0] == 'REQ':
+                self.requests += 1
+                subscription_id, filters = message[1], message[2:]
+                with self.lock:
+                    self.subscriptions[(client, subscription_id)] = filters
+                    events = [e for e in self.events if any(match(f, e) for f in filters)]
+                for event in events:
+                    self.send(client, ['EVENT', subscription_id, event])
+                self.send(client, ['EOSE', subscription_id])
+            elif message[0] == 'CLOSE':
+                with self.lock:
+                    self.subscriptions.pop((client, message[1]), None)
+            elif message[0] == 'EVENT':
+                event = message[1]
+                self.send(client, ['OK', event['id'], True, ''])
+                self.inject(event)
+        with self.lock:
+            for key in [k for k in self.subscriptions if k[0] is client]:
+                del self.subscriptions[key]
@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import socket
+import struct
+import threading
+import socketserver
+
+#  Minimal websocket server (RFC 6455, text frames only) for local stand-ins
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class WebSocketClient:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, text: str):
+        data = text.encode()
+        header = bytes([0x81])
+        if len(data) < 126:
+            header += bytes([len(data)])
+        elif len(data) < 1 << 16:
+            header += bytes([126]) + struct.pack('!H', len(data))
+        else:
+            header += bytes([127]) + struct.pack('!Q', len(data))
+        with self.lock:
+            try:
+                self.sock.sendall(header + data)
+            except OSError:
+                self.closed = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def receive(self):
+        """
+        Return next text message, None on close.
+        """
+        while True:
+            try:
+                head = self.read_exact(2)
+                opcode = head[0] & 0x0f
+                size = head[1] & 0x7f
+                if size == 126:
+                    size = struct.unpack('!H', self.read_exact(2))[0]
+                elif size == 127:
+                    size = struct.unpack('!Q', self.read_exact(8))[0]
+                mask = self.read_exact(4) if head[1] & 0x80 else None
+                payload = self.read_exact(size)
+            except (ConnectionError, OSError):
+                return None
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                with self.lock:
+                    self.sock.sendall(bytes([0x8a, len(payload)]) + payload)
+                continue
+            if opcode in (0x1, 0x0):
+                return payload.decode()
+
+
+class WebSocketServer:
+    """
+    handler(client) is called in its own thread for every connection.
+    """
+
+    def __init__(self, handler, host='127.0.0.1', port=0):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                request = b''
+                while b'\r\n\r\n' not in request:
+                    chunk = self.request.recv(4096)
+                    if not chunk:
+                        return
+                    request += chunk
+                headers = {}
+                for line in request.decode().split('\r\n')[1:]:
+                    if ':' in line:
+                        k, v = line.split(':', 1)
+                        headers[k.strip().lower()] = v.strip()
+                accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + GUID).encode()).digest())
+                self.request.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                                     b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+                client = WebSocketClient(self.request)
+                server.clients.append(client)
+                try:
+                    server.handler(client)
+                finally:
+                    client.closed = True
+                    server.clients.remove(client)
+
+        self.handler = handler
+        self.clients = []
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.url = f"ws://{host}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        for client in list(self.clients):
+            client.close()
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,45 @@
+import time
+
+import requests
+
+from lud_16 import LUD16
+from fake_lnurl import FakeLnurl
+
+#  LUD16 client against a local wallet server stand-in
+
+WITHDRAWALS = 40
+ADDRESSES = [f"user{i}@wallet.local" for i in range(5)]
+
+server = FakeLnurl().start()
+
+# before: two fresh requests per withdrawal
+start = time.monotonic()
+for i in range(WITHDRAWALS):
+    user = ADDRESSES[i % len(ADDRESSES)].split('@')[0]
+    data = requests.get(f"{server.url}/.well-known/lnurlp/{user}").json()
+    requests.get(f"{data['callback']}?&amount={1000 * (1000 + i)}").json()['pr']
+print(f"before: {WITHDRAWALS} invoices in {time.monotonic() - start:.2f}s, {server.requests} requests, "
+      f"{len(server.connections)} connections")
+
+server.requests = server.metadata_requests = 0
+server.connections.clear()
+client = LUD16(base_url=server.url)
+start = time.monotonic()
+for i in range(WITHDRAWALS):
+    assert client.request_invoice(ADDRESSES[i % len(ADDRESSES)], 1000 + i)
+print(f"after:  {WITHDRAWALS} invoices in {time.monotonic() - start:.2f}s, {server.requests} requests "
+      f"({server.metadata_requests} lnurlp), {len(server.connections)} connections")
+
+server.requests = 0
+print(f"out of range amount: {client.request_invoice(ADDRESSES[0], 10 ** 9)}, {server.requests} request")
+
+# a stalled wallet server does not block the caller
+server.delay = 3
+slow = LUD16(timeout=(1, 1), base_url=server.url)
+start = time.monotonic()
+future = slow.get_invoice_async('stalled@wallet.local', 1000)
+submitted = time.monotonic() - start
+result = future.result()
+print(f"stalled server: submit returned in {submitted * 1000:.2f}ms, result={result} "
+      f"after {time.monotonic() - start:.2f}s (read timeout 1s)")
+server.stop()
@@ -0,0 +1,83 @@
+import os
+import time
+import queue
+import random
+import tempfile
+
+import secp256k1
+from nostr.filter import Filter, Filters
+
+from RelayPool import RelayPool
+from Checkpoints import Checkpoints
+from fake_relay import FakeRelay, make_event
+
+#  Mentions/DMs replayed at restart: no `since` (before) vs per relay
+#  checkpoints (after), two relays holding 30 days of mentions
+
+MENTIONS = 3000
+TTL = 30 * 24 * 3600
+OVERLAP = 300
+
+relays = [FakeRelay().start(), FakeRelay().start()]
+bot = secp256k1.PrivateKey()
+npub = bot.pubkey.serialize()[1:].hex()
+users = [secp256k1.PrivateKey() for _ in range(50)]
+now = int(time.time())
+for i in range(MENTIONS):
+    event = make_event(random.choice(users), 1, f"long {i}", [['p', npub]], created_at=now - random.randint(60, TTL))
+    for relay in relays:
+        relay.inject(event)
+
+checkpoints = Checkpoints(os.path.join(tempfile.mkdtemp(), 'bot.sqlite'))
+
+
+def filters(url, use_checkpoint):
+    since = None
+    if use_checkpoint:
+        since = int(time.time()) - TTL
+        mark = checkpoints.get(f"mentions:{url}")
+        if mark is not None:
+            since = max(since, mark - OVERLAP)
+    return Filters([Filter(pubkey_refs=[npub], kinds=[1, 4], since=since)])
+
+
+def startup(use_checkpoint):
+    """
+    Subscribe like NostrBot.update_filters, advance marks like listen_notifications
+    until every relay sent EOSE and the queue is drained. Return events received.
+    """
+    pool = RelayPool()
+    for relay in relays:
+        pool.add_relay(relay.url)
+    pool.connect()
+    pool.add_subscription_on_all_relays('rektbot', lambda url: filters(url, use_checkpoint))
+    received = 0
+    marks = {}
+    while True:
+        try:
+            event_msg = pool.message_pool.events.get(timeout=0.2)
+        except queue.Empty:
+            if all('rektbot' in relay.eose for relay in pool.relays.values()):
+                break
+            continue
+        received += 1
+        created_at = event_msg.event.created_at
+        marks[event_msg.url] = max(marks.get(event_msg.url, created_at), created_at)
+    if use_checkpoint:
+        for url, created_at in marks.items():
+            checkpoints.advance(f"mentions:{url}", created_at)
+    checkpoints.flush(force=True)
+    pool.close_connections()
+    return received
+
+
+print(f"before, every restart: {startup(use_checkpoint=False)} mentions replayed")
+print(f"after, first start: {startup(use_checkpoint=True)} mentions replayed")
+print(f"after, restart: {startup(use_checkpoint=True)} mentions replayed")
+for i in range(20):
+    event = make_event(random.choice(users), 1, f"short {i}", [['p', npub]])
+    for relay in relays:
+        relay.inject(event)
+print(f"after, restart with 20 new mentions: {startup(use_checkpoint=True)} mentions replayed")
+for relay in relays:
+    relay.stop()
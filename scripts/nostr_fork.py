@@ -0,0 +1,86 @@
+import json
+import time
+from hashlib import sha256
+
+import nostr.event
+import nostr.key
+import nostr.message_pool
+from nostr.event import EventKind
+from nostr.message_type import ClientMessageType
+
+#  Bench only: the bot needs the nostr fork of requirements.md
+#  (pip install git+https://github.com/pythcoiner/python-nostr@event_to_json).
+#  PyPI nostr 0.0.2 lacks Event(content=...), add_*_ref, to_json and
+#  EncryptedDirectMessage, install() patches the fork's event API onto it so
+#  the benches run where the fork is not installed. No-op with the fork.
+
+
+class Event:
+    """
+    Event of the fork: keyword arguments, id computed from the current fields.
+    """
+
+    def __init__(self, content=None, public_key=None, created_at=None, kind=EventKind.TEXT_NOTE, tags=None,
+                 signature=None):
+        self.content = content
+        self.public_key = public_key
+        self.created_at = created_at or int(time.time())
+        self.kind = kind
+        self.tags = tags if tags is not None else []
+        self.signature = signature
+
+    @property
+    def id(self) -> str:
+        data = [0, self.public_key, self.created_at, self.kind, self.tags, self.content]
+        return sha256(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()).hexdigest()
+
+    def add_pubkey_ref(self, pubkey: str):
+        self.tags.append(['p', pubkey])
+
+    def add_event_ref(self, event_id: str):
+        self.tags.append(['e', event_id])
+
+    def to_json(self) -> list:
+        return [ClientMessageType.EVENT, {
+            'id': self.id,
+            'pubkey': self.public_key,
+            'created_at': self.created_at,
+            'kind': self.kind,
+            'tags': self.tags,
+            'content': self.content,
+            'sig': self.signature,
+        }]
+
+    def to_message(self) -> str:
+        return json.dumps(self.to_json())
+
+
+class EncryptedDirectMessage(Event):
+
+    def __init__(self, recipient_pubkey=None, cleartext_content=None, **kwargs):
+        kwargs.setdefault('kind', EventKind.ENCRYPTED_DIRECT_MESSAGE)
+        Event.__init__(self, **kwargs)
+        self.recipient_pubkey = recipient_pubkey
+        self.cleartext_content = cleartext_content
+        self.add_pubkey_ref(recipient_pubkey)
+
+
+def received_event(public_key, content, created_at, kind, tags, id, signature):
+    # MessagePool of 0.0.2 builds events positionally
+    return Event(content=content, public_key=public_key, created_at=created_at, kind=kind, tags=tags,
+                 signature=signature)
+
+
+def sign_event(self, event):
+    if event.public_key is None:
+        event.public_key = self.public_key.hex()
+    event.signature = self.sign_message_hash(bytes.fromhex(event.id))
+
+
+def install():
+    if hasattr(nostr.event, 'EncryptedDirectMessage'):
+        return
+    nostr.event.Event = Event
+    nostr.event.EncryptedDirectMessage = EncryptedDirectMessage
+    nostr.message_pool.Event = received_event
+    nostr.key.PrivateKey.sign_event = sign_event
@@ -0,0 +1,32 @@
+import time
+
+from PriceFeed import PriceFeed
+from fake_lnm import FakeTicker
+
+#  Check PriceFeed against a local ticker stand-in, count REST fallbacks
+
+rest_calls = 0
+
+
+def fetch():
+    global rest_calls
+    rest_calls += 1
+    return 1.0
+
+
+ticker = FakeTicker(price=30000.0, interval=0.1).start()
+feed = PriceFeed(fetch, url=ticker.url, max_age=1.0)
+feed.start()
+time.sleep(0.5)
+
+for _ in range(1000):
+    assert feed.get() == 30000.0
+ticker.price = 31000.0
+time.sleep(0.3)
+assert feed.get() == 31000.0
+print(f"1001 price reads, {rest_calls} REST calls")
+
+ticker.stop()
+feed.stop()
+time.sleep(1.5)
+print(f"websocket down: price={feed.get()} (REST), {rest_calls} REST calls")
@@ -0,0 +1,63 @@
+import time
+import logging
+
+import secp256k1
+from nostr.filter import Filter, Filters
+
+from RelayPool import RelayPool
+from fake_relay import FakeRelay, make_event
+
+#  RelayPool against local relay stand-ins: startup time, scoring, reconnect
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+fast = FakeRelay().start()
+slow = FakeRelay(delay=0.02).start()
+lossy = FakeRelay(loss=0.5).start()
+dead = 'ws://127.0.0.1:1'
+
+bot = secp256k1.PrivateKey()
+user = secp256k1.PrivateKey()
+bot_pubkey = bot.pubkey.serialize()[1:].hex()
+
+pool = RelayPool(read_count=2, ping_interval=0)
+for url in (fast.url, slow.url, lossy.url, dead):
+    pool.add_relay(url)
+print(f"fast={fast.url} slow={slow.url} lossy={lossy.url} dead={dead}")
+
+start = time.monotonic()
+connected = pool.connect(timeout=5, min_ready=3)
+print(f"startup: {connected} relays ready in {time.monotonic() - start:.3f}s (was a fixed 2s sleep)")
+
+pool.add_subscription_on_all_relays('rektbot', Filters([Filter(pubkey_refs=[bot_pubkey], kinds=[1, 4])]))
+time.sleep(0.3)
+print(f"subscribed on {[r.url for r in pool.relays.values() if r.subscriptions]}")
+
+# every relay sees the events, each one delivers what it can
+for i in range(50):
+    event = make_event(user, 1, f"long {i}", [['p', bot_pubkey]])
+    for relay in (fast, slow, lossy):
+        relay.inject(event)
+time.sleep(3)
+print(f"subscribed on {[r.url for r in pool.relays.values() if r.subscriptions]}")
+pool.rebalance()
+time.sleep(3)
+
+received = pool.message_pool.events.qsize()
+print(f"{received}/50 unique events received")
+for url, stats in pool.stats().items():
+    print(f"  {url}: {stats}")
+print(f"after rebalance, subscribed on {[r.url for r in pool.relays.values() if r.subscriptions]}")
+print(f"write relays: {[r.url for r in pool.write_relays()]}")
+
+# reconnect and resubscribe
+fast.drop_clients()
+time.sleep(0.2)
+print(f"fast relay dropped, connected={pool.relays[fast.url].connected}")
+time.sleep(2)
+print(f"fast relay reconnected={pool.relays[fast.url].connected}, "
+      f"connections={pool.relays[fast.url].connections}, subscriptions={pool.relays[fast.url].subscriptions}")
+
+pool.close_connections()
+for relay in (fast, slow, lossy):
+    relay.stop()
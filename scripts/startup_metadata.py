@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import queue
+import random
+import tempfile
+
+import secp256k1
+
+from RelayPool import RelayPool
+from Subscriptions import MetadataShards
+from Users import UserRegistry
+from Checkpoints import Checkpoints
+from fake_relay import FakeRelay, make_event
+
+#  Metadata events received at startup with a few thousand users:
+#  full kind-0 replay (before) vs `since` checkpoint (after)
+
+USERS = 3000
+UPDATED = 50
+OVERLAP = 3600
+
+relay = FakeRelay().start()
+now = int(time.time())
+keys = [secp256k1.PrivateKey() for _ in range(USERS)]
+pubkeys = [key.pubkey.serialize()[1:].hex() for key in keys]
+for key in keys:
+    # profiles last updated between a year and two days ago
+    relay.inject(make_event(key, 0, json.dumps({'name': 'rekt', 'lud16': 'user@wallet.local'}),
+                            created_at=now - random.randint(2 * 86400, 365 * 86400)))
+
+path = os.path.join(tempfile.mkdtemp(), 'bot.sqlite')
+users = UserRegistry(path, legacy_path=None)
+for pubkey in pubkeys:
+    users.add(pubkey)
+checkpoints = Checkpoints(path)
+
+
+def as_dict(event):
+    # the bot nostr fork has Event.to_json(), PyPI nostr has not
+    if hasattr(event, 'to_json'):
+        return event.to_json()[1]
+    return {'pubkey': event.public_key, 'created_at': event.created_at, 'content': event.content}
+
+
+def startup(use_checkpoint):
+    """
+    Subscribe metadata like NostrBot.update_filters, handle events like NostrBot.handle_event
+    until every shard sent EOSE. Return (events received, profiles parsed, seconds).
+    """
+    pool = RelayPool()
+    pool.add_relay(relay.url)
+    pool.connect()
+    shards = MetadataShards()
+    since = checkpoints.get('metadata') if use_checkpoint else None
+    if since is not None:
+        since -= OVERLAP
+    requests = shards.load(list(users), since, users.has_profile if use_checkpoint else None)
+    start = time.monotonic()
+    for subscription_id, filters in requests:
+        pool.add_subscription_on_all_relays(subscription_id, filters)
+    received = parsed = 0
+    eose = 0
+    while eose < len(requests):
+        try:
+            event_msg = pool.message_pool.events.get(timeout=0.05)
+        except queue.Empty:
+            while pool.message_pool.has_eose_notices():
+                pool.message_pool.get_eose_notice()
+                eose += 1
+            continue
+        event = as_dict(event_msg.event)
+        received += 1
+        created_at = event['created_at']
+        if not use_checkpoint or users.is_newer_profile(event['pubkey'], created_at):
+            content = json.loads(event['content'])
+            users.set_profile(event['pubkey'], content.get('lud16'), created_at)
+            parsed += 1
+        checkpoints.advance('metadata', min(created_at, int(time.time())))
+    checkpoints.flush(force=True)
+    pool.close_connections()
+    return received, parsed, time.monotonic() - start
+
+
+received, parsed, elapsed = startup(use_checkpoint=False)
+print(f"before, every start: {received} metadata events, {parsed} parsed, {elapsed:.2f}s")
+received, parsed, elapsed = startup(use_checkpoint=True)
+print(f"after, restart: {received} metadata events, {parsed} parsed, {elapsed:.2f}s")
+
+for key in keys[:UPDATED]:
+    relay.inject(make_event(key, 0, json.dumps({'name': 'rekt', 'lud16': 'new@wallet.local'})))
+received, parsed, elapsed = startup(use_checkpoint=True)
+print(f"after, restart with {UPDATED} updated profiles: {received} metadata events, {parsed} parsed, {elapsed:.2f}s")
+assert users.get_lud16(pubkeys[0]) == 'new@wallet.local'
+relay.stop()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#  local stand-ins (fake_lnm, fake_lnurl, ...) live in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
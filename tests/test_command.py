@@ -0,0 +1,52 @@
+import pytest
+
+import Command
+
+NPUB = 'nostr:npub15w8szlfuwx86zt62q73mkude9gtsm8rzzjshlj3ug8wf6wprvhcsj2nuj0'
+
+
+@pytest.mark.parametrize('content', [
+    'I was so close to get rekt lol',
+    f'{NPUB} close to the top, careful',
+    'so close!',
+    'we are close',
+    'closed my position yesterday',
+    'gm, how does it work?',
+    f'{NPUB} https://example.com/long 500',
+    "what's the status of btc?",
+    f'{NPUB} status of the market?',
+    'my balance is empty',
+    'check your balance before trading',
+    'status all',
+])
+@pytest.mark.parametrize('dm', [False, True])
+def test_conversation_is_not_a_command(content, dm):
+    assert Command.parse(content, dm) is None
+
+
+@pytest.mark.parametrize('content', ['close', 'Close all!', f'{NPUB} close', '  close all\n'])
+def test_close_alone_by_dm(content):
+    assert Command.parse(content, dm=True) == Command.Command('close')
+    assert Command.parse(content, dm=False) is None
+
+
+@pytest.mark.parametrize('content', ['status', 'Balance?', f'{NPUB} status', '  balance!\n'])
+@pytest.mark.parametrize('dm', [False, True])
+def test_status_and_balance_alone(content, dm):
+    assert Command.parse(content, dm) == Command.Command(content.split()[-1].strip('?!').lower())
+
+
+def test_trade():
+    command = Command.parse(f'{NPUB} SHORT 250 tp9000 x50')
+    assert command == Command.Command('trade', side='short', amount=250, tp=9000, leverage=50)
+    assert Command.parse('long 100 and short 100') is None
+    assert Command.parse('long 1000').leverage == Command.DEFAULT_LEVERAGE
+
+
+def test_withdraw_and_invoice():
+    assert Command.parse('lnurl please', dm=True) == Command.Command('withdraw', withdraw_mode='lnurl')
+    assert Command.parse('invoice', dm=True) == Command.Command('withdraw', withdraw_mode='invoice')
+    assert Command.parse('lnbc10u1pjtz58msp5 here', dm=True) == Command.Command('invoice', invoice='lnbc10u1pjtz58msp5')
+    assert Command.parse('lnurl') is None
+    assert Command.parse('status') == Command.Command('status')
+    assert Command.parse('balance?') == Command.Command('balance')
@@ -0,0 +1,25 @@
+import os
+import threading
+
+from History import History, SeenEvent
+
+
+def test_compact_from_another_thread(tmp_path):
+    history = History(str(tmp_path / 'history.sqlite'), legacy_path=None)
+    old, new = os.urandom(32).hex(), os.urandom(32).hex()
+    history.add(old)
+    history.flush()
+    SeenEvent.update(seen_at=0).where(SeenEvent.event_id == old).execute()
+
+    # the ingest thread keeps adding while the scheduler compacts
+    added = [os.urandom(32).hex() for _ in range(200)]
+    compact = threading.Thread(target=history.compact, args=(3600,))
+    compact.start()
+    for event_id in added:
+        history.add(event_id)
+    history.add(new)
+    compact.join()
+
+    assert old not in history
+    assert new in history and all(event_id in history for event_id in added)
+    history.close()
@@ -0,0 +1,64 @@
+import sys
+import time
+import types
+import inspect
+
+import pytest
+
+# LNM reads its options from config at import
+sys.modules.setdefault('config', types.ModuleType('config'))
+import config  # noqa: E402
+from lnmarkets import rest  # noqa: E402
+from fake_lnm import FakeLNMRest, JsonClient  # noqa: E402
+from LNM import LNMarkets  # noqa: E402
+
+# the lnmarkets client the bot pins takes format= on its calls, PyPI ln-markets does not
+PINNED_CLIENT = 'format' in inspect.signature(rest.LNMarketsRest.futures_get_ticker).parameters
+
+
+@pytest.fixture
+def server():
+    server = FakeLNMRest(price=31000.0, balance=10 ** 6).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def lnm(server, monkeypatch):
+    monkeypatch.setattr(config, 'lnm_base_url', server.url, raising=False)
+    return LNMarkets('k', 's', 'p', 0.002)
+
+
+def test_pooled_client_format(lnm):
+    ticker = lnm.client.request_api('GET', '/futures/ticker', {}, False, format='json')
+    assert ticker['lastPrice'] == 31000.0
+    assert isinstance(lnm.client.request_api('GET', '/futures/ticker', {}), str)
+    assert lnm.transport.requests == 2
+
+
+@pytest.mark.skipif(not PINNED_CLIENT, reason='installed lnmarkets client has no format=')
+def test_lnm_calls_through_pooled_client(lnm):
+    assert lnm.fetch_price() == 31000.0
+    assert lnm.get_running_positions() == []
+    assert lnm.transport.requests == 2
+
+
+def test_first_closed_sync_bounded_by_oldest_open_order(server, lnm):
+    if not PINNED_CLIENT:
+        lnm.client = JsonClient(lnm.client)
+    now = int(time.time() * 1000)
+    # old history of the account, closed before any open order
+    for i in range(5000):
+        server.close({'id': f'old{i}', 'side': 'b', 'exit_price': 1.0, 'pl': 0, 'opening_fee': 0,
+                      'closing_fee': 0, 'sum_carry_fees': 0, 'closed_ts': now - 10 ** 7 + i})
+    position = server.new_position({'side': 'b', 'margin': 1000, 'leverage': 10})
+
+    assert lnm.get_closed_positions([position['id']], since=now - 1000) == {}
+    assert server.requests == 1 and lnm.closed_positions == {}
+    # cursor from what was fetched: the bound, not the whole history next time
+    assert lnm.closed_cursor == now - 1000
+
+    server.close_position(position['id'], 32000.0)
+    closed = lnm.get_closed_positions([position['id']], since=now - 1000)
+    assert closed[position['id']].exit_price == 32000.0
+    assert server.requests == 2 and lnm.closed_cursor == closed[position['id']].closed_ts
@@ -0,0 +1,22 @@
+from nostr.key import PrivateKey
+
+import Nip04
+
+
+def test_evicted_secret_in_use_is_not_zeroized():
+    secrets = Nip04.SharedSecrets(PrivateKey(), size=1)
+    alice, bob = PrivateKey().public_key.hex(), PrivateKey().public_key.hex()
+    key = secrets.get(alice)
+    expected = bytes(key)
+    # another worker evicts alice's secret while key is still in use
+    secrets.get(bob)
+    assert key == expected != bytes(len(key))
+    assert secrets.get(alice) == expected
+
+
+def test_decrypt_encrypt_roundtrip():
+    bot, user = PrivateKey(), PrivateKey()
+    Nip04.init(bot.raw_secret, cache_size=1)
+    content = Nip04.encrypt('long 1000', user.public_key.hex())
+    assert user.decrypt_message(content, bot.public_key.hex()) == 'long 1000'
+    assert Nip04.decrypt(user.encrypt_message('lnurl', bot.public_key.hex()), user.public_key.hex()) == 'lnurl'
@@ -0,0 +1,82 @@
+from fake_lnurl import make_invoice
+from OrderManager import OrderManager
+
+
+def open_order(manager, order_id, user='alice'):
+    manager.new_order({'order_id': order_id, 'user': user, 'amount': 1000, 'order_type': 'long', 'tp': 0,
+                       'leverage': 10, 'mode': 'dm'})
+    manager.set_order_unpaid({'order_id': order_id, 'invoice': 'lnbc', 'hash': f'hash-{order_id}'})
+    manager.set_order_paid(order_id)
+    manager.set_order_open({'order_id': order_id, 'trade_amount': 10000, 'margin': 970, 'fee': 29.4,
+                            'price': 30000, 'lnm_id': f'lnm-{order_id}'})
+
+
+def test_withdraw_requested_once(tmp_path):
+    manager = OrderManager(str(tmp_path / 'bot.sqlite'))
+    requested = []
+    manager.order_status_withdraw_requested.connect(requested.append)
+    open_order(manager, 'o1')
+    manager.set_orders_close([{'order_id': 'o1', 'price': 31000}])
+
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'lnurl'})
+    # a second request while the first is in flight pays nothing
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'lnurl'})
+    assert len(requested) == 1
+    assert manager.get_order_status('o1') == 'withdraw_pending'
+    assert manager.get_user_balance('alice') == 0
+
+    # a failed withdraw can be requested again
+    manager.set_orders_withdraw_fail(['o1'])
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'lnurl'})
+    assert len(requested) == 2
+    manager.close()
+
+
+def test_duplicate_invoice_paid_once(tmp_path):
+    manager = OrderManager(str(tmp_path / 'bot.sqlite'))
+    requested, prompts = [], []
+    manager.order_status_withdraw_requested.connect(requested.append)
+    manager.order_withdraw_notify_amount.connect(prompts.append)
+    open_order(manager, 'o1')
+    manager.set_orders_close([{'order_id': 'o1', 'price': 31000}])
+
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'invoice'})
+    total = prompts[-1]['total_amount']
+    # still withdrawable while waiting the invoice, prompted again with the same amount
+    assert manager.get_user_balance('alice') == total
+    open_order(manager, 'o2')
+    manager.set_orders_close([{'order_id': 'o2', 'price': 30000}])
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'invoice'})
+    total = prompts[-1]['total_amount']
+    assert total == manager.get_user_balance('alice')
+
+    invoice = make_invoice(total * 1000)
+    manager.set_order_withdraw_receive_invoice({'user': 'alice', 'invoice': invoice})
+    manager.set_order_withdraw_receive_invoice({'user': 'alice', 'invoice': invoice})
+    manager.set_order_withdraw_requested({'user': 'alice', 'withdraw_mode': 'lnurl'})
+    assert [(len(data['batch_list']), data['total_amount']) for data in requested] == [(2, total)]
+    assert manager.get_order_status('o1') == manager.get_order_status('o2') == 'withdraw_pending'
+
+    manager.set_order_withdraw_done(requested[0])
+    assert manager.get_order_status('o1') == 'withdraw_done'
+    manager.close()
+
+
+def test_fields_set_as_stored(tmp_path):
+    path = str(tmp_path / 'bot.sqlite')
+    manager = OrderManager(path)
+    open_order(manager, 'o1')
+    # tp of an open order is not changed
+    manager.set_order_tp('o1', 35000)
+    order = manager.get_order_by_id('o1')
+    assert order.tp == 0 and order.fee == 29 and type(order.fee) is int
+    manager.set_orders_close([{'order_id': 'o1', 'price': 31000}, {'order_id': 'unknown', 'price': 1}])
+    # already closed
+    manager.set_orders_close([{'order_id': 'o1', 'price': 1}])
+    profit = manager.get_order_by_id('o1').profit
+    manager.close()
+
+    manager = OrderManager(path)
+    order = manager.get_order_by_id('o1')
+    assert (order.status, order.tp, order.fee, order.profit) == ('closed', 0, 29, profit)
+    manager.close()
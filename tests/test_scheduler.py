@@ -0,0 +1,31 @@
+import time
+import threading
+
+from Scheduler import Scheduler
+
+
+def test_hung_job_times_out_and_never_overlaps():
+    release = threading.Event()
+    running = []
+
+    def hung():
+        running.append(1)
+        assert len(running) == 1
+        release.wait(5)
+        running.pop()
+
+    ticks = []
+    scheduler = Scheduler()
+    scheduler.add_job('hung', hung, interval=0.02, timeout=0.1)
+    scheduler.add_job('other', lambda: ticks.append(1), interval=0.02, timeout=0.1)
+    scheduler.start()
+    time.sleep(0.4)
+    hung_job = scheduler.jobs['hung']
+    # timed out once, then skipped while the run is still going
+    assert hung_job.overruns == 1 and hung_job.skipped > 0 and hung_job.runs == 1
+    assert len(ticks) > 5
+
+    release.set()
+    time.sleep(0.2)
+    scheduler.stop()
+    assert hung_job.runs > 1 and hung_job.errors == 0
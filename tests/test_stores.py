@@ -0,0 +1,82 @@
+import sqlite3
+
+import Database
+from Checkpoints import Checkpoints
+from OrderManager import OrderManager
+from Users import UserRegistry
+
+
+def open_stores(path):
+    # same order as NostrBot.__init__
+    return UserRegistry(path, legacy_path=None), Checkpoints(path), OrderManager(path)
+
+
+def new_order(manager, order_id):
+    manager.new_order({'order_id': order_id, 'user': 'alice', 'amount': 1000, 'order_type': 'long', 'tp': 0,
+                       'leverage': 10, 'mode': 'dm'})
+
+
+def test_stores_start_on_empty_dir(tmp_path):
+    path = str(tmp_path / 'bot.sqlite')
+    users, checkpoints, manager = open_stores(path)
+    users.add('alice')
+    checkpoints.advance('metadata', 100)
+    new_order(manager, 'o1')
+    for store in (users, checkpoints, manager):
+        store.close()
+
+    users, checkpoints, manager = open_stores(path)
+    assert 'alice' in users
+    assert checkpoints.get('metadata') == 100
+    assert manager.get_order_status('o1') == 'new'
+    assert manager.db.pragma('user_version') == len(Database.MIGRATIONS)
+    for store in (users, checkpoints, manager):
+        store.close()
+
+
+def test_stores_migrate_legacy_orders_db(tmp_path):
+    path = str(tmp_path / 'bot.sqlite')
+    # orders table of a db made before migrations (user_version 0, no index)
+    manager = OrderManager(path)
+    manager.close()
+    conn = sqlite3.connect(path)
+    for name in ('order_deposit_id', 'order_status', 'order_lnm_id', 'order_user_status'):
+        conn.execute(f'DROP INDEX "{name}"')
+    conn.execute('ALTER TABLE "order" DROP COLUMN "created_at"')
+    conn.execute('PRAGMA user_version = 0')
+    conn.commit()
+    conn.close()
+
+    users, checkpoints, manager = open_stores(path)
+    indexes = {index.name for index in manager.db.get_indexes('order')}
+    assert {'order_deposit_id', 'order_status', 'order_lnm_id', 'order_user_status'} <= indexes
+    assert manager.db.pragma('user_version') == len(Database.MIGRATIONS)
+    new_order(manager, 'o1')
+    assert manager.get_order_status('o1') == 'new'
+    assert manager.get_order_by_id('o1').created_at is not None
+    for store in (users, checkpoints, manager):
+        store.close()
+
+
+def test_users_profile_at_migration(tmp_path):
+    path = str(tmp_path / 'bot.sqlite')
+    # users table before profiles were tracked, db at user_version 1
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE "user" ("id" INTEGER NOT NULL PRIMARY KEY, "pubkey" VARCHAR(255) NOT NULL, '
+                 '"first_seen" INTEGER NOT NULL, "last_activity" INTEGER NOT NULL, "lud16" VARCHAR(255), '
+                 '"events" INTEGER NOT NULL, "orders" INTEGER NOT NULL)')
+    conn.execute('CREATE UNIQUE INDEX "user_pubkey" ON "user" ("pubkey")')
+    conn.execute("INSERT INTO user VALUES (1, 'alice', 0, 0, 'alice@example.com', 0, 0)")
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    conn.close()
+
+    users = UserRegistry(path, legacy_path=None)
+    assert users.db.pragma('user_version') == len(Database.MIGRATIONS)
+    assert users.get_lud16('alice') == 'alice@example.com'
+    assert not users.has_profile('alice')
+    assert users.set_profile('alice', 'new@example.com', 10)
+    users.close()
+    users = UserRegistry(path, legacy_path=None)
+    assert users.has_profile('alice') and users.get_lud16('alice') == 'new@example.com'
+    users.close()